@@ -34,6 +34,20 @@ SOURCES = \
           qubesmanager/restore.py \
           qubesmanager/settings.py \
           qubesmanager/template_manager.py \
+          qubesmanager/update_orchestrator.py \
+          qubesmanager/run_command.py \
+          qubesmanager/table_export.py \
+          qubesmanager/stall_watchdog.py \
+          qubesmanager/artifact_cache.py \
+          qubesmanager/worker_pool.py \
+          qubesmanager/step_runner.py \
+          qubesmanager/installation_catalog.py \
+          qubesmanager/scratch_volume.py \
+          qubesmanager/tool_probe.py \
+          qubesmanager/transfer.py \
+          qubesmanager/vm_info.py \
+          qubesmanager/cache_loader.py \
+          qubesmanager/group_model.py \
           qubesmanager/ui_about.py \
           qubesmanager/ui_backupdlg.py \
           qubesmanager/ui_bootfromdevice.py \
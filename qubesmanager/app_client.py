@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+#
+"""Thin clients for the qubes-* tools.
+
+If the resident qubesmanager service (see app_server) is running, a tool
+only asks it to open the window and exits; otherwise it falls back to
+starting the tool in-process, as before. This module deliberately uses only
+the standard library, so that talking to the service does not pay for
+importing Qt or qubesadmin.
+"""
+
+import importlib
+import json
+import os
+import socket
+import sys
+import tempfile
+import time
+
+connect_timeout = 1  # in sec
+reply_timeout = 60  # in sec
+
+# set in the environment of the service, so that tools started by the
+# service itself (which then waits for them) do not ask it for a window
+service_env = 'QUBES_MANAGER_SERVICE'
+
+
+class ServiceError(Exception):
+    """The service refused to open the window"""
+
+
+def socket_path():
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(runtime_dir,
+                        'qubesmanager-{}.sock'.format(os.getuid()))
+
+
+def _is_debug():
+    # same as utils.is_debug, which cannot be used without importing Qt
+    return os.getenv('QUBES_MANAGER_DEBUG', '') not in ('', '0')
+
+
+def request_window(window, args=(), path=None):
+    """
+    Asks the service to open a window.
+    :param window: name of the window, e.g. 'vm-settings'
+    :param args: list of command line arguments for the window
+    :param path: path of the service socket; default socket_path()
+    :return: True if the window was opened, False if the service is not
+        running
+    :raises ServiceError: if the service could not open the window
+    """
+    if path is None:
+        path = socket_path()
+
+    start_time = time.monotonic()
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(connect_timeout)
+        try:
+            sock.connect(path)
+        except OSError:
+            return False
+
+        sock.settimeout(reply_timeout)
+        sock.sendall(json.dumps(
+            {'window': window, 'args': list(args)}).encode() + b'\n')
+
+        reply = b''
+        while not reply.endswith(b'\n'):
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            reply += chunk
+    except OSError as ex:
+        raise ServiceError(str(ex)) from ex
+    finally:
+        sock.close()
+
+    try:
+        reply = json.loads(reply.decode())
+    except ValueError as ex:
+        raise ServiceError('Invalid reply from qubesmanager service') from ex
+
+    if reply.get('status') != 'ok':
+        raise ServiceError(reply.get('error', 'Unknown error'))
+
+    if _is_debug():
+        print("{}: opened by the service in {:.0f} ms ({:.0f} ms in the "
+              "service, {})".format(
+                  window, (time.monotonic() - start_time) * 1000,
+                  reply.get('elapsed', 0),
+                  'cold' if reply.get('cold') else 'warm'))
+    return True
+
+
+def open_window(window, module, args=None):
+    """Opens the window through the service, or in-process with the main()
+    of the given module when the service is not running."""
+    if args is None:
+        args = sys.argv[1:]
+
+    if os.environ.get(service_env):
+        return importlib.import_module(module).main()
+
+    try:
+        if request_window(window, args):
+            return 0
+    except ServiceError as ex:
+        print("{}: {}".format(window, ex), file=sys.stderr)
+        return 1
+
+    return importlib.import_module(module).main()
+
+
+def qube_manager():
+    if '--dump' in sys.argv[1:]:
+        # headless, there is no window for the service to open
+        return importlib.import_module('qubesmanager.qube_manager').main()
+    return open_window('qube-manager', 'qubesmanager.qube_manager')
+
+
+def template_manager():
+    return open_window('template-manager', 'qubesmanager.template_manager')
+
+
+def global_settings():
+    return open_window('global-settings', 'qubesmanager.global_settings')
+
+
+def vm_settings():
+    return open_window('vm-settings', 'qubesmanager.settings')
+
+
+def vm_create():
+    return open_window('vm-create', 'qubesmanager.create_new_vm')
+
+
+def vm_clone():
+    return open_window('vm-clone', 'qubesmanager.clone_vm')
+
+
+def backup():
+    return open_window('backup', 'qubesmanager.backup')
+
+
+def restore():
+    return open_window('restore', 'qubesmanager.restore')
@@ -0,0 +1,287 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+#
+"""Resident qubesmanager service.
+
+Keeps a single Qt application, qubesadmin connection and events dispatcher
+around and opens the qubes-* tool windows on request of the thin clients
+from app_client, so that they do not have to start a new interpreter, Qt
+application and domain cache each time.
+"""
+
+import asyncio
+import importlib
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+import qasync
+import qubesadmin
+from qubesadmin import events
+from qubesadmin import exc
+
+# pylint: disable=import-error
+from PyQt5 import QtCore, QtNetwork, QtWidgets
+
+from . import app_client
+from . import stall_watchdog
+from . import utils
+
+logger = logging.getLogger('qubesmanager.app_server')
+
+
+class AppServer(QtCore.QObject):
+    """Listens on a local socket and opens windows requested by clients.
+    Each request is a single line of JSON: {"window": name, "args": [...]};
+    the reply is {"status": "ok", "elapsed": ms, "cold": bool} or
+    {"status": "error", "error": message}."""
+
+    # window name: (module, method creating the window)
+    windows = {
+        'qube-manager': ('qubesmanager.qube_manager', 'open_qube_manager'),
+        'template-manager': ('qubesmanager.template_manager',
+                             'open_template_manager'),
+        'global-settings': ('qubesmanager.global_settings',
+                            'open_global_settings'),
+        'vm-settings': ('qubesmanager.settings', 'open_vm_settings'),
+        'vm-create': ('qubesmanager.create_new_vm', 'open_vm_create'),
+        'vm-clone': ('qubesmanager.clone_vm', 'open_vm_clone'),
+        'backup': ('qubesmanager.backup', 'open_backup'),
+        'restore': ('qubesmanager.restore', 'open_restore'),
+    }
+
+    def __init__(self, qt_app, qubes_app, dispatcher, path=None):
+        super().__init__()
+        self.qt_app = qt_app
+        self.qubes_app = qubes_app
+        self.dispatcher = dispatcher
+        self.path = path or app_client.socket_path()
+
+        # window name: list of (cold, latency in ms)
+        self.latencies = {}
+        self.open_windows = []
+        self.manager_window = None
+
+        self.server = QtNetwork.QLocalServer(self)
+        self.server.setSocketOptions(QtNetwork.QLocalServer.UserAccessOption)
+        self.server.newConnection.connect(self.on_new_connection)
+
+    def listen(self):
+        """Starts listening; returns False if another instance of the
+        service is already running."""
+        try:
+            if app_client.request_window('ping', path=self.path):
+                return False
+        except app_client.ServiceError:
+            return False  # something answers there, but not as expected
+        QtNetwork.QLocalServer.removeServer(self.path)
+        return self.server.listen(self.path)
+
+    def close(self):
+        self.server.close()
+        QtNetwork.QLocalServer.removeServer(self.path)
+
+    def on_new_connection(self):
+        while self.server.hasPendingConnections():
+            connection = self.server.nextPendingConnection()
+            connection.setProperty('request', b'')
+            connection.readyRead.connect(
+                lambda conn=connection: self.on_ready_read(conn))
+            connection.disconnected.connect(connection.deleteLater)
+
+    def on_ready_read(self, connection):
+        data = connection.property('request') + connection.readAll().data()
+        if b'\n' not in data:
+            connection.setProperty('request', data)
+            return
+        connection.setProperty('request', b'')
+
+        try:
+            request = json.loads(data.split(b'\n', 1)[0].decode())
+            reply = self.handle_request(request.get('window'),
+                                        request.get('args', []))
+        except ValueError:
+            reply = {'status': 'error', 'error': 'Invalid request'}
+
+        connection.write(json.dumps(reply).encode() + b'\n')
+        connection.flush()
+        connection.disconnectFromServer()
+
+    def handle_request(self, window, args):
+        if window == 'ping':
+            return {'status': 'ok', 'elapsed': 0, 'cold': False}
+        if window not in self.windows:
+            return {'status': 'error',
+                    'error': 'Unknown window: {}'.format(window)}
+
+        module_name, method = self.windows[window]
+        cold = not utils.is_imported(module_name)
+        start_time = time.monotonic()
+        try:
+            module = importlib.import_module(module_name)
+            getattr(self, method)(module, args)
+        except SystemExit:
+            # argument parsing failed; the parser already printed why
+            return {'status': 'error',
+                    'error': 'Invalid arguments: {}'.format(' '.join(args))}
+        except (exc.QubesException, KeyError, ValueError) as ex:
+            return {'status': 'error', 'error': str(ex)}
+        except Exception as ex:  # pylint: disable=broad-except
+            # the client waits for a reply, whatever went wrong
+            logger.exception("opening %s failed", window)
+            return {'status': 'error',
+                    'error': '{}: {}'.format(type(ex).__name__, ex)}
+
+        elapsed = (time.monotonic() - start_time) * 1000
+        self.latencies.setdefault(window, []).append((cold, elapsed))
+        utils.debug("{}: opened in {:.0f} ms ({})".format(
+            window, elapsed, 'cold' if cold else 'warm'))
+        return {'status': 'ok', 'elapsed': elapsed, 'cold': cold}
+
+    def show_window(self, window, dispatcher=None):
+        window.setAttribute(QtCore.Qt.WA_DeleteOnClose)
+        self.open_windows.append(window)
+
+        def _closed():
+            self.open_windows.remove(window)
+            if dispatcher is not None:
+                dispatcher.remove_all_handlers()
+        window.destroyed.connect(_closed)
+
+        if hasattr(window, "setup_application"):
+            window.setup_application()
+        window.show()
+        window.raise_()
+        window.activateWindow()
+
+    def open_qube_manager(self, module, _args):
+        # there is only one manager window, kept around when closed
+        if self.manager_window is None:
+            self.manager_window = module.VmManagerWindow(
+                self.qt_app, self.qubes_app, self.dispatcher)
+            self.manager_window.setup_application()
+        self.manager_window.show()
+        self.manager_window.raise_()
+        self.manager_window.activateWindow()
+
+    def open_template_manager(self, module, _args):
+        dispatcher = utils.WindowDispatcher(self.dispatcher)
+        self.show_window(module.TemplateManagerWindow(
+            self.qt_app, self.qubes_app, dispatcher), dispatcher)
+
+    def open_global_settings(self, module, _args):
+        self.show_window(module.GlobalSettingsWindow(
+            self.qt_app, self.qubes_app))
+
+    def open_vm_settings(self, module, args):
+        args = module.parser.parse_args(args, app=self.qubes_app)
+        vm = args.domains.pop()
+        if vm.klass == 'AdminVM':
+            raise ValueError(
+                "This tool cannot be used to change properties of an "
+                "AdminVM ({}).".format(vm.name))
+        self.show_window(module.VMSettingsWindow(
+            vm, args.tab, self.qt_app, self.qubes_app))
+
+    def open_vm_create(self, module, args):
+        module.parser.parse_args(args, app=self.qubes_app)
+        self.show_window(module.NewVmDlg(self.qt_app, self.qubes_app))
+
+    def open_vm_clone(self, module, args):
+        args = module.parser.parse_args(args, app=self.qubes_app)
+        src_vm = args.domains.pop() if args.domains else None
+        self.show_window(module.CloneVMDlg(
+            self.qt_app, self.qubes_app, src_vm=src_vm))
+
+    def open_backup(self, module, _args):
+        dispatcher = utils.WindowDispatcher(self.dispatcher)
+        self.show_window(module.BackupVMsWindow(
+            self.qt_app, self.qubes_app, dispatcher), dispatcher)
+
+    def open_restore(self, module, _args):
+        self.show_window(module.RestoreVMsWindow(
+            self.qt_app, self.qubes_app))
+
+    def latency_report(self):
+        lines = []
+        for window, latencies in sorted(self.latencies.items()):
+            cold = [ms for is_cold, ms in latencies if is_cold]
+            warm = [ms for is_cold, ms in latencies if not is_cold]
+            line = "{}: opened {} times".format(window, len(latencies))
+            if cold:
+                line += ", cold {:.0f} ms".format(cold[0])
+            if warm:
+                line += ", warm median {:.0f} ms".format(
+                    statistics.median(warm))
+            lines.append(line)
+        return "\n".join(lines)
+
+
+def main():
+    qt_app = QtWidgets.QApplication(sys.argv)
+
+    translator = QtCore.QTranslator(qt_app)
+    locale = QtCore.QLocale.system().name()
+    i18n_dir = os.path.join(
+        os.path.dirname(os.path.realpath(__file__)),
+        'i18n')
+    translator.load("qubesmanager_{!s}.qm".format(locale), i18n_dir)
+    qt_app.installTranslator(translator)
+    QtCore.QCoreApplication.installTranslator(translator)
+
+    qt_app.setOrganizationName("The Qubes Project")
+    qt_app.setOrganizationDomain("http://qubes-os.org")
+    # the service keeps running when its windows are closed
+    qt_app.setQuitOnLastWindowClosed(False)
+
+    qubes_app = qubesadmin.Qubes()
+
+    loop = qasync.QEventLoop(qt_app)
+    asyncio.set_event_loop(loop)
+    dispatcher = events.EventsDispatcher(qubes_app)
+
+    os.environ[app_client.service_env] = str(os.getpid())
+
+    server = AppServer(qt_app, qubes_app, dispatcher)
+    if not server.listen():
+        print("qubesmanager service is already running or cannot listen "
+              "on {}".format(server.path), file=sys.stderr)
+        return 1
+    watchdog = stall_watchdog.start_from_env(qt_app)
+
+    try:
+        loop.run_until_complete(
+            asyncio.ensure_future(dispatcher.listen_for_events()))
+    except asyncio.CancelledError:
+        pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        stall_watchdog.stop_and_report(watchdog)
+        report = server.latency_report()
+        if report:
+            print(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+#
+"""Cache of files downloaded by the fancy manager installations.
+
+Files are stored by their sha256 (so a file downloaded from several URLs is
+kept once) and looked up by URL. The least recently used files are removed
+when the cache grows over its size budget. The installation scripts store
+downloaded files with `python3 -m qubesmanager.artifact_cache store URL FILE`.
+A cached file is hashed again by the installation before it is used, see
+verify_command; a corrupted one is removed with `remove URL`.
+"""
+
+import argparse
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shlex
+import sys
+import time
+
+# directory of the cache, e.g. one shared by several machines
+env_name = 'QUBES_FANCY_MANAGER_CACHE'
+DEFAULT_DIRECTORY = os.path.expanduser('~/.qubes-fancy-manager/artifacts')
+DEFAULT_MAX_SIZE = 16 * 1024 ** 3
+
+CHUNK_SIZE = 1024 ** 2
+
+
+class HashMismatch(ValueError):
+    """File does not have the expected sha256"""
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class ArtifactCache:
+    """Files by URL, stored by sha256, with a size budget"""
+    def __init__(self, directory=None, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory or os.getenv(env_name) or \
+            DEFAULT_DIRECTORY
+        self.max_size = max_size
+        self.objects_directory = os.path.join(self.directory, 'objects')
+        self.index_path = os.path.join(self.directory, 'index.json')
+
+    @contextlib.contextmanager
+    def _index(self, write=False):
+        """Yields the index (dict with 'urls': {url: sha256} and 'objects':
+        {sha256: {'size', 'last_used'}}), locked against other processes
+        and written back if write is True"""
+        os.makedirs(self.objects_directory, exist_ok=True)
+        with open(os.path.join(self.directory, 'lock'), 'w',
+                  encoding='utf-8') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+            try:
+                with open(self.index_path, encoding='utf-8') as file:
+                    index = json.load(file)
+            except (OSError, ValueError):
+                index = {}
+            index.setdefault('urls', {})
+            index.setdefault('objects', {})
+            yield index
+            if write:
+                tmp_path = self.index_path + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as file:
+                    json.dump(index, file)
+                os.replace(tmp_path, self.index_path)
+
+    def object_path(self, sha256):
+        return os.path.join(self.objects_directory, sha256)
+
+    def lookup(self, url, sha256=None):
+        """Returns path of the cached file downloaded from the URL, or None;
+        if sha256 is given, the cached file must have it. Only the size of
+        the file is checked, see verify_command."""
+        with self._index(write=True) as index:
+            cached_sha256 = index['urls'].get(url)
+            if cached_sha256 is None or \
+                    (sha256 is not None and sha256 != cached_sha256):
+                return None
+            info = index['objects'].get(cached_sha256)
+            path = self.object_path(cached_sha256)
+            try:
+                valid = info is not None and \
+                    os.path.getsize(path) == info['size']
+            except OSError:
+                valid = False
+            if not valid:
+                # removed or truncated behind our back
+                self._remove_object(index, cached_sha256)
+                return None
+            info['last_used'] = time.time()
+            return path
+
+    def store(self, url, path, sha256=None):
+        """
+        Copies the file downloaded from the URL into the cache, hashing it
+        on the way, and removes the least recently used files over budget.
+        :raises HashMismatch: if sha256 is given and the file does not
+            match it
+        :return: path of the cached file
+        """
+        os.makedirs(self.objects_directory, exist_ok=True)
+        tmp_path = os.path.join(
+            self.objects_directory, '.tmp-{}'.format(os.getpid()))
+        hasher = hashlib.sha256()
+        try:
+            with open(path, 'rb') as source, open(tmp_path, 'wb') as target:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    hasher.update(chunk)
+                    target.write(chunk)
+            digest = hasher.hexdigest()
+            if sha256 is not None and digest != sha256:
+                raise HashMismatch(
+                    "{} has sha256 {}, expected {}".format(
+                        url, digest, sha256))
+            size = os.path.getsize(tmp_path)
+            with self._index(write=True) as index:
+                os.replace(tmp_path, self.object_path(digest))
+                index['urls'][url] = digest
+                index['objects'][digest] = {'size': size,
+                                            'last_used': time.time()}
+                self._evict(index, keep=digest)
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp_path)
+        return self.object_path(digest)
+
+    def remove(self, url):
+        """Removes the file downloaded from the URL (e.g. a corrupted one)
+        from the cache"""
+        with self._index(write=True) as index:
+            sha256 = index['urls'].get(url)
+            if sha256 is not None:
+                self._remove_object(index, sha256)
+
+    def size(self):
+        with self._index() as index:
+            return sum(info['size'] for info in index['objects'].values())
+
+    def _remove_object(self, index, sha256):
+        index['objects'].pop(sha256, None)
+        for url in [url for url, url_sha256 in index['urls'].items()
+                    if url_sha256 == sha256]:
+            del index['urls'][url]
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.object_path(sha256))
+
+    def _evict(self, index, keep=None):
+        total = sum(info['size'] for info in index['objects'].values())
+        by_age = sorted(index['objects'].items(),
+                        key=lambda item: item[1]['last_used'])
+        for sha256, info in by_age:
+            if total <= self.max_size:
+                break
+            if sha256 == keep:
+                continue
+            self._remove_object(index, sha256)
+            total -= info['size']
+
+
+def store_command(url, path, sha256=None):
+    """Returns a shell command storing the downloaded file in the cache;
+    a failure to cache does not fail the installation"""
+    command = "python3 -m qubesmanager.artifact_cache store {} {}".format(
+        shlex.quote(url), shlex.quote(path))
+    if sha256:
+        command += " --sha256 {}".format(shlex.quote(sha256))
+    return command + " || true"
+
+
+def verify_command(cached_path):
+    """Returns a shell condition true if the cached file still has the
+    sha256 it is stored by"""
+    return "echo {}'  '{} | sha256sum -c --status".format(
+        shlex.quote(os.path.basename(cached_path)), shlex.quote(cached_path))
+
+
+def remove_command(url):
+    """Returns a shell command removing the file of the URL from the cache"""
+    return "python3 -m qubesmanager.artifact_cache remove {} || true".format(
+        shlex.quote(url))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Manage the cache of the fancy manager downloads")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    store_parser = subparsers.add_parser('store')
+    store_parser.add_argument('url')
+    store_parser.add_argument('path')
+    store_parser.add_argument('--sha256')
+    lookup_parser = subparsers.add_parser('lookup')
+    lookup_parser.add_argument('url')
+    lookup_parser.add_argument('--sha256')
+    remove_parser = subparsers.add_parser('remove')
+    remove_parser.add_argument('url')
+    args = parser.parse_args(args)
+
+    cache = ArtifactCache()
+    try:
+        if args.command == 'store':
+            print(cache.store(args.url, args.path, args.sha256))
+            return 0
+        if args.command == 'remove':
+            cache.remove(args.url)
+            return 0
+        path = cache.lookup(args.url, args.sha256)
+    except (OSError, HashMismatch) as ex:
+        print("artifact cache: {}".format(ex), file=sys.stderr)
+        return 1
+    if path is None:
+        return 1
+    print(path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+#
+"""Loading data of the qubes shown in the Qube Manager.
+
+All the qubes are loaded in chunks in a thread when the manager starts, and
+the changes are found out again after a reconnection to qubesd.
+"""
+
+import concurrent.futures
+import time
+
+from qubesadmin import exc
+
+# pylint: disable=import-error
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from . import utils as manager_utils
+from .vm_info import VmInfo
+
+
+class ResyncThread(QThread):
+    """After reconnecting to qubesd, finds out what changed in the meantime:
+    compares the freshly listed domains and their power states with the
+    cached ones and fetches all the properties only of new domains and of
+    those whose power state changed (together with running qubes based on
+    such templates)."""
+    def __init__(self, vms, states):
+        """
+        :param vms: domains listed after reconnecting, with power states
+            already fetched in bulk
+        :param states: {name: (power state, template name)} of the cached
+            domains
+        """
+        super().__init__()
+        self.vms = vms
+        self.states = states
+        self.added = []
+        self.changed = []
+        self.removed = []
+        self.msg = None
+
+    def run(self):
+        try:
+            names = {vm.name for vm in self.vms}
+            self.removed = [name for name in self.states
+                            if name not in names]
+
+            to_fetch = {}
+            for vm in self.vms:
+                if self.isInterruptionRequested():
+                    return
+                if vm.name not in self.states or \
+                        vm.get_power_state() != self.states[vm.name][0]:
+                    to_fetch[vm.name] = vm
+            # the outdated state of running qubes follows their template
+            for vm in self.vms:
+                power, template = self.states.get(vm.name, (None, None))
+                if power == 'Running' and template in to_fetch:
+                    to_fetch.setdefault(vm.name, vm)
+
+            # domains removed meanwhile are skipped by load_vm_infos
+            chunks = load_vm_infos(to_fetch.values())
+            try:
+                for chunk in chunks:
+                    if self.isInterruptionRequested():
+                        return
+                    for vm_info in chunk:
+                        if vm_info.name in self.states:
+                            self.changed.append(vm_info)
+                        else:
+                            self.added.append(vm_info)
+            finally:
+                chunks.close()
+        except exc.QubesException as ex:
+            self.msg = str(ex)
+
+        manager_utils.debug(
+            "resync: {} added, {} changed, {} removed of {} domains".format(
+                len(self.added), len(self.changed), len(self.removed),
+                len(self.states)))
+
+
+def load_vm_infos(vms, chunk_size=50, max_workers=1):
+    """
+    Loads VmInfo of the given domains, with updates-available of all of them
+    fetched at once beforehand. Domains that cannot be loaded (e.g. removed
+    in the meantime) are skipped.
+    :param chunk_size: number of domains loaded at once
+    :param max_workers: maximum number of domains loaded concurrently
+    :return: generator of lists of VmInfo, one for each chunk
+    """
+    vms = list(vms)
+    updates_available = manager_utils.get_feature_for_vms(
+        [vm for vm in vms if vm.klass in {'TemplateVM', 'StandaloneVM'}],
+        'updates-available', False)
+
+    def _load(vm):
+        try:
+            return VmInfo(vm, updates_available.get(vm.name, False))
+        except (exc.QubesException, KeyError):
+            return None
+
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, max_workers)) as executor:
+        for start in range(0, len(vms), chunk_size):
+            chunk = executor.map(_load, vms[start:start + chunk_size])
+            yield [vm_info for vm_info in chunk if vm_info is not None]
+
+
+class CacheLoaderThread(QThread):
+    """Loads VmInfo of the given domains in chunks, so that the window can
+    be shown with placeholders right away and filled in as data comes."""
+    chunk_loaded = pyqtSignal(list)
+    # domains loaded at once; each takes a few qubesd calls
+    chunk_size = 50
+
+    def __init__(self, vms):
+        super().__init__()
+        self.vms = vms
+        self.loaded = 0
+
+    def run(self):
+        start_time = time.monotonic()
+        chunks = load_vm_infos(self.vms, self.chunk_size)
+        try:
+            for chunk in chunks:
+                if self.isInterruptionRequested():
+                    return
+                if chunk:
+                    self.loaded += len(chunk)
+                    self.chunk_loaded.emit(chunk)
+        finally:
+            # waits only for the chunk being loaded
+            chunks.close()
+
+        manager_utils.debug("loaded {} of {} domains in {:.2f} s".format(
+            self.loaded, len(self.vms), time.monotonic() - start_time))
@@ -22,7 +22,6 @@
 
 import os
 import sys
-import subprocess
 
 from PyQt5 import QtCore, QtWidgets, QtGui  # pylint: disable=import-error
 
@@ -152,8 +151,9 @@ class CloneVMDlg(QtWidgets.QDialog, Ui_CloneVMDlg):
 
         if self.thread.msg_is_success:
             if self.launch_settings.isChecked():
-                subprocess.check_call(['qubes-vm-settings',
-                                       str(self.name.text())])
+                common_threads.get_process_launcher().open_vm_settings(
+                    self.qtapp, self.app, str(self.name.text()),
+                    self.parent())
 
 
 parser = qubesadmin.tools.QubesArgumentParser(vmname_nargs='?')
@@ -184,3 +184,5 @@ def main(args=None):
 
     dialog = CloneVMDlg(qtapp, args.app, src_vm=src_vm)
     dialog.exec_()
+    # settings of the new qube may still be open
+    common_threads.wait_for_processes()
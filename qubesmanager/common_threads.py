@@ -20,11 +20,16 @@
 #
 
 
+import functools
+import sys
+
 from PyQt5 import QtCore, QtWidgets  # pylint: disable=import-error
 from contextlib import contextmanager
 
 from qubesadmin import exc
 
+from . import utils
+
 
 @contextmanager
 def busy_cursor():
@@ -72,3 +77,141 @@ class CloneVMThread(QubesThread):
             self.msg_is_success = True
         except exc.QubesException as ex:
             self.msg = (self.tr("Error while cloning qube!"), str(ex))
+
+
+class ProcessLauncher(QtCore.QObject):
+    """Starts external programs (mostly other qubes-* tools) without waiting
+    for them. The children are kept until they exit and their exit status
+    is reported asynchronously through signals, so the event loop never
+    blocks on them."""
+    # program, exit code (-1 if it crashed or could not be started)
+    process_finished = QtCore.pyqtSignal(str, int)
+    # program, error message
+    process_failed = QtCore.pyqtSignal(str, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.processes = []
+        self.windows = []
+
+    def start(self, program, args=(), on_finished=None):
+        """
+        Starts the program and returns immediately.
+        :param program: program to run
+        :param args: list of its arguments
+        :param on_finished: optional callable, called with the exit code
+        :return: QProcess
+        """
+        process = QtCore.QProcess(self)
+        process.setProcessChannelMode(QtCore.QProcess.ForwardedChannels)
+        process.finished.connect(functools.partial(
+            self._process_finished, process, program, on_finished))
+        process.errorOccurred.connect(functools.partial(
+            self._process_error, process, program, on_finished))
+        self.processes.append(process)
+        utils.debug("starting {} {}".format(program, ' '.join(args)))
+        process.start(program, list(args))
+        return process
+
+    def open_tool(self, program, args=(), module=None, create_window=None,
+                  dispatcher=None):
+        """
+        Opens a qubes-* tool window: in-process, with create_window(module),
+        if the code of the tool is already imported; otherwise by starting
+        the program.
+        :param program: program to start
+        :param args: list of its arguments
+        :param module: full name of the module of the tool
+        :param create_window: callable taking the module and returning
+            the window
+        :param dispatcher: utils.WindowDispatcher used by the window, its
+            handlers are removed once the window is closed
+        :return: the window opened in-process or None
+        """
+        if module is not None and utils.is_imported(module):
+            window = create_window(sys.modules[module])
+            self.show_window(window, dispatcher)
+            return window
+        self.start(program, args)
+        return None
+
+    def open_vm_settings(self, qt_app, qubes_app, vm_name, parent=None):
+        return self.open_tool(
+            'qubes-vm-settings', [vm_name], module='qubesmanager.settings',
+            create_window=lambda module: module.VMSettingsWindow(
+                qubes_app.domains[vm_name], 'basic', qt_app, qubes_app,
+                parent))
+
+    def show_window(self, window, dispatcher=None):
+        window.setAttribute(QtCore.Qt.WA_DeleteOnClose)
+        self.windows.append(window)
+
+        def _closed():
+            self.windows.remove(window)
+            if dispatcher is not None:
+                dispatcher.remove_all_handlers()
+        window.destroyed.connect(_closed)
+
+        window.show()
+        window.raise_()
+        window.activateWindow()
+
+    def wait_for_finished(self):
+        """Waits for all children; to be called only when the application
+        is about to exit, as the children would be killed with it."""
+        for process in list(self.processes):
+            process.waitForFinished(-1)
+
+    def _forget(self, process):
+        if process in self.processes:
+            self.processes.remove(process)
+            process.deleteLater()
+
+    def _process_finished(self, process, program, on_finished,
+                          exit_code, exit_status):
+        # pylint: disable=too-many-arguments
+        self._forget(process)
+        if exit_status == QtCore.QProcess.CrashExit:
+            exit_code = -1
+            self._report_failure(program, self.tr("{} crashed.").format(
+                program))
+        elif exit_code != 0:
+            self._report_failure(
+                program, self.tr("{} exited with code {}.").format(
+                    program, exit_code))
+        self.process_finished.emit(program, exit_code)
+        if on_finished is not None:
+            on_finished(exit_code)
+
+    def _process_error(self, process, program, on_finished, error):
+        if error != QtCore.QProcess.FailedToStart:
+            return  # crashes are reported once the process finishes
+        self._forget(process)
+        self._report_failure(program, self.tr("{} could not be started: {}")
+                             .format(program, process.errorString()))
+        self.process_finished.emit(program, -1)
+        if on_finished is not None:
+            on_finished(-1)
+
+    def _report_failure(self, program, message):
+        print(message, file=sys.stderr)
+        self.process_failed.emit(program, message)
+
+
+_process_launcher = None
+
+
+def get_process_launcher():
+    """Returns the process launcher shared by all windows of the
+    application."""
+    global _process_launcher  # pylint: disable=global-statement
+    if _process_launcher is None:
+        _process_launcher = ProcessLauncher(
+            QtCore.QCoreApplication.instance())
+    return _process_launcher
+
+
+def wait_for_processes():
+    """Waits for the children started by the process launcher, if any."""
+    if _process_launcher is not None:
+        _process_launcher.wait_for_finished()
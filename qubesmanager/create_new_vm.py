@@ -23,7 +23,6 @@
 
 import os
 import sys
-import subprocess
 
 from PyQt5 import QtCore, QtWidgets, QtGui  # pylint: disable=import-error
 
@@ -31,6 +30,7 @@ import qubesadmin
 import qubesadmin.tools
 import qubesadmin.exc
 
+from . import common_threads
 from . import utils
 from . import bootfromdevice
 
@@ -241,8 +241,9 @@ class NewVmDlg(QtWidgets.QDialog, Ui_NewVMDlg):
 
         else:
             if self.launch_settings.isChecked():
-                subprocess.check_call(['qubes-vm-settings',
-                                       str(self.name.text())])
+                common_threads.get_process_launcher().open_vm_settings(
+                    self.qtapp, self.app, str(self.name.text()),
+                    self.parent())
             if self.install_system.isChecked():
                 qubesadmin.tools.qvm_start.main(
                         ['--cdrom', self.boot_dialog.cdrom_location,
@@ -337,3 +338,5 @@ def main(args=None):
 
     dialog = NewVmDlg(qtapp, args.app)
     dialog.exec_()
+    # settings of the new qube may still be open
+    common_threads.wait_for_processes()
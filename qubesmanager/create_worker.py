@@ -20,11 +20,15 @@
 # with this program; if not, see <http://www.gnu.org/licenses/>.
 #
 #
+import collections
+import glob
 import json
 import os
 import random
 import re
 import shelve
+import shlex
+import shutil
 import string
 import sys
 import subprocess
@@ -42,7 +46,14 @@ import qubesadmin.tools
 import qubesadmin.exc
 
 from . import utils
+from . import artifact_cache
 from . import bootfromdevice
+from . import installation_catalog
+from . import run_command
+from . import scratch_volume
+from . import step_runner
+from . import tool_probe
+from . import worker_pool as worker_pool_module
 from . import resources_rc
 
 from .ui_createworker import Ui_NewWorkerDlg  # pylint: disable=import-error
@@ -77,11 +88,26 @@ class CustomItemDelegate(QStyledItemDelegate):
             option.backgroundBrush = QBrush(QColor("black"))
 
 
-def get_step(script, run_on_fail):
-    return {
+def get_step(script, run_on_fail, name=None, after=None, check=None):
+    """
+    Returns a step of an installation, see step_runner.
+    :param run_on_fail: run the step even if an earlier step failed
+    :param name: name of the step, shown with its timing
+    :param after: names of the steps it has to wait for; None for the step
+        before it
+    :param check: shell condition true if what the step made is still
+        there; when resuming, a completed step is run again only if it fails
+    """
+    step = {
         "script": script,
-        "run_on_fail": run_on_fail
+        "run_on_fail": run_on_fail,
+        "name": name
     }
+    if after is not None:
+        step["after"] = list(after)
+    if check is not None:
+        step["check"] = check
+    return step
 
 
 class FancyManager:
@@ -89,41 +115,30 @@ class FancyManager:
     fancy_mount_path = os.path.join(fancy_directory, 'loop_device_backing_file.img')
     fancy_mount_point_path = os.path.join(fancy_directory, 'temp_mount')
     fancy_state_path = os.path.join(fancy_directory, 'state')
-
-    def __init__(self):
+    # tools found in the workers, written by the installation scripts
+    fancy_tools_path = os.path.join(fancy_directory, 'tools')
+    # where the installations keep their files in dom0
+    tmp_directory = '/tmp'
+    # a failed installation can be resumed for this long (in seconds)
+    run_max_age = 7 * 24 * 3600
+    # compression of files copied from the workers (see transfer), and its
+    # level (None for the default of the codec)
+    transfer_compression = 'auto'
+    transfer_level = None
+
+    def __init__(self, worker_pool=None):
         self.run_once_with_flag(self.add_in_options, 'installed_in_options')
         os.makedirs(self.fancy_directory, exist_ok=True)
+        self.artifact_cache = artifact_cache.ArtifactCache()
+        self.worker_pool = worker_pool or worker_pool_module.WorkerPool()
+        self.scratch_volume = scratch_volume.ScratchVolume(
+            self.fancy_mount_path, self.fancy_mount_point_path)
+        self.collect_runs()
+
+        self.unman_signing_key = "/etc/pki/rpm-gpg/RPM-GPG-KEY-unman"
 
-        unman_signing_key = "/etc/pki/rpm-gpg/RPM-GPG-KEY-unman"
-
-        self.available_installations = [
-            ("Linux templates", "separator"),
-            # ("qubes.3isec.org templates"),
-            ("qubes-template-archlinux-minimal-4.0.6-202301300342",
-             "qubes-template-archlinux-minimal-4.0.6-202301300342", "unman", "arch.png"),
-            ("qubes-template-blackarch-4.0.6-202302042136", "qubes-template-blackarch-4.0.6-202302042136", "unman",
-             "blackarch.png"),
-            ("qubes-template-bookworm-minimal-4.0.6-202210290334", "qubes-template-bookworm-minimal-4.0.6-202210290334",
-             "unman", "debian.png"),
-            ("qubes-template-debian-12-4.0.6-202301242054", "qubes-template-debian-12-4.0.6-202301242054", "unman",
-             "debian.png"),
-            ("qubes-template-focal-4.0.6-202208271536", "qubes-template-focal-4.0.6-202208271536", "unman",
-             "ubuntu.png"),
-            ("qubes-template-focal-minimal-4.0.6-202208260823", "qubes-template-focal-minimal-4.0.6-202208260823",
-             "unman", "ubuntu.png"),
-            ("qubes-template-jammy-4.0.6-202205012228", "qubes-template-jammy-4.0.6-202205012228", "unman",
-             "ubuntu.png"),
-            ("qubes-template-kali-4.0.6-202302232007", "qubes-template-kali-4.0.6-202302232007", "unman", "kali11.png"),
-            ("qubes-template-parrot-pwn-4.0.6-202301281509", "qubes-template-parrot-pwn-4.0.6-202301281509", "unman",
-             "parrot.png"),
-            ("qubes-template-parrot_full-4.0.6-202210290410", "qubes-template-parrot_full-4.0.6-202210290410", "unman",
-             "parrot.png"),
-            ("qubes-template-una-4.0.6-202205202253", "qubes-template-una-4.0.6-202205202253", "unman", "mint.png"),
-            ("Windows", "separator"),
-            ("win10x64-ltsc-eval", "win10x64-ltsc-eval", "windows", "win10x64-ltsc-eval.png"),
-            ("Unikernels", "separator"),
-            ("mirage-firewall", "mirage-firewall", "mirage", "mirage-firewall.png")
-        ]
+        self.catalog = installation_catalog.InstallationCatalog(
+            os.path.join(self.fancy_directory, 'catalog.json'))
 
     def run_once_with_flag(self, f , flag):
         with shelve.open(self.fancy_state_path) as db:
@@ -180,77 +195,29 @@ class FancyManager:
             print("This script should be executed in dom0.")
 
 
-    def temp_mount_wrap(self, script):
-        mount_size = "10G"
-        mount_script = f"""
-        
-        
-        # Set the file and mount point paths
-        backing_file={self.fancy_mount_path}
-        mount_point={self.fancy_mount_point_path}
-        
-        # Create a file as the backing store for the loop device
-        truncate -s {mount_size} "$backing_file"
-        
-        # Associate the backing file with a loop device
-        loop_device=$(losetup --find --show "$backing_file")
-        
-        # Create the ext4 filesystem on the loop device
-        mkfs.ext4 "$loop_device"
-        
-        # Create the mount point if it doesn't exist
-        mkdir -p "$mount_point"
-        
-        # Mount the loop device
-        mount "$loop_device" "$mount_point"
-        
-        
-        """
-
-        unmount_script = f"""
-               
-        # Unmount the loop device
-        umount "$mount_point"
-        
-        # Detach the loop device
-        losetup -d "$loop_device"
-        
-        # Remove the backing file
-        rm "$backing_file"
-        
-        echo "Unmounted and cleaned up."
-
-        """
-
-        return mount_script + script + unmount_script
-
-    def disp_wrap(self, disp_vm, run_id):
-
-        template_name = f"{run_id}_tmpl"
-        disposable_name = f"{run_id}_disp"
-
-        create_disposable = f"""
-        
-            # Create a template from the default disposable template
-            qvm-clone "{disp_vm}" "{template_name}"
-            qvm-volume extend "{template_name}:private" 10GiB || true
-            
-            # Create a disposable qube from the template
-            qvm-create --disp --template "{template_name}" "{disposable_name}"
-
-        """
-
-        remove_disposable = f"""
-        
-            # Wait for the disposable qube to shut down
-            qvm-shutdown --wait "{disposable_name}"
-            # Remove the disposable qube and template
-            qvm-remove -f "{disposable_name}"
-            
-        """
-
-
-        return [get_step(create_disposable, False), get_step(remove_disposable, True)], disposable_name
+    def scratch_wrap(self, run_id, size=scratch_volume.DEFAULT_SIZE):
+        """Returns steps mounting the scratch volume (with at least size
+        bytes) and cleaning up after the run, and the directory of the run
+        in it"""
+        mount = self.scratch_volume.mount_script(run_id, size)
+        cleanup = self.scratch_volume.cleanup_script(run_id)
+        return [get_step(mount, False, "mount scratch volume",
+                         check=self.scratch_volume.check_script(run_id)),
+                get_step(cleanup, True, "clean up scratch volume")], \
+            self.scratch_volume.run_directory(run_id)
+
+    def worker_wrap(self, disp_vm, run_id, paths=None):
+        """Leases a worker disposable to the run; returns its setup and
+        cleanup steps, and its name. Paths are the files the run leaves in
+        the worker, default the downloaded file."""
+        worker_name = self.worker_pool.acquire(run_id)
+        if paths is None:
+            paths = [f"/tmp/{run_id}"]
+        setup = self.worker_pool.setup_script(worker_name, disp_vm)
+        cleanup = self.worker_pool.cleanup_script(worker_name, paths)
+        return [get_step(setup, False, "prepare worker",
+                         check=self.worker_pool.check_script(worker_name)),
+                get_step(cleanup, True, "clean up worker")], worker_name
 
     def require_reboot(self):
         with shelve.open(self.fancy_state_path) as db:
@@ -258,13 +225,112 @@ class FancyManager:
                 return os.path.exists(f"/tmp/{db['require_reboot_tmp_file_id']}")
             return False
 
-    def get_installations(self):
-        return self.available_installations
+    @staticmethod
+    def _run_key(run_id):
+        return 'run:' + run_id
+
+    def start_run(self, run_id, installation_id, steps):
+        """Saves steps of the installation in the state, to be able to resume
+        it if it fails; see checkpoint and resume_run"""
+        with shelve.open(self.fancy_state_path) as state:
+            state[self._run_key(run_id)] = {
+                'run_id': run_id,
+                'installation_id': installation_id,
+                'steps': steps,
+                'completed': [],
+                'worker': self.worker_pool.leases.get(run_id),
+                'status': 'running',
+                'pid': os.getpid(),
+                'updated': time.time(),
+            }
+
+    def checkpoint(self, run_id, step_name):
+        """Records that the step of the run completed"""
+        with shelve.open(self.fancy_state_path) as state:
+            run = state.get(self._run_key(run_id))
+            if run is None:
+                return
+            if step_name not in run['completed']:
+                run['completed'].append(step_name)
+            run['updated'] = time.time()
+            state[self._run_key(run_id)] = run
+
+    def finish_run(self, run_id, exit_code):
+        """Forgets a run which succeeded, keeps a failed one for resuming"""
+        with shelve.open(self.fancy_state_path) as state:
+            run = state.get(self._run_key(run_id))
+            if run is None:
+                return
+            if exit_code == 0:
+                del state[self._run_key(run_id)]
+                self.remove_run_files(run_id)
+                return
+            run['status'] = 'failed'
+            run['updated'] = time.time()
+            state[self._run_key(run_id)] = run
+
+    @staticmethod
+    def _is_resumable(run):
+        if run['status'] == 'failed':
+            return True
+        # still marked running after the manager running it quit
+        if run['pid'] == os.getpid():
+            return False
+        try:
+            os.kill(run['pid'], 0)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            pass
+        return False
+
+    def failed_runs(self):
+        """Returns the runs that can be resumed, most recent first"""
+        with shelve.open(self.fancy_state_path) as state:
+            runs = [run for key, run in state.items()
+                    if key.startswith('run:')]
+        return sorted((run for run in runs if self._is_resumable(run)),
+                      key=lambda run: run['updated'], reverse=True)
+
+    def resume_run(self, run_id):
+        """Leases the worker the run used again; returns its steps and names
+        of its completed steps, or None if the worker is busy"""
+        with shelve.open(self.fancy_state_path) as state:
+            run = state[self._run_key(run_id)]
+            if run['worker'] is not None and \
+                    self.worker_pool.acquire(run_id, run['worker']) is None:
+                return None
+            run['status'] = 'running'
+            run['pid'] = os.getpid()
+            run['updated'] = time.time()
+            state[self._run_key(run_id)] = run
+        return run['steps'], run['completed']
+
+    def collect_runs(self):
+        """Forgets runs not resumed for run_max_age, removing their files"""
+        now = time.time()
+        with shelve.open(self.fancy_state_path) as state:
+            for key in [key for key in state.keys() if key.startswith('run:')]:
+                run = state[key]
+                if now - run['updated'] > self.run_max_age and \
+                        self._is_resumable(run):
+                    del state[key]
+                    self.remove_run_files(run['run_id'])
+
+    def remove_run_files(self, run_id):
+        # the downloaded file, possibly renamed to have a suffix
+        for path in glob.glob(os.path.join(self.tmp_directory, run_id + '*')):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        # or its directory in the scratch volume, if it is mounted
+        shutil.rmtree(self.scratch_volume.run_directory(run_id),
+                      ignore_errors=True)
 
     def get_installation_type(self, installation_id):
-        for inst in self.available_installations:
-            if inst[0] == installation_id:
-                return inst[2]
+        installation = self.catalog.get(installation_id)
+        return installation.type if installation is not None else None
 
     def get_install_script(self, installation_id, file_id, default_dispvm, name, netvm, label):
         if self.get_installation_type(installation_id) == "mirage":
@@ -275,12 +341,11 @@ class FancyManager:
             return self.unman_installation(installation_id, file_id, default_dispvm, name, netvm, label)
 
     def mirage_installation(self, installation_id, run_id, default_dispvm, name, netvm, label):
-        steps, disposable_name = self.disp_wrap(default_dispvm, run_id)
-        script = self.download_file(
-            "https://github.com/mirage/qubes-mirage-firewall/releases/download/v0.8.4/mirage-firewall.tar.bz2", run_id,
-            disposable_name)
-        script = script + self.get_mirage_installation(name, run_id, netvm, label)
-        return [steps[0], get_step(script, False), steps[1]]
+        download = self.catalog.get(installation_id)
+        installation = self.get_mirage_installation(name, run_id, netvm, label)
+        steps, cleanup = self.fetch_steps(
+            download, run_id, default_dispvm, ".tar.bz2")
+        return steps + [get_step(installation, False, "install"), cleanup]
 
     def windows_installation(self, installation_id, run_id, default_dispvm, name, netvm, label):
 
@@ -292,10 +357,12 @@ class FancyManager:
         w_net_vm = netvm
         w_packages = "firefox"
 
-        steps, disposable_name = self.disp_wrap(default_dispvm, run_id)
+        resources_dir = "/home/user/Documents/qvm-create-windows-qube"
+        steps, worker_name = self.worker_wrap(
+            default_dispvm, run_id, [resources_dir])
 
 
-        installation_prepare = """
+        header = """
         
         #!/bin/bash
         # Copyright (C) 2021 Elliot Killick <elliotkillick@zohomail.eu>
@@ -313,7 +380,10 @@ class FancyManager:
         BLUE='\033[0;34m'
         GREEN='\033[0;32m'
         NC='\033[0m'
+        """
 
+        # dom0 only, runs while the worker is being prepared
+        install_tools = header + """
         # Step 3
         if [ -f "/usr/lib/qubes/qubes-windows-tools.iso" ]; then
             echo -e "${BLUE}[i]${NC} Qubes Windows Tools is already installed in Dom0. Skipping download..." >&2
@@ -328,34 +398,28 @@ class FancyManager:
                 exit 1
             fi
         fi
+        """
 
+        install_dependencies = header + """
         echo -e "${BLUE}[i]${NC} Installing package dependencies on $template..." >&2
-        fedora_packages="genisoimage geteltorito datefudge"
-        debian_packages="genisoimage curl datefudge"
-        script='if grep -q '\''ID=fedora'\'' /etc/os-release; then
-          sudo dnf -y install '"$fedora_packages"'
-        elif grep -q '\''ID=debian'\'' /etc/os-release; then
-          sudo apt-get -y install '"$debian_packages"'
-        else
-          echo "Unsupported distribution."
-          exit 1
-        fi'
-        """ + f"""
-        qvm-run -p "{disposable_name}" "$script"
-        """ + """
+        """ + self.ensure_tools(
+            worker_name, ["genisoimage", "geteltorito", "datefudge", "curl"],
+            "genisoimage geteltorito datefudge", "genisoimage curl datefudge")
 
+        clone_repository = header + """
         echo -e "${BLUE}[i]${NC} Cloning qvm-create-windows-qube GitHub repository..." >&2
         """ + f"""
-        resources_dir="/home/user/Documents/qvm-create-windows-qube"
-        qvm-run -p "{disposable_name}" "cd {"${resources_dir%/*}"} && git clone --branch {repo_branch} {repo}"
+        resources_dir="{resources_dir}"
+        qvm-run -p "{worker_name}" "rm -rf '$resources_dir'"
+        qvm-run -p "{worker_name}" "cd {"${resources_dir%/*}"} && git clone --branch {repo_branch} {repo}"
         
         """ + """
 
         echo -e "${BLUE}[i]${NC} Please check for a \"Good signature\" from GPG (Verify it out-of-band if necessary)..." >&2
         """ + f"""
-        qvm-run -p "{disposable_name}" "cd '$resources_dir' && gpg --import author.asc && git verify-commit \$(git rev-list --max-parents=0 HEAD)"
+        qvm-run -p "{worker_name}" "cd '$resources_dir' && gpg --import author.asc && git verify-commit \$(git rev-list --max-parents=0 HEAD)"
 
-        qvm-run -p --filter-escape-chars --no-color-output "{disposable_name}" "cat '$resources_dir/qvm-create-windows-qube'" | sudo tee /usr/bin/qvm-create-windows-qube > /dev/null
+        qvm-run -p --filter-escape-chars --no-color-output "{worker_name}" "cat '$resources_dir/qvm-create-windows-qube'" | sudo tee /usr/bin/qvm-create-windows-qube > /dev/null
 
         # Allow execution of script
         sudo chmod +x /usr/bin/qvm-create-windows-qube
@@ -364,34 +428,153 @@ class FancyManager:
         echo -e "${GREEN}[+]${NC} Installation complete!"
 
 
-        """ + f"""
+        """
+
+        iso_path = shlex.quote(
+            f"{resources_dir}/windows-media/isos/{w_inst}.iso")
+        download_command = shlex.quote(
+            f"cd {shlex.quote(resources_dir + '/windows-media/isos')} && "
+            f"./download-windows.sh {shlex.quote(w_inst)}")
+        download_windows = header + f"""
 
-                qvm-run -p "{disposable_name}" "cd '$resources_dir'/windows-media/isos && ./download-windows.sh '{w_inst}'"
+                qvm-run -p "{worker_name}" {download_command}
+                """
+
+        create_qube = header + f"""
                 echo "START WINDOWS INSTALLATION"
-                qvm-create-windows-qube --resources-qube "{disposable_name}" -n {w_net_vm} -oyp {w_packages} -i {w_inst}.iso -a {w_inst}.xml {w_name}
+                qvm-create-windows-qube --resources-qube "{worker_name}" \\
+                    -n {shlex.quote(w_net_vm)} -oyp {w_packages} \\
+                    -i {shlex.quote(w_inst + '.iso')} \\
+                    -a {shlex.quote(w_inst + '.xml')} {shlex.quote(w_name)}
                 
                 
                 """
 
-        return [steps[0], get_step(installation_prepare, False) , steps[1]]
+        # the checks let a resumed installation reuse the worker, unless it
+        # was shut down (which discards its files) in the meantime
+        return [steps[0],
+                get_step(install_tools, False, "install windows tools",
+                         after=[],
+                         check="[ -f /usr/lib/qubes/qubes-windows-tools.iso ]"),
+                get_step(install_dependencies, False, "install dependencies",
+                         after=["prepare worker"],
+                         check=f"qvm-run -q {worker_name} "
+                               f"'command -v genisoimage'"),
+                get_step(clone_repository, False, "clone repository",
+                         check=f"qvm-run -q {worker_name} "
+                               f"\"test -d '{resources_dir}/.git'\" && "
+                               f"[ -x /usr/bin/qvm-create-windows-qube ]"),
+                get_step(download_windows, False, "download windows",
+                         check=f"qvm-run -q {worker_name} "
+                               f"{shlex.quote('test -s ' + iso_path)}"),
+                get_step(create_qube, False, "install",
+                         after=["download windows", "install windows tools"]),
+                steps[1]]
 
     def unman_installation(self, installation_id, run_id, default_dispvm, name, netvm, label):
-        steps, disposable_name = self.disp_wrap(default_dispvm, run_id)
-        script = self.download_file(
-            f"https://qubes.3isec.org/Templates_4.1/{installation_id}.noarch.rpm", run_id,
-            default_dispvm)
-        script = script + self.get_unman_installation(name, run_id, netvm, label)
-        return [steps[0], get_step(script, False), steps[1]]
-
-    def download_file(self, download_url, destination_id, vm_name):
+        download = self.catalog.get(installation_id)
+        # templates are too big for /tmp, which is in memory
+        scratch_steps, directory = self.scratch_wrap(run_id)
+        installation = self.get_unman_installation(
+            name, run_id, netvm, label, directory)
+        steps, cleanup = self.fetch_steps(
+            download, run_id, default_dispvm, ".rpm", directory)
+        return [scratch_steps[0]] + steps + [
+            get_step(installation, False, "install"),
+            scratch_steps[1],
+            cleanup]
+
+    def fetch_steps(self, download, run_id, default_dispvm, suffix,
+                    directory='/tmp'):
+        """Returns steps getting the file of the catalog Installation to
+        directory/run_id, and the step cleaning up after them. A cached file
+        is verified and copied; the worker is then neither started nor
+        cleaned up, unless the cached file turns out to be corrupted."""
+        steps, worker_name = self.worker_wrap(default_dispvm, run_id)
+        download_step = self.download_step(
+            download, run_id, worker_name, suffix, directory)
+        cached_path = self.artifact_cache.lookup(download.url, download.sha256)
+        if not cached_path:
+            return [steps[0], download_step], steps[1]
+
+        # the worker steps do nothing if the cached file was copied
+        for step in (steps[0], download_step):
+            step['script'] = "if {}; then echo 'cached file used'; " \
+                "exit 0; fi\n{}".format(download_step['check'], step['script'])
+        copy = get_step(
+            self.copy_cached_file(cached_path, download.url, run_id,
+                                  directory),
+            False, "copy cached file")
+        return [copy, steps[0], download_step], steps[1]
+
+    def download_file(self, download_url, destination_id, vm_name, sha256=None,
+                      directory='/tmp'):
+        # the URL and hash come from the catalog, see installation_catalog
+        path = shlex.quote(os.path.join(directory, destination_id))
+        wget = f"wget --progress=bar:force --show-progress " \
+            f"-O /tmp/{destination_id} {shlex.quote(download_url)}"
+        transfer = f"python3 -m qubesmanager.transfer {vm_name} " \
+            f"/tmp/{destination_id} {path}"
+        if sha256:
+            transfer += f" --sha256 {shlex.quote(sha256)}"
+        transfer += f" --compress {self.transfer_compression}"
+        if self.transfer_level is not None:
+            transfer += f" --level {self.transfer_level}"
+        store = artifact_cache.store_command(
+            download_url, os.path.join(directory, destination_id), sha256)
         return f"""
-        echo "start download {download_url}"
-        qvm-run -p {vm_name} "if grep -q 'ID=fedora' /etc/os-release; then sudo dnf -y install wget; elif grep -q 'ID=debian' /etc/os-release; then sudo apt-get -y install wget; else echo 'Unsupported distribution.'; exit 1; fi"
-        qvm-run -p {vm_name} 'wget --progress=bar:force --show-progress -O /tmp/{destination_id} {download_url}'
+        echo start download {shlex.quote(download_url)}
+        {self.ensure_tools(vm_name, ["wget"], "wget", "wget")}
+        qvm-run -p {vm_name} {shlex.quote(wget)}
+        download_status=$?
         echo "downloaded"
         echo "copy to dom0"
-        qvm-run -p {vm_name} 'cat /tmp/{destination_id} ' > /tmp/{destination_id}
-        echo "copied to dom0 /tmp/{destination_id}"
+        # verified while copied, a wrong file is not kept
+        {transfer} || exit 1
+        echo "copied to dom0 "{path}
+        # only complete downloads are cached
+        [ "$download_status" -eq 0 ] && {store}
+        """
+
+    def ensure_tools(self, vm_name, tools, fedora_packages, debian_packages):
+        """Returns a shell command installing the packages in the worker,
+        unless its template is known to have the tools (see tool_probe)"""
+        install = f"""if grep -q 'ID=fedora' /etc/os-release; then
+          sudo dnf -y install {fedora_packages}
+        elif grep -q 'ID=debian' /etc/os-release; then
+          sudo apt-get -y install {debian_packages}
+        else
+          echo 'Unsupported distribution.'
+          exit 1
+        fi"""
+        return tool_probe.ensure_command(
+            vm_name, tools, install, self.fancy_tools_path)
+
+    def download_step(self, download, destination_id, vm_name, suffix,
+                      directory='/tmp'):
+        """Returns step downloading the file of the catalog Installation to
+        directory/destination_id; the installation renames it to have the
+        suffix"""
+        path = shlex.quote(os.path.join(directory, destination_id))
+        return get_step(
+            self.download_file(download.url, destination_id, vm_name,
+                               download.sha256, directory),
+            False, "download",
+            check=f"[ -s {path} ] || [ -s {path}{suffix} ]")
+
+    @staticmethod
+    def copy_cached_file(cached_path, url, destination_id, directory='/tmp'):
+        """Returns a script copying the cached file, if it is not corrupted;
+        a corrupted one is removed from the cache and not copied"""
+        path = shlex.quote(os.path.join(directory, destination_id))
+        return f"""
+        echo "using cached {cached_path}"
+        if {artifact_cache.verify_command(cached_path)}; then
+            cp --reflink=auto {shlex.quote(cached_path)} {path}
+        else
+            echo "cached file is corrupted, downloading it again"
+            {artifact_cache.remove_command(url)}
+        fi
         """
 
     def get_mirage_installation(self, name, file_id, netvm, label):
@@ -399,8 +582,10 @@ class FancyManager:
                 
                 echo "START EXTRACTION"
                 # ensure bzip2 is installed
-                sudo dnf install bzip2 bzip2-libs
-                mv /tmp/{file_id} /tmp/{file_id}.tar.bz2
+                command -v bzip2 >/dev/null || sudo dnf install bzip2 bzip2-libs
+                # already renamed, if resumed
+                [ -e /tmp/{file_id} ] && \\
+                    mv /tmp/{file_id} /tmp/{file_id}.tar.bz2
                 tar jxf /tmp/{file_id}.tar.bz2 -C /tmp
                 echo "FINISH EXTRACTION"
                 echo "START MIRAGE INSTALLATION"
@@ -425,11 +610,14 @@ class FancyManager:
 
                 """
 
-    def get_unman_installation(self, name, file_id, netvm, label):
+    def get_unman_installation(self, name, file_id, netvm, label,
+                               directory='/tmp'):
+        path = shlex.quote(os.path.join(directory, file_id))
         return f"""
         echo "start to install"
-        mv /tmp/{file_id} /tmp/{file_id}.rpm
-        qvm-template --keyring /etc/pki/rpm-gpg/RPM-GPG-KEY-unman install /tmp/{file_id}.rpm
+        # already renamed, if resumed
+        [ -e {path} ] && mv {path} {path}.rpm
+        qvm-template --keyring {self.unman_signing_key} install {path}.rpm
         echo "install finished"
         # """
 
@@ -437,13 +625,18 @@ class FancyManager:
         unman_key_url = "https://raw.githubusercontent.com/unman/unman/master/unman.pub"
         tmp_file_name = random_string(10)
 
-        script = self.download_file(unman_key_url, tmp_file_name, worker_vm)
+        cached_path = self.artifact_cache.lookup(unman_key_url)
+        if cached_path:
+            script = self.copy_cached_file(
+                cached_path, unman_key_url, tmp_file_name)
+        else:
+            script = self.download_file(unman_key_url, tmp_file_name, worker_vm)
 
         script = script + f"""
-        qvm-run -p {worker_vm} 'cat /tmp/{tmp_file_name} ' > /tmp/{tmp_file_name}
         sudo mv /tmp/{tmp_file_name} {self.unman_signing_key}
         sudo rpm --import {self.unman_signing_key}
         """
+        return script
 
 
 def random_string(length):
@@ -451,59 +644,173 @@ def random_string(length):
     return result
 
 
+# lines of output kept by the live output dialog
+TERMINAL_MAX_LINES = 10000
+# longer output without a newline is broken into lines
+MAX_LINE_LENGTH = 64 * 1024
+# the live output is repainted at most this many times a second
+MAX_FPS = 10
+
+ESCAPE_SEQUENCE = re.compile(r'\x1b\[[0-9;?]*[ -/]*[@-~]')
+LINE_CONTROL = re.compile(r'([\r\n])')
+
+
+class TerminalBuffer(run_command.OutputBuffer):
+    """Output buffer treating carriage returns (used by progress bars) like
+    a terminal does: the text after one overwrites the line from its start.
+    Output can come split anywhere, even inside a \\r\\n or an escape
+    sequence; escape sequences (colors) are removed."""
+    def __init__(self, max_lines=TERMINAL_MAX_LINES):
+        super().__init__(max_lines)
+        # cursor position in the unfinished last line
+        self.column = 0
+        # start of an escape sequence finished by the next output
+        self.escape = ''
+
+    def append(self, text):
+        text = self.escape + text
+        self.escape = ''
+        start = text.rfind('\x1b')
+        if start != -1 and len(text) - start < 32 and \
+                not ESCAPE_SEQUENCE.match(text, start):
+            text, self.escape = text[:start], text[start:]
+        text = ESCAPE_SEQUENCE.sub('', text)
+
+        lines = []
+        for part in LINE_CONTROL.split(text):
+            if part == '\n':
+                lines.append(self.partial)
+                self.partial = ''
+                self.column = 0
+            elif part == '\r':
+                self.column = 0
+            elif part:
+                self.partial = self.partial[:self.column] + part + \
+                    self.partial[self.column + len(part):]
+                self.column += len(part)
+                if len(self.partial) > MAX_LINE_LENGTH:
+                    lines.append(self.partial)
+                    self.partial = ''
+                    self.column = 0
+        self.add_lines(lines)
+        return lines
+
+    def flush(self):
+        self.column = 0
+        return super().flush()
+
+
 class LiveShellDialog(QtWidgets.QDialog):
+    """Shows output of the installation steps as a terminal would, with
+    bounded scrollback, repainted at most MAX_FPS times a second however
+    fast the output comes"""
+    # run id, exit code
+    script_finished = pyqtSignal(str, int)
+    # run id, step name
+    step_succeeded = pyqtSignal(str, str)
+
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.liveShell = QtWidgets.QTextEdit(self)
+        self.run_id = None
+        self.liveShell = QtWidgets.QPlainTextEdit(self)
         self.liveShell.setReadOnly(True)
+        self.liveShell.setUndoRedoEnabled(False)
+        self.liveShell.setMaximumBlockCount(TERMINAL_MAX_LINES)
+        self.liveShell.setFont(QtGui.QFontDatabase.systemFont(
+            QtGui.QFontDatabase.FixedFont))
 
-        # Set the default size of the QTextEdit widget
+        # Set the default size of the output widget
         self.liveShell.setMinimumSize(800, 600)
 
         self.layout = QtWidgets.QVBoxLayout(self)
         self.layout.addWidget(self.liveShell)
 
-        self.process = QtCore.QProcess(self)
-        self.process.setProcessChannelMode(QtCore.QProcess.MergedChannels)
-        self.process.readyRead.connect(self.on_ready_read)
-        self.process.finished.connect(self.on_finished)
-
-    def on_ready_read(self):
-        text = self.process.readAll().data().decode()
-        self.liveShell.moveCursor(QtGui.QTextCursor.End)
-
-        # Check if the output is a progress bar update
-        if text.startswith('\r'):
-            # Move the cursor one line up and to the beginning of the line
-            cursor = self.liveShell.textCursor()
-            cursor.movePosition(QtGui.QTextCursor.Up, QtGui.QTextCursor.MoveAnchor)
-            cursor.movePosition(QtGui.QTextCursor.StartOfLine, QtGui.QTextCursor.MoveAnchor)
-            self.liveShell.setTextCursor(cursor)
-
-            # Remove the current progress line
-            cursor = self.liveShell.textCursor()
-            cursor.select(QtGui.QTextCursor.LineUnderCursor)
-            cursor.removeSelectedText()
-            self.liveShell.setTextCursor(cursor)
-
-            # Insert the new progress text
-            self.liveShell.insertPlainText(text.lstrip('\r'))
-
-        else:
-            self.liveShell.insertPlainText(text)
+        self.buffer = TerminalBuffer()
+        # lines completed since the last repaint; the last block of the
+        # widget is always the unfinished last line
+        self.new_lines = collections.deque(maxlen=TERMINAL_MAX_LINES)
+        self.repaint_count = 0
+        self.repaint_timer = QtCore.QTimer(self)
+        self.repaint_timer.setSingleShot(True)
+        self.repaint_timer.setInterval(1000 // MAX_FPS)
+        self.repaint_timer.timeout.connect(self.repaint_output)
+
+        self.runner = None
+        # closed while the steps ran: closes once the cleanup steps ended
+        self.aborting = False
+
+    def reject(self):
+        if self.runner is not None and self.runner.is_running():
+            if not self.aborting:
+                self.aborting = True
+                self.add_line("Aborting, waiting for the cleanup steps...")
+                self.runner.abort()
+            return
+        super().reject()
+
+    def on_output(self, text):
+        self.new_lines.extend(self.buffer.append(text))
+        if not self.repaint_timer.isActive():
+            self.repaint_timer.start()
+
+    def add_line(self, line):
+        """Adds a line of the dialog itself, not output of the steps"""
+        self.new_lines.extend(self.buffer.flush())
+        self.buffer.add_lines([line])
+        self.new_lines.append(line)
+        if not self.repaint_timer.isActive():
+            self.repaint_timer.start()
+
+    def repaint_output(self):
+        self.repaint_timer.stop()
+        scrollbar = self.liveShell.verticalScrollBar()
+        at_bottom = scrollbar.value() == scrollbar.maximum()
+
+        # replace the unfinished line with the new lines and the
+        # unfinished line now, in a single edit
+        cursor = QtGui.QTextCursor(self.liveShell.document())
+        cursor.movePosition(QtGui.QTextCursor.End)
+        cursor.movePosition(QtGui.QTextCursor.StartOfBlock,
+                            QtGui.QTextCursor.KeepAnchor)
+        self.new_lines.append(self.buffer.partial)
+        cursor.insertText("\n".join(self.new_lines))
+        self.new_lines.clear()
+        self.repaint_count += 1
+
+        if at_bottom:
+            scrollbar.setValue(scrollbar.maximum())
+
+    def on_step_started(self, index):
+        self.add_line(f"== {self.runner.records[index].name} ==")
+
+    def on_step_finished(self, index, exit_code):
+        record = self.runner.records[index]
+        # cleanup steps run again when resuming
+        if exit_code == 0 and not record.run_on_fail:
+            self.step_succeeded.emit(self.run_id or "", record.name)
 
     def on_finished(self, exit_code):
-        self.process.close()
-        self.liveShell.append(f"Process finished with exit code {exit_code}.")
-
-    def run_script(self, scripts):
-        if not isinstance(scripts, str): # some of installations send string TODO ;
-            sc = ""
-            for script in scripts:
-                sc = sc + script["script"]
-            scripts = sc
-        print(scripts)
-        self.process.start("bash", ["-c", scripts])
+        for line in step_runner.format_timings(
+                self.runner.records).splitlines():
+            self.add_line(line)
+        self.add_line(f"Process finished with exit code {exit_code}.")
+        self.repaint_output()
+        self.script_finished.emit(self.run_id or "", exit_code)
+        if self.aborting:
+            self.done(0)
+
+    def run_script(self, scripts, run_id=None, completed=()):
+        """Runs the steps; completed are names of the steps a resumed run
+        completed before"""
+        self.run_id = run_id
+        if isinstance(scripts, str):
+            scripts = [get_step(scripts, False)]
+        self.runner = step_runner.StepRunner(run_id, parent=self)
+        self.runner.output.connect(self.on_output)
+        self.runner.step_started.connect(self.on_step_started)
+        self.runner.step_finished.connect(self.on_step_finished)
+        self.runner.finished.connect(self.on_finished)
+        self.runner.start(scripts, completed)
 
 class Process(QObject):
     finished = pyqtSignal()
@@ -571,14 +878,20 @@ class CreateVMThread(QtCore.QThread):
 
 
 class NewWorkerDlg(QtWidgets.QDialog, Ui_NewWorkerDlg):
-    def __init__(self, qtapp, app, parent=None):
+    def __init__(self, qtapp, app, parent=None, worker_pool=None):
+        """
+        :param worker_pool: WorkerPool to download in; pass one that outlives
+            the dialog, so that its workers are reused by later installations
+        """
         super().__init__(parent)
         self.setupUi(self)
 
         self.qtapp = qtapp
         self.app = app
 
-        self.fancy = FancyManager()
+        if worker_pool is None:
+            worker_pool = worker_pool_module.WorkerPool(app, parent=self)
+        self.fancy = FancyManager(worker_pool)
 
         self.thread = None
         self.progress = None
@@ -636,23 +949,10 @@ class NewWorkerDlg(QtWidgets.QDialog, Ui_NewWorkerDlg):
                 self.tr('No template available!'),
                 self.tr('Cannot create a qube when no template exists.'))
 
-        type_list = []
-        installations = self.fancy.get_installations()
-        for inst in self.fancy.get_installations():
-            type_list.append((self.tr(inst[0]), inst[1]))
-
-        utils.initialize_widget(widget=self.installlation,
-                                choices=type_list,
-                                selected_value="please chose installation",
-                                add_current_label=False)
-
         # flag to remove "please chose installation" from options ONCE
         self.initial_option_item_removed = False
+        self.populate_installations()
 
-        for index, value in enumerate(installations):
-            if value[1] == "separator":
-                self.installlation.model().item(index).setEnabled(False)
-                # self.installlation.insertSeparator(index)
         self.installlation.setItemDelegate(CustomItemDelegate(self.installlation))
         # Load the image and set it to the QLabel
         # pixmap = QtGui.QPixmap(':/')
@@ -675,6 +975,63 @@ class NewWorkerDlg(QtWidgets.QDialog, Ui_NewWorkerDlg):
         self.netvm.setHidden(True)
         self.launch_settings.setHidden(True)
 
+        self.resume_button = self.buttonBox.addButton(
+            self.tr("Resume failed installation..."),
+            QtWidgets.QDialogButtonBox.ActionRole)
+        self.resume_button.clicked.connect(self.resume_installation)
+        self.resume_button.setEnabled(bool(self.fancy.failed_runs()))
+
+        self.catalog_thread = None
+        self.refresh_catalog()
+
+
+    def populate_installations(self):
+        """Fills the installations from the catalog, with a separator
+        before each group of them"""
+        type_list = []
+        for group, installations in self.fancy.catalog.groups():
+            type_list.append((self.tr(group), "separator"))
+            for installation in installations:
+                type_list.append((installation.name, installation.id))
+
+        self.installlation.blockSignals(True)
+        utils.initialize_widget(widget=self.installlation,
+                                choices=type_list,
+                                selected_value="please chose installation",
+                                add_current_label=False)
+        self.installlation.blockSignals(False)
+
+        for index, (_name, value) in enumerate(type_list):
+            if value == "separator":
+                self.installlation.model().item(index).setEnabled(False)
+
+    def refresh_catalog(self):
+        """Fetches the catalog in the background, if it is configured and
+        the cached one is old"""
+        url = QtCore.QSettings().value(installation_catalog.URL_KEY, '')
+        dispvm = getattr(self.app, 'default_dispvm', None)
+        if not url or dispvm is None or not self.fancy.catalog.is_stale():
+            return
+        self.catalog_thread = installation_catalog.CatalogRefreshThread(
+            installation_catalog.fetch_command(url, dispvm))
+        self.catalog_thread.finished.connect(self.catalog_refreshed)
+        self.catalog_thread.start()
+
+    def catalog_refreshed(self):
+        if self.catalog_thread.data is None:
+            # the cached (or builtin) catalog stays in use
+            print("Cannot refresh the installation catalog: {}".format(
+                self.catalog_thread.msg), file=sys.stderr)
+            return
+        try:
+            self.fancy.catalog.update(self.catalog_thread.data)
+        except (OSError, installation_catalog.InvalidCatalog) as ex:
+            print("Cannot save the installation catalog: {}".format(ex),
+                  file=sys.stderr)
+        # once an installation is chosen, the new catalog waits for the
+        # next time the dialog opens
+        if not self.initial_option_item_removed:
+            self.populate_installations()
 
     def accept(self):
 
@@ -689,11 +1046,8 @@ class NewWorkerDlg(QtWidgets.QDialog, Ui_NewWorkerDlg):
         scripts = self.fancy.get_install_script(self.installlation.currentData(), file_id, self.app.default_dispvm, name,
                                                netvm,
                                                label)
-        self.live_shell_dialog = LiveShellDialog(parent=self)
-        self.live_shell_dialog.setWindowTitle("Live Output")
-
-        self.live_shell_dialog.show()
-        self.live_shell_dialog.run_script(scripts)
+        self.fancy.start_run(file_id, self.installlation.currentData(), scripts)
+        self.run_installation(file_id, scripts)
 
         return
 
@@ -753,6 +1107,55 @@ class NewWorkerDlg(QtWidgets.QDialog, Ui_NewWorkerDlg):
         self.progress.setModal(True)
         self.progress.show()
 
+    def run_installation(self, run_id, steps, completed=()):
+        self.live_shell_dialog = LiveShellDialog(parent=self)
+        self.live_shell_dialog.setWindowTitle("Live Output")
+
+        self.live_shell_dialog.step_succeeded.connect(self.fancy.checkpoint)
+        self.live_shell_dialog.script_finished.connect(
+            self.installation_finished)
+
+        self.live_shell_dialog.show()
+        self.live_shell_dialog.run_script(steps, run_id, completed)
+
+    def resume_installation(self):
+        runs = self.fancy.failed_runs()
+        if not runs:
+            self.resume_button.setEnabled(False)
+            return
+        run = runs[0]
+        if len(runs) > 1:
+            descriptions = [
+                self.tr("{} (failed {}, {} steps done)").format(
+                    run['installation_id'],
+                    time.strftime('%Y-%m-%d %H:%M',
+                                  time.localtime(run['updated'])),
+                    len(run['completed']))
+                for run in runs]
+            description, ok = QtWidgets.QInputDialog.getItem(
+                self, self.tr("Resume installation"),
+                self.tr("Installation to resume:"), descriptions, 0, False)
+            if not ok:
+                return
+            run = runs[descriptions.index(description)]
+
+        resumed = self.fancy.resume_run(run['run_id'])
+        if resumed is None:
+            QtWidgets.QMessageBox.warning(
+                self,
+                self.tr("Cannot resume the installation"),
+                self.tr("Its download worker <b>{}</b> is busy with another "
+                        "installation, try again when it "
+                        "finishes.").format(run['worker']))
+            return
+        steps, completed = resumed
+        self.run_installation(run['run_id'], steps, completed)
+
+    def installation_finished(self, run_id, exit_code):
+        self.fancy.worker_pool.release(run_id)
+        self.fancy.finish_run(run_id, exit_code)
+        self.resume_button.setEnabled(bool(self.fancy.failed_runs()))
+
     def create_finished(self):
         if self.thread.msg:
             QtWidgets.QMessageBox.warning(
@@ -776,10 +1179,7 @@ class NewWorkerDlg(QtWidgets.QDialog, Ui_NewWorkerDlg):
         template = self.worker.currentData()
         klass = self.installlation.currentData()
 
-        for i in self.fancy.get_installations():
-            if i[0] == self.installlation.currentData():
-                pixmap = QtGui.QPixmap(f':/{i[3]}')
-                self.imageLabel.setPixmap(pixmap)
+        self.imageLabel.setPixmap(self.fancy.catalog.icon(klass))
 
         if not self.initial_option_item_removed and self.installlation.count() > 0:
             last_index = self.installlation.count() - 1
@@ -0,0 +1,366 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+#
+"""Views of the Qube Manager table: saved view presets and qubes grouped
+in a tree."""
+
+import bisect
+
+# pylint: disable=import-error
+from PyQt5.QtCore import Qt, QAbstractItemModel, QModelIndex
+# pylint: disable=import-error
+from PyQt5.QtGui import QFont
+
+
+class ViewPreset:
+    """Filters, sorting, visible columns and search query of the qube table,
+    applied all at once by VmManagerWindow.apply_view_preset"""
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('show', 'sort_column', 'sort_order', 'hidden_columns',
+                 'search')
+
+    # names of the show_* checkboxes, without the prefix
+    show_options = ('running', 'halted', 'network', 'templates',
+                    'standalone', 'all')
+
+    def __init__(self, show=show_options, sort_column=2,
+                 sort_order=Qt.AscendingOrder, hidden_columns=(), search=""):
+        self.show = frozenset(show)
+        self.sort_column = sort_column
+        self.sort_order = Qt.SortOrder(sort_order)
+        self.hidden_columns = frozenset(hidden_columns)
+        self.search = search
+
+    def to_dict(self):
+        return {'show': sorted(self.show),
+                'sort_column': self.sort_column,
+                'sort_order': int(self.sort_order),
+                'hidden_columns': sorted(self.hidden_columns),
+                'search': self.search}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(show=data.get('show', cls.show_options),
+                   sort_column=int(data.get('sort_column', 2)),
+                   sort_order=int(data.get('sort_order', Qt.AscendingOrder)),
+                   hidden_columns=data.get('hidden_columns', ()),
+                   search=data.get('search', ""))
+
+    def __eq__(self, other):
+        return isinstance(other, ViewPreset) and \
+            self.to_dict() == other.to_dict()
+
+
+class QubeGroup:
+    """Qubes sharing a value of the grouped by attribute, with aggregates
+    kept up to date as qubes are added, changed or removed"""
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('group_id', 'key', 'names', 'running', 'disk', 'outdated')
+
+    def __init__(self, group_id, key):
+        self.group_id = group_id
+        self.key = key
+        self.names = []  # sorted
+        self.running = 0
+        self.disk = 0.0
+        self.outdated = 0
+
+    def add_aggregates(self, aggregates, sign=1):
+        running, disk, outdated = aggregates
+        self.running += sign * running
+        self.disk += sign * disk
+        self.outdated += sign * outdated
+
+
+class QubesGroupModel(QAbstractItemModel):
+    """Tree of qubes grouped by template, netvm, label or class, on top of
+    QubesTableModel. Each top level row is a group showing the number of
+    its running and outdated qubes and their total disk usage; these are
+    updated only for the source rows reported as changed."""
+    group_by_options = ('template', 'netvm', 'label', 'klass')
+
+    def __init__(self, source, group_by, accepts_row=None):
+        """
+        :param source: QubesTableModel
+        :param group_by: one of group_by_options
+        :param accepts_row: optional callable telling if a source row should
+            be shown, e.g. filterAcceptsRow of the filtering proxy
+        """
+        super().__init__()
+        self.source = source
+        self.group_by = group_by
+        self.accepts_row = accepts_row
+
+        self._groups = []  # sorted by key
+        self._groups_by_key = {}
+        self._groups_by_id = {}
+        self._next_group_id = 1
+        # qube name: source row
+        self._rows = {}
+        # qube name: (group, aggregates)
+        self._members = {}
+
+        source.dataChanged.connect(self._source_data_changed)
+        source.rowsInserted.connect(self._source_rows_inserted)
+        source.rowsAboutToBeRemoved.connect(self._source_rows_removed)
+        source.modelReset.connect(self.rebuild)
+        source.layoutChanged.connect(self._source_layout_changed)
+
+        self._fill()
+
+    def group_key(self, vm):
+        if not vm.loaded and self.group_by != 'klass':
+            return None
+        if self.group_by == 'template':
+            return vm.template or vm.klass
+        if self.group_by == 'label':
+            return getattr(vm.label, 'name', None)
+        return getattr(vm, self.group_by)
+
+    @staticmethod
+    def aggregates(vm):
+        return (int(vm.state['power'] == 'Running'),
+                vm.disk_float or 0.0,
+                int(bool(vm.state['outdated'])))
+
+    def _source_vm(self, row):
+        return self.source.qubes_cache.get_vm(row)
+
+    def _fill(self):
+        self._groups = []
+        self._groups_by_key = {}
+        self._groups_by_id = {}
+        self._rows = {}
+        self._members = {}
+        for row in range(self.source.rowCount(QModelIndex())):
+            vm = self._source_vm(row)
+            self._rows[vm.name] = row
+            if self.accepts_row is None or self.accepts_row(row):
+                self._add_member(vm, notify=False)
+
+    def rebuild(self):
+        """Groups all the qubes again, e.g. after filters changed"""
+        self.beginResetModel()
+        self._fill()
+        self.endResetModel()
+
+    def group_by_key(self, key):
+        return self._groups_by_key.get(key)
+
+    def group_of(self, name):
+        member = self._members.get(name)
+        return member[0] if member else None
+
+    def _group_index(self, group, column=0):
+        return self.createIndex(self._groups.index(group), column, 0)
+
+    def _sort_key(self, key):
+        return (key is not None, str(key).lower())
+
+    def _add_member(self, vm, notify=True):
+        key = self.group_key(vm)
+        group = self._groups_by_key.get(key)
+        if group is None:
+            group = QubeGroup(self._next_group_id, key)
+            self._next_group_id += 1
+            position = bisect.bisect(
+                [self._sort_key(g.key) for g in self._groups],
+                self._sort_key(key))
+            if notify:
+                self.beginInsertRows(QModelIndex(), position, position)
+            self._groups.insert(position, group)
+            self._groups_by_key[key] = group
+            self._groups_by_id[group.group_id] = group
+            if notify:
+                self.endInsertRows()
+
+        position = bisect.bisect(group.names, vm.name)
+        if notify:
+            self.beginInsertRows(self._group_index(group), position, position)
+        group.names.insert(position, vm.name)
+        aggregates = self.aggregates(vm)
+        group.add_aggregates(aggregates)
+        self._members[vm.name] = (group, aggregates)
+        if notify:
+            self.endInsertRows()
+            self._group_changed(group)
+
+    def _remove_member(self, name):
+        group, aggregates = self._members.pop(name)
+        position = group.names.index(name)
+        self.beginRemoveRows(self._group_index(group), position, position)
+        del group.names[position]
+        group.add_aggregates(aggregates, -1)
+        self.endRemoveRows()
+
+        if group.names:
+            self._group_changed(group)
+            return
+        position = self._groups.index(group)
+        self.beginRemoveRows(QModelIndex(), position, position)
+        del self._groups[position]
+        del self._groups_by_key[group.key]
+        del self._groups_by_id[group.group_id]
+        self.endRemoveRows()
+
+    def _group_changed(self, group):
+        self.dataChanged.emit(
+            self._group_index(group),
+            self._group_index(group, self.columnCount(QModelIndex()) - 1))
+
+    def _source_data_changed(self, top_left, bottom_right, _roles=()):
+        for row in range(top_left.row(), bottom_right.row() + 1):
+            self._update_row(row)
+
+    def _update_row(self, row):
+        vm = self._source_vm(row)
+        member = self._members.get(vm.name)
+        accepted = self.accepts_row is None or self.accepts_row(row)
+
+        if member is None:
+            if accepted:
+                self._add_member(vm)
+            return
+        if not accepted or self.group_key(vm) != member[0].key:
+            self._remove_member(vm.name)
+            if accepted:
+                self._add_member(vm)
+            return
+
+        group, old_aggregates = member
+        aggregates = self.aggregates(vm)
+        if aggregates != old_aggregates:
+            group.add_aggregates(old_aggregates, -1)
+            group.add_aggregates(aggregates)
+            self._members[vm.name] = (group, aggregates)
+            self._group_changed(group)
+        position = group.names.index(vm.name)
+        self.dataChanged.emit(
+            self.createIndex(position, 0, group.group_id),
+            self.createIndex(position, self.columnCount(QModelIndex()) - 1,
+                             group.group_id))
+
+    def _source_layout_changed(self):
+        # the source was sorted; groups and their members keep their order,
+        # only the source rows they map to change
+        self._rows = {self._source_vm(row).name: row
+                      for row in range(self.source.rowCount(QModelIndex()))}
+
+    def _source_rows_inserted(self, _parent, first, last):
+        count = last - first + 1
+        for name, row in self._rows.items():
+            if row >= first:
+                self._rows[name] = row + count
+        for row in range(first, last + 1):
+            vm = self._source_vm(row)
+            self._rows[vm.name] = row
+            if self.accepts_row is None or self.accepts_row(row):
+                self._add_member(vm)
+
+    def _source_rows_removed(self, _parent, first, last):
+        count = last - first + 1
+        for row in range(first, last + 1):
+            name = self._source_vm(row).name
+            del self._rows[name]
+            if name in self._members:
+                self._remove_member(name)
+        for name, row in self._rows.items():
+            if row > last:
+                self._rows[name] = row - count
+
+    def index(self, row, column, parent=QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QModelIndex()
+        if not parent.isValid():
+            return self.createIndex(row, column, 0)
+        group = self._groups[parent.row()]
+        return self.createIndex(row, column, group.group_id)
+
+    def parent(self, index):  # pylint: disable=arguments-differ
+        if not index.isValid() or not index.internalId():
+            return QModelIndex()
+        return self._group_index(self._groups_by_id[index.internalId()])
+
+    # pylint: disable=invalid-name
+    def rowCount(self, parent=QModelIndex()):
+        if not parent.isValid():
+            return len(self._groups)
+        if parent.internalId() or parent.column() != 0:
+            return 0
+        return len(self._groups[parent.row()].names)
+
+    # pylint: disable=invalid-name
+    def columnCount(self, _parent=QModelIndex()):
+        return self.source.columnCount(QModelIndex())
+
+    # pylint: disable=invalid-name
+    def headerData(self, col, orientation, role):
+        return self.source.headerData(col, orientation, role)
+
+    def mapToSource(self, index):
+        """Returns the source index of a qube, or an invalid index for
+        a group"""
+        if not index.isValid() or not index.internalId():
+            return QModelIndex()
+        group = self._groups_by_id[index.internalId()]
+        return self.source.index(
+            self._rows[group.names[index.row()]], index.column())
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        if not index.internalId():
+            return Qt.ItemIsEnabled
+        return self.source.flags(self.mapToSource(index))
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if index.internalId():
+            return self.mapToSource(index).data(role)
+
+        if role == Qt.DisplayRole:
+            return self.group_text(self._groups[index.row()],
+                                   self.source.columns_indices[index.column()])
+        if role == Qt.FontRole:
+            font = QFont()
+            font.setBold(True)
+            return font
+        return None
+
+    def group_text(self, group, col_name):
+        """Returns text of the group row in the given column"""
+        if col_name == "Name":
+            key = group.key
+            if key is None:
+                key = self.tr("loading...") \
+                    if self.group_by != 'label' else self.tr("none")
+            return "{} ({})".format(key, len(group.names))
+        if col_name == "State":
+            text = self.tr("{} running").format(group.running)
+            if group.outdated:
+                text += ", " + self.tr("{} outdated").format(group.outdated)
+            return text
+        if col_name == "Disk Usage":
+            return str(round(group.disk / (1024 * 1024), 2)) + " MiB"
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if not index.internalId():
+            return False
+        return self.source.setData(self.mapToSource(index), value, role)
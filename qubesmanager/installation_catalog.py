@@ -0,0 +1,261 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+#
+"""Catalog of the installations offered by the fancy manager.
+
+The catalog ships with the manager (BUILTIN_CATALOG) and can be refreshed
+from the URL in the fancy/catalog_url setting. It is fetched through a
+disposable, as dom0 has no network, in a thread, so that it never delays
+the dialog. The refreshed catalog, with versions and sha256 of the
+downloads, is cached on disk and used from then on. Icons are files next to
+this module, loaded when first shown.
+"""
+
+import json
+import os
+import re
+import shlex
+import subprocess
+import time
+
+from PyQt5 import QtCore, QtGui  # pylint: disable=import-error
+
+CATALOG_FORMAT = 1
+DEFAULT_CACHE_PATH = os.path.expanduser('~/.qubes-fancy-manager/catalog.json')
+ICONS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'installation_icons')
+URL_KEY = 'fancy/catalog_url'
+# a cached catalog older than this (in seconds) is refreshed
+MAX_AGE = 24 * 3600
+# seconds fetching the catalog may take, including start of the disposable
+FETCH_TIMEOUT = 300
+
+TYPES = ('unman', 'windows', 'mirage')
+# types of the installations downloading a file of the catalog
+DOWNLOAD_TYPES = ('unman', 'mirage')
+
+# the values end up in scripts run in dom0; they are quoted there, but the
+# catalog comes from the network, so only plain values are accepted at all
+NAME_PATTERN = re.compile(r'\A[A-Za-z0-9._-]+\Z')
+URL_PATTERN = re.compile(r'\Ahttps://[A-Za-z0-9.-]+(:[0-9]+)?'
+                         r'(/[A-Za-z0-9._~%+=,@/-]*)?\Z')
+SHA256_PATTERN = re.compile(r'\A[0-9a-f]{64}\Z')
+
+
+def _unman_template(name, version, icon):
+    return {
+        'id': name, 'type': 'unman', 'group': 'Linux templates',
+        'version': version, 'icon': icon,
+        'url': 'https://qubes.3isec.org/Templates_4.1/'
+               'qubes-template-{}-{}.noarch.rpm'.format(name, version),
+    }
+
+
+BUILTIN_CATALOG = {
+    'format': CATALOG_FORMAT,
+    'installations': [
+        _unman_template('archlinux-minimal', '4.0.6-202301300342',
+                        'arch.png'),
+        _unman_template('blackarch', '4.0.6-202302042136', 'blackarch.png'),
+        _unman_template('bookworm-minimal', '4.0.6-202210290334',
+                        'debian.png'),
+        _unman_template('debian-12', '4.0.6-202301242054', 'debian.png'),
+        _unman_template('focal', '4.0.6-202208271536', 'ubuntu.png'),
+        _unman_template('focal-minimal', '4.0.6-202208260823', 'ubuntu.png'),
+        _unman_template('jammy', '4.0.6-202205012228', 'ubuntu.png'),
+        _unman_template('kali', '4.0.6-202302232007', 'kali11.png'),
+        _unman_template('parrot-pwn', '4.0.6-202301281509', 'parrot.png'),
+        _unman_template('parrot_full', '4.0.6-202210290410', 'parrot.png'),
+        _unman_template('una', '4.0.6-202205202253', 'mint.png'),
+        {'id': 'win10x64-ltsc-eval', 'type': 'windows', 'group': 'Windows',
+         'icon': 'win10x64-ltsc-eval.png'},
+        {'id': 'mirage-firewall', 'type': 'mirage', 'group': 'Unikernels',
+         'version': '0.8.4', 'icon': 'mirage-firewall.png',
+         'url': 'https://github.com/mirage/qubes-mirage-firewall/releases/'
+                'download/v0.8.4/mirage-firewall.tar.bz2'},
+    ],
+}
+
+
+class InvalidCatalog(ValueError):
+    """Catalog is not in the expected format"""
+
+
+class Installation:
+    """An installation of the catalog"""
+    # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    def __init__(self, data):
+        """
+        :param data: dict from the catalog
+        :raises InvalidCatalog: if a field is missing or of a wrong type
+        """
+        try:
+            self.id = data['id']  # pylint: disable=invalid-name
+            self.type = data['type']
+            self.group = data['group']
+        except (KeyError, TypeError) as ex:
+            raise InvalidCatalog("Missing {} in {!r}".format(ex, data)) \
+                from ex
+        self.version = data.get('version')
+        self.url = data.get('url')
+        self.sha256 = data.get('sha256')
+        self.icon = data.get('icon')
+        if not isinstance(self.group, str) or not self.group:
+            raise InvalidCatalog("Invalid {!r}".format(data))
+        self._check(NAME_PATTERN, 'id', self.id)
+        if self.type not in TYPES:
+            raise InvalidCatalog("Unknown type of {}: {}".format(
+                self.id, self.type))
+        if self.version is not None:
+            self._check(NAME_PATTERN, 'version', self.version)
+        if self.url is not None:
+            self._check(URL_PATTERN, 'url', self.url)
+        elif self.type in DOWNLOAD_TYPES:
+            raise InvalidCatalog("Missing url of {}".format(self.id))
+        if self.sha256 is not None:
+            self._check(SHA256_PATTERN, 'sha256', self.sha256)
+        if self.icon is not None and os.path.basename(self.icon) != self.icon:
+            raise InvalidCatalog("Invalid icon of {}: {}".format(
+                self.id, self.icon))
+
+    @staticmethod
+    def _check(pattern, field, value):
+        if not isinstance(value, str) or not pattern.match(value):
+            raise InvalidCatalog("Invalid {}: {!r}".format(field, value))
+
+    @property
+    def name(self):
+        """Text shown in the list of installations"""
+        if self.version:
+            return "{} ({})".format(self.id, self.version)
+        return self.id
+
+
+def parse_catalog(data):
+    """Returns dict of id: Installation, in catalog order
+    :raises InvalidCatalog: if data is not a valid catalog
+    """
+    if not isinstance(data, dict) or data.get('format') != CATALOG_FORMAT \
+            or not isinstance(data.get('installations'), list):
+        raise InvalidCatalog("Not a catalog of format {}".format(
+            CATALOG_FORMAT))
+    installations = {}
+    for item in data['installations']:
+        installation = Installation(item)
+        if installation.id in installations:
+            raise InvalidCatalog("Duplicate installation {}".format(
+                installation.id))
+        installations[installation.id] = installation
+    return installations
+
+
+class InstallationCatalog:
+    """The installations, looked up by id"""
+    def __init__(self, cache_path=DEFAULT_CACHE_PATH):
+        self.cache_path = cache_path
+        # time the cached catalog was fetched, None for the builtin one
+        self.fetched = None
+        self.installations = parse_catalog(BUILTIN_CATALOG)
+        self._icons = {}
+        self.load()
+
+    def load(self):
+        """Reads the cached catalog, keeps the current one if there is no
+        valid cache"""
+        try:
+            with open(self.cache_path, encoding='utf-8') as file:
+                cached = json.load(file)
+            installations = parse_catalog(cached.get('catalog'))
+            fetched = float(cached['fetched'])
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return
+        self.installations = installations
+        self.fetched = fetched
+
+    def update(self, data):
+        """Replaces the catalog with a fetched one and caches it
+        :raises InvalidCatalog: if data is not a valid catalog
+        """
+        self.installations = parse_catalog(data)
+        self.fetched = time.time()
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp_path = self.cache_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({'fetched': self.fetched, 'catalog': data}, file)
+        os.replace(tmp_path, self.cache_path)
+
+    def is_stale(self):
+        return self.fetched is None or time.time() - self.fetched > MAX_AGE
+
+    def get(self, installation_id):
+        """Returns Installation of the id, or None"""
+        return self.installations.get(installation_id)
+
+    def __iter__(self):
+        return iter(self.installations.values())
+
+    def groups(self):
+        """Returns list of (group, list of its installations), in catalog
+        order"""
+        groups = {}
+        for installation in self:
+            groups.setdefault(installation.group, []).append(installation)
+        return list(groups.items())
+
+    def icon(self, installation_id):
+        """Returns QPixmap of the installation, loaded the first time it is
+        asked for (a null one if there is none)"""
+        if installation_id not in self._icons:
+            installation = self.get(installation_id)
+            path = None
+            if installation is not None and installation.icon:
+                path = os.path.join(ICONS_DIRECTORY, installation.icon)
+            self._icons[installation_id] = QtGui.QPixmap(path) \
+                if path and os.path.exists(path) else QtGui.QPixmap()
+        return self._icons[installation_id]
+
+
+def fetch_command(url, dispvm):
+    """Returns command printing the catalog at the URL, fetched in a new
+    disposable of dispvm"""
+    return ['qvm-run', '--dispvm={}'.format(dispvm), '--pass-io',
+            'curl -fsSL --max-time 60 {}'.format(shlex.quote(url))]
+
+
+# pylint: disable=too-few-public-methods
+class CatalogRefreshThread(QtCore.QThread):
+    """Fetches the catalog; on success, data is the parsed JSON (to be
+    given to InstallationCatalog.update), otherwise msg is the error"""
+    def __init__(self, command):
+        QtCore.QThread.__init__(self)
+        self.command = command
+        self.data = None
+        self.msg = None
+
+    def run(self):
+        try:
+            result = subprocess.run(
+                self.command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                timeout=FETCH_TIMEOUT, check=True)
+            data = json.loads(result.stdout.decode())
+            parse_catalog(data)
+            self.data = data
+        except subprocess.CalledProcessError as ex:
+            self.msg = ex.stderr.decode(errors='replace').strip() or str(ex)
+        except (OSError, subprocess.TimeoutExpired, ValueError) as ex:
+            self.msg = str(ex)
@@ -21,22 +21,30 @@
 # with this program; if not, see <http://www.gnu.org/licenses/>.
 #
 #
+import argparse
+import itertools
+import json
 import subprocess
+import sys
+import time
 from datetime import datetime, timedelta
 from functools import partial
 from os import path
 
+import qubesadmin
 from qubesadmin import exc
 from qubesadmin import utils
 
 # pylint: disable=import-error
-from PyQt5.QtCore import (Qt, QAbstractTableModel, QObject, pyqtSlot, QEvent,
-    QSettings, QRegExp, QSortFilterProxyModel, QSize, QPoint, QTimer)
+from PyQt5.QtCore import (Qt, QAbstractTableModel, QAbstractItemModel,
+    QObject, pyqtSlot, QEvent, QSettings, QRegExp, QSortFilterProxyModel,
+    QSize, QPoint, QTimer, QModelIndex, pyqtSignal)
 
 # pylint: disable=import-error
 from PyQt5.QtWidgets import (QLineEdit, QStyledItemDelegate, QToolTip,
-    QMenu, QInputDialog, QMainWindow, QProgressDialog, QStyleOptionViewItem,
-    QMessageBox, QShortcut)
+    QMenu, QInputDialog, QMainWindow, QStyleOptionViewItem,
+    QMessageBox, QShortcut, QTreeView, QActionGroup, QAbstractItemView,
+    QFileDialog)
 
 # pylint: disable=import-error
 from PyQt5.QtGui import (QIcon, QPixmap, QRegExpValidator, QFont, QColor,
@@ -45,16 +53,26 @@ from PyQt5.QtGui import (QIcon, QPixmap, QRegExpValidator, QFont, QColor,
 from qubesmanager.about import AboutDialog
 
 from . import ui_qubemanager  # pylint: disable=no-name-in-module
-from . import settings
-from . import global_settings
-from . import restore
-from . import backup
-from . import create_new_vm
-from . import create_worker
-from . import log_dialog
 from . import utils as manager_utils
 from . import common_threads
-from . import clone_vm
+from . import table_export
+from .cache_loader import CacheLoaderThread, ResyncThread, load_vm_infos
+from .group_model import QubesGroupModel, ViewPreset
+from .vm_info import VmInfo, VmState
+
+# dialogs are only imported once the user opens them
+settings = manager_utils.lazy_import('qubesmanager.settings')
+global_settings = manager_utils.lazy_import('qubesmanager.global_settings')
+restore = manager_utils.lazy_import('qubesmanager.restore')
+backup = manager_utils.lazy_import('qubesmanager.backup')
+create_new_vm = manager_utils.lazy_import('qubesmanager.create_new_vm')
+create_worker = manager_utils.lazy_import('qubesmanager.create_worker')
+worker_pool = manager_utils.lazy_import('qubesmanager.worker_pool')
+log_dialog = manager_utils.lazy_import('qubesmanager.log_dialog')
+clone_vm = manager_utils.lazy_import('qubesmanager.clone_vm')
+update_orchestrator = manager_utils.lazy_import(
+    'qubesmanager.update_orchestrator')
+run_command = manager_utils.lazy_import('qubesmanager.run_command')
 
 
 class SearchBox(QLineEdit):
@@ -74,6 +92,8 @@ class SearchBox(QLineEdit):
             self.focusing = False
 
 icon_size = QSize(22, 22)
+# pixmaps of qube classes and labels kept in memory
+pixmap_cache_size = 64
 
 # pylint: disable=invalid-name
 class StateIconDelegate(QStyledItemDelegate):
@@ -117,6 +137,11 @@ class StateIconDelegate(QStyledItemDelegate):
         return hint
 
     def paint(self, qp, option, index):
+        if not isinstance(index.data(), VmState):
+            # qube still being loaded, or a group of qubes
+            super().paint(qp, option, index)
+            return
+
         # create a new QStyleOption (*never* use the one given in arguments)
         option = QStyleOptionViewItem(option)
 
@@ -153,7 +178,8 @@ class StateIconDelegate(QStyledItemDelegate):
         qp.restore()
 
     def helpEvent(self, event, view, option, index):
-        if event.type() != QEvent.ToolTip:
+        if event.type() != QEvent.ToolTip or \
+                not isinstance(index.data(), VmState):
             return super().helpEvent(event, view,
                     option, index)
         option = QStyleOptionViewItem(option)
@@ -193,157 +219,116 @@ class StateIconDelegate(QStyledItemDelegate):
         return True
 
 
-# pylint: disable=too-many-instance-attributes
-# pylint: disable=too-few-public-methods
-class VmInfo():
-    def __init__(self, vm):
-        self.vm = vm
-        self.qid = vm.qid
-        self.name = self.vm.name
-
-        self.label = getattr(self.vm, 'label', None)
-        self.klass = getattr(self.vm, 'klass', None)
-        self.icon = getattr(vm, 'icon', 'appvm-black')
-
-        self.state = {'power': "", 'outdated': ""}
-        self.updateable = getattr(vm, 'updateable', False)
-        self.update(True)
-
-    def update_power_state(self):
-        try:
-            self.state['power'] = self.vm.get_power_state()
-        except exc.QubesDaemonAccessError:
-            self.state['power'] = ""
-
-        self.state['outdated'] = ""
-        try:
-            if manager_utils.is_running(self.vm, False):
-                if hasattr(self.vm, 'template') and \
-                        manager_utils.is_running(self.vm.template, False):
-                    self.state['outdated'] = "to-be-outdated"
-                else:
-                    try:
-                        if any(vol.is_outdated()
-                               for vol in self.vm.volumes.values()):
-                            self.state['outdated'] = "outdated"
-                    except exc.QubesDaemonAccessError:
-                        pass
-
-            if self.vm.klass in {'TemplateVM', 'StandaloneVM'} and \
-                    manager_utils.get_feature(
-                        self.vm, 'updates-available', False):
-                self.state['outdated'] = 'update'
-        except exc.QubesDaemonAccessError:
-            pass
-
-    def update(self, update_size_on_disk=False, event=None):
-        """
-        Update VmInfo
-        :param update_size_on_disk: should disk utilization be updated?
-        :param event: name of the event that caused the update, to avoid
-        updating unnecessary properties; if event is none, update everything
-        :return: None
-        """
-        self.update_power_state()
-
-        if not event or event.endswith(':label'):
-            self.label = getattr(self.vm, 'label', None)
-            self.icon = getattr(self.vm, 'icon', 'appvm-black')
-
-        if not event or event.endswith(':template'):
-            try:
-                self.template = self.vm.template.name
-            except AttributeError:
-                self.template = None
-
-        if not event or event.endswith(':netvm'):
-            self.netvm = getattr(self.vm, 'netvm', None)
-            if self.netvm:
-                self.netvm = str(self.netvm)
-            else:
-                self.netvm = "n/a"
-            try:
-                if hasattr(self.vm, 'netvm') \
-                        and self.vm.property_is_default("netvm"):
-                    self.netvm = "default (" + self.netvm + ")"
-            except exc.QubesDaemonAccessError:
-                pass
-
-        if not event or event.endswith(':internal'):
-            self.internal = manager_utils.get_boolean_feature(
-                self.vm, 'internal')
-
-        if not event or event.endswith(':ip'):
-            self.ip = getattr(self.vm, 'ip', "n/a")
-
-        if not event or event.endswith(':include_in_backups'):
-            self.inc_backup = getattr(self.vm, 'include_in_backups', None)
-
-        if not event or event.endswith(':backup_timestamp'):
-            self.last_backup = getattr(self.vm, 'backup_timestamp', None)
-            if self.last_backup:
-                self.last_backup = str(datetime.fromtimestamp(self.last_backup))
-
-        if not event or event.endswith(':default_dispvm'):
-            self.dvm = getattr(self.vm, 'default_dispvm', None)
-            try:
-                if self.vm.property_is_default("default_dispvm"):
-                    self.dvm = "default (" + str(self.dvm) + ")"
-                elif self.dvm is not None:
-                    self.dvm = str(self.dvm)
-            except exc.QubesDaemonAccessError:
-                if self.dvm is not None:
-                    self.dvm = str(self.dvm)
-
-        if not event or event.endswith(':template_for_dispvms'):
-            self.dvm_template = getattr(self.vm, 'template_for_dispvms', None)
-
-        if self.vm.klass != 'AdminVM' and update_size_on_disk:
-            try:
-                self.disk_float = float(self.vm.get_disk_utilization())
-                self.disk = str(round(self.disk_float/(1024*1024), 2)) + " MiB"
-            except exc.QubesDaemonAccessError:
-                self.disk_float = None
-                self.disk = None
-
-        if self.vm.klass != 'AdminVM':
-            self.virt_mode = getattr(self.vm, 'virt_mode', None)
-        else:
-            self.virt_mode = None
-            self.disk = "n/a"
-
-
 class QubesCache(QAbstractTableModel):
     def __init__(self, qubes_app):
         QAbstractTableModel.__init__(self)
         self._qubes_app = qubes_app
         self._info_list = []
-        self._info_by_id = {}
+        # domains are looked up by name, which (unlike qid) is known
+        # without asking qubesd, also for placeholders
+        self._info_by_name = {}
+
+    def add_vm(self, vm, updates_available=None):
+        self._add(VmInfo(vm, updates_available))
 
-    def add_vm(self, vm):
-        vm_info = VmInfo(vm)
-        self._info_list.append(vm_info)
-        self._info_by_id[vm.qid] = vm_info
+    def add_placeholder(self, vm):
+        self._add(VmInfo.placeholder(vm))
+
+    def _add(self, vm_info):
+        if vm_info.name in self._info_by_name:
+            index = self._info_list.index(self._info_by_name[vm_info.name])
+            self._info_list[index] = vm_info
+        else:
+            self._info_list.append(vm_info)
+        self._info_by_name[vm_info.name] = vm_info
 
     def remove_vm(self, name):
         vm_info = self.get_vm(name=name)
         self._info_list.remove(vm_info)
-        del self._info_by_id[vm_info.qid]
+        del self._info_by_name[name]
+
+    def get_row(self, name):
+        return self._info_list.index(self._info_by_name[name])
+
+    def sort(self, key, reverse=False):
+        self._info_list.sort(key=key, reverse=reverse)
 
     def get_vm(self, row=None, qid=None, name=None):
         if row is not None:
             return self._info_list[row]
         if qid is not None:
-            return self._info_by_id[qid]
-        return next(x for x in self._info_list if x.name == name)
+            for vm_info in self._info_list:
+                if vm_info.qid == qid:
+                    return vm_info
+            raise KeyError(qid)
+        return self._info_by_name[name]
+
+    def is_loaded(self):
+        return all(vm_info.loaded for vm_info in self._info_list)
 
-    def update_model_data(self, *args, **kwargs):
-        # pylint: disable=unused-argument
+    def get_placeholders(self):
+        """Returns domains whose VmInfo is not loaded yet"""
+        return [vm_info.vm for vm_info in self._info_list
+                if not vm_info.loaded]
+
+    def replace_placeholders(self, vm_infos):
+        """
+        Replaces placeholders with loaded VmInfo; entries that are not
+        placeholders anymore (e.g. re-added by an event) are kept.
+        :return: list of rows that were replaced
+        """
+        rows = []
+        for vm_info in vm_infos:
+            current = self._info_by_name.get(vm_info.name)
+            if current is None or current.loaded:
+                continue
+            row = self._info_list.index(current)
+            self._info_list[row] = vm_info
+            self._info_by_name[vm_info.name] = vm_info
+            rows.append(row)
+        return rows
+
+    def get_states(self):
+        """Returns {name: (power state, template name)} of all cached
+        domains, dropping power states cached by qubesadmin, so that they
+        are fetched again"""
+        states = {}
         for vm_info in self._info_list:
             # FIXME: add helper maybe?
             # pylint: disable=protected-access
             vm_info.vm._power_state_cache = None
-            vm_info.update()
+            states[vm_info.name] = (vm_info.state['power'], vm_info.template)
+        return states
+
+    def apply_changes(self, added, changed, removed):
+        """
+        Applies the result of a ResyncThread in one go. Domains added or
+        removed by events in the meantime are skipped.
+        :param added: list of VmInfo of new domains
+        :param changed: list of VmInfo replacing the cached ones
+        :param removed: list of names of domains that no longer exist
+        """
+        index_by_name = {vm_info.name: index
+                         for index, vm_info in enumerate(self._info_list)}
+
+        for vm_info in changed:
+            index = index_by_name.get(vm_info.name)
+            if index is None:
+                continue
+            self._info_list[index] = vm_info
+            self._info_by_name[vm_info.name] = vm_info
+
+        removed = set(removed).intersection(self._info_by_name)
+        if removed:
+            for name in removed:
+                del self._info_by_name[name]
+            self._info_list = [vm_info for vm_info in self._info_list
+                               if vm_info.name not in removed]
+
+        for vm_info in added:
+            if vm_info.name not in index_by_name:
+                self._info_list.append(vm_info)
+                self._info_by_name[vm_info.name] = vm_info
 
     def __len__(self):
         return len(self._info_list)
@@ -353,12 +338,23 @@ class QubesCache(QAbstractTableModel):
 
 
 class QubesTableModel(QAbstractTableModel):
+    # rows added to the view at once when scrolling
+    fetch_chunk = 200
+
     def __init__(self, qubes_cache):
         QAbstractTableModel.__init__(self)
         self.qubes_cache = qubes_cache
+        # only this many rows of the cache are visible; the rest is added by
+        # fetchMore as the view needs them, or once they are loaded
+        self.fetched_rows = min(len(qubes_cache), self.fetch_chunk)
+        self.sort_column = -1
+        self.sort_order = Qt.AscendingOrder
+        # whether the cache is still in the order of the sort column
+        self.sorted = False
         self.template = {}
-        self.klass_pixmap = {}
-        self.label_pixmap = {}
+        # pixmaps by class and by label icon
+        self.klass_pixmap = manager_utils.LruCache(pixmap_cache_size)
+        self.label_pixmap = manager_utils.LruCache(pixmap_cache_size)
         self.columns_indices = [
                 "Type",
                 "Label",
@@ -378,7 +374,88 @@ class QubesTableModel(QAbstractTableModel):
 
     # pylint: disable=invalid-name
     def rowCount(self, _):
-        return len(self.qubes_cache)
+        return min(len(self.qubes_cache), self.fetched_rows)
+
+    # pylint: disable=invalid-name
+    def canFetchMore(self, parent):
+        return not parent.isValid() and \
+            self.fetched_rows < len(self.qubes_cache)
+
+    # pylint: disable=invalid-name
+    def fetchMore(self, parent):
+        if parent.isValid():
+            return
+        self.fetch_rows(self.fetched_rows + self.fetch_chunk)
+
+    def fetch_rows(self, row_count):
+        """Makes at least row_count rows visible"""
+        first = self.rowCount(QModelIndex())
+        last = min(row_count, len(self.qubes_cache))
+        if last <= first:
+            return
+        self.beginInsertRows(QModelIndex(), first, last - 1)
+        self.fetched_rows = last
+        self.endInsertRows()
+
+    def rows_added(self, count=1):
+        """Shows rows appended to the cache, unless the rows before them are
+        still hidden"""
+        self.check_order(range(len(self.qubes_cache) - count,
+                               len(self.qubes_cache)))
+        if self.fetched_rows >= len(self.qubes_cache) - count:
+            self.fetch_rows(len(self.qubes_cache))
+
+    def remove_vm(self, name):
+        row = self.qubes_cache.get_row(name)
+        if row >= self.fetched_rows:
+            self.qubes_cache.remove_vm(name)
+            return
+        self.beginRemoveRows(QModelIndex(), row, row)
+        self.qubes_cache.remove_vm(name)
+        self.fetched_rows -= 1
+        self.endRemoveRows()
+
+    def apply_changes(self, added, changed, removed):
+        """Applies the result of a ResyncThread, see QubesCache"""
+        self.beginResetModel()
+        self.sorted = False
+        all_fetched = self.fetched_rows >= len(self.qubes_cache)
+        self.qubes_cache.apply_changes(added, changed, removed)
+        if all_fetched:
+            self.fetched_rows = len(self.qubes_cache)
+        self.endResetModel()
+
+    def vm_changed(self, name):
+        """Data of the given domain changed in the cache"""
+        try:
+            row = self.qubes_cache.get_row(name)
+        except KeyError:
+            return
+        self.check_order([row])
+        if row < self.fetched_rows:
+            self.dataChanged.emit(
+                self.index(row, 0),
+                self.index(row, len(self.columns_indices) - 1))
+
+    def all_changed(self):
+        """Data of all domains changed in the cache"""
+        self.sorted = False
+        row_count = self.rowCount(QModelIndex())
+        if row_count:
+            self.dataChanged.emit(
+                self.index(0, 0),
+                self.index(row_count - 1, len(self.columns_indices) - 1))
+
+    def rows_loaded(self, rows):
+        """Placeholders in the given rows were replaced with loaded data"""
+        if not rows:
+            return
+        self.check_order(rows)
+        self.fetch_rows(max(rows) + 1)
+        last_column = len(self.columns_indices) - 1
+        for row in rows:
+            self.dataChanged.emit(self.index(row, 0),
+                                  self.index(row, last_column))
 
     # pylint: disable=invalid-name
     def columnCount(self, _):
@@ -395,33 +472,13 @@ class QubesTableModel(QAbstractTableModel):
         col_name = self.columns_indices[col]
         vm = self.qubes_cache.get_vm(row)
 
+        if not vm.loaded:
+            return self.placeholder_data(vm, col_name, role)
+
         if role == Qt.DisplayRole:
             if col in [0, 1]:
                 return None
-            if col_name == "Name":
-                return vm.name
-            if col_name == "State":
-                return vm.state
-            if col_name == "Template":
-                if vm.template is None:
-                    return vm.klass
-                return vm.template
-            if col_name == "NetVM":
-                return vm.netvm
-            if col_name == "Disk Usage":
-                return vm.disk
-            if col_name == "Internal":
-                return "Yes" if vm.internal else ""
-            if col_name == "IP":
-                return vm.ip
-            if col_name == "Last backup":
-                return vm.last_backup
-            if col_name == "Default DispVM":
-                return vm.dvm
-            if col_name == "Is DVM Template":
-                return "Yes" if vm.dvm_template else ""
-            if col_name == "Virt Mode":
-                return vm.virt_mode
+            return self.display_value(vm, col_name)
         if role == Qt.DecorationRole:
             if col_name == "Type":
                 try:
@@ -461,36 +518,151 @@ class QubesTableModel(QAbstractTableModel):
             return vm
         # Used for sorting
         if role == Qt.UserRole + 1:
-            if vm.klass == 'AdminVM':
-                return ""
-            if col_name == "Type":
+            return self.sort_value(vm, col_name)
+        return None
+
+    def display_value(self, vm, col_name):
+        # pylint: disable=too-many-return-statements
+        if col_name == "Name":
+            return vm.name
+        if col_name == "State":
+            return vm.state
+        if col_name == "Template":
+            if vm.template is None:
                 return vm.klass
-            if col_name == "Label":
-                vmtype, vmcolor = vm.icon.split("-")
-                try:
-                    processed_color = str(vm.label.index)
-                except ValueError:
-                    processed_color = vmcolor
-                return vmtype + processed_color
-            if col_name == "State":
-                # sorting order is based on a logical order (from running to
-                # progressively less running) and update state
-                state = vm.state.get('power', '')
-                try:
-                    ordered_state = str(
-                        ["Running", "Transient", "Halting", "Paused",
-                         "Suspended", "Dying", "Crashed",
-                         "Halted", "NA"].index(state))
-                except ValueError:
-                    ordered_state = state
-                updated = vm.state.get('outdated', '')
-                return ordered_state + updated
-            if col_name == "Disk Usage":
-                return vm.disk_float
-            if col_name == "Backup":
-                # sort True before False, hence the not
-                return not vm.inc_backup
-            return self.data(index, Qt.DisplayRole)
+            return vm.template
+        if col_name == "NetVM":
+            return vm.netvm
+        if col_name == "Disk Usage":
+            return vm.disk
+        if col_name == "Internal":
+            return "Yes" if vm.internal else ""
+        if col_name == "IP":
+            return vm.ip
+        if col_name == "Last backup":
+            return vm.last_backup
+        if col_name == "Default DispVM":
+            return vm.dvm
+        if col_name == "Is DVM Template":
+            return "Yes" if vm.dvm_template else ""
+        if col_name == "Virt Mode":
+            return vm.virt_mode
+        return None
+
+    def sort_value(self, vm, col_name):
+        # pylint: disable=too-many-return-statements
+        if vm.klass == 'AdminVM':
+            return ""
+        if col_name == "Type":
+            return vm.klass
+        if col_name == "Label":
+            vmtype, vmcolor = vm.icon.split("-")
+            try:
+                processed_color = str(vm.label.index)
+            except ValueError:
+                processed_color = vmcolor
+            return vmtype + processed_color
+        if col_name == "State":
+            # sorting order is based on a logical order (from running to
+            # progressively less running) and update state
+            state = vm.state.get('power', '')
+            try:
+                ordered_state = str(
+                    ["Running", "Transient", "Halting", "Paused",
+                     "Suspended", "Dying", "Crashed",
+                     "Halted", "NA"].index(state))
+            except ValueError:
+                ordered_state = state
+            updated = vm.state.get('outdated', '')
+            return ordered_state + updated
+        if col_name == "Disk Usage":
+            return vm.disk_float
+        if col_name == "Backup":
+            # sort True before False, hence the not
+            return not vm.inc_backup
+        return self.display_value(vm, col_name)
+
+    def sort_key(self, vm, col_name):
+        """Returns key ordering qubes by the Qt.UserRole + 1 data of the
+        column (case insensitive), then by name"""
+        if vm.loaded:
+            value = self.sort_value(vm, col_name)
+        else:
+            value = self.placeholder_data(vm, col_name, Qt.UserRole + 1)
+        name = vm.name.lower()
+        if value is None:
+            return (0, 0, name)
+        if isinstance(value, str):
+            return (2, value.lower(), name)
+        return (1, value, name)
+
+    def check_order(self, rows):
+        """Marks the cache as not sorted if any of the given (changed or
+        added) rows is out of order with its neighbours"""
+        if not self.sorted or self.sort_column < 0:
+            return
+        col_name = self.columns_indices[self.sort_column]
+        reverse = self.sort_order == Qt.DescendingOrder
+        for row in rows:
+            first = max(row - 1, 0)
+            last = min(row + 1, len(self.qubes_cache) - 1)
+            keys = [self.sort_key(self.qubes_cache.get_vm(i), col_name)
+                    for i in range(first, last + 1)]
+            if keys != sorted(keys, reverse=reverse):
+                self.sorted = False
+                return
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        """Sorts the rows of the cache itself, so that views (through
+        QubesProxyModel) only follow its order; keys are computed once per
+        row instead of comparing model data for each pair of rows. Rows
+        already in that order are not sorted again.
+        :return: True if the rows were sorted (and layoutChanged emitted)
+        """
+        order = Qt.SortOrder(order)
+        if column == self.sort_column and order == self.sort_order and \
+                (column < 0 or self.sorted):
+            return False
+        self.sort_column = column
+        self.sort_order = order
+        if column < 0:
+            return False
+        col_name = self.columns_indices[column]
+
+        hint = QAbstractItemModel.VerticalSortHint
+        self.layoutAboutToBeChanged.emit([], hint)
+        persistent = self.persistentIndexList()
+        names = [self.qubes_cache.get_vm(index.row()).name
+                 for index in persistent]
+        self.qubes_cache.sort(
+            key=lambda vm: self.sort_key(vm, col_name),
+            reverse=order == Qt.DescendingOrder)
+        rows = {vm.name: row for row, vm in enumerate(self.qubes_cache)}
+        self.changePersistentIndexList(
+            persistent, [self.index(rows[name], index.column())
+                         for name, index in zip(names, persistent)])
+        self.sorted = True
+        self.layoutChanged.emit([], hint)
+        return True
+
+    def placeholder_data(self, vm, col_name, role):
+        # pylint: disable=too-many-return-statements
+        if role == Qt.DisplayRole:
+            if col_name == "Name":
+                return vm.name
+            if col_name == "Template":
+                return self.tr("loading...")
+            return None
+        if role == Qt.ForegroundRole:
+            return QColor("gray")
+        if role == Qt.UserRole:
+            return vm
+        if role == Qt.UserRole + 1:
+            # equal to each other, so that they are sorted by name
+            if col_name == "Name":
+                return vm.name
+            return None
+        return None
 
     # pylint: disable=invalid-name
     def headerData(self, col, orientation, role):
@@ -508,6 +680,8 @@ class QubesTableModel(QAbstractTableModel):
             col_name = self.columns_indices[index.column()]
             if col_name == "Backup":
                 vm = self.qubes_cache.get_vm(index.row())
+                if not vm.loaded:
+                    return False
                 vm.vm.include_in_backups = (value == Qt.Checked)
                 vm.inc_backup = (value == Qt.Checked)
                 return True
@@ -526,6 +700,9 @@ vm_restart_check_timeout = 1000  # in msec
 
 
 class VmShutdownMonitor(QObject):
+    # emitted once the qube is not checked anymore
+    finished = pyqtSignal()
+
     def __init__(self, vm, check_time=vm_restart_check_timeout,
                  and_restart=False, caller=None):
         QObject.__init__(self)
@@ -594,7 +771,9 @@ class VmShutdownMonitor(QObject):
                         # shutting it down
                         pass
                     self.restart_vm_if_needed()
+                    self.finished.emit()
                 elif msgbox.clickedButton() is ignore_button:
+                    self.finished.emit()
                     return
                 else:
                     self.shutdown_started = datetime.now()
@@ -611,6 +790,7 @@ class VmShutdownMonitor(QObject):
                 return
 
             self.restart_vm_if_needed()
+            self.finished.emit()
 
 
 # pylint: disable=too-few-public-methods
@@ -626,20 +806,15 @@ class StartVMThread(common_threads.QubesThread):
 class UpdateVMThread(common_threads.QubesThread):
     def run(self):
         try:
-            if self.vm.klass == 'AdminVM':
-                subprocess.check_call(
-                    ["/usr/bin/qubes-dom0-update", "--clean", "--gui"])
-            else:
-                if not manager_utils.is_running(self.vm, False):
-                    try:
-                        self.vm.start()
-                    except exc.QubesDaemonAccessError:
-                        # permission denied, let us hope for the best
-                        pass
-                self.vm.run_service("qubes.InstallUpdatesGUI",
-                                    user="root", wait=False)
-        except (ChildProcessError, subprocess.CalledProcessError,
-                exc.QubesException) as ex:
+            if not manager_utils.is_running(self.vm, False):
+                try:
+                    self.vm.start()
+                except exc.QubesDaemonAccessError:
+                    # permission denied, let us hope for the best
+                    pass
+            self.vm.run_service("qubes.InstallUpdatesGUI",
+                                user="root", wait=False)
+        except (ChildProcessError, exc.QubesException) as ex:
             self.msg = (self.tr("Error on qube update!"), str(ex))
 
 
@@ -656,46 +831,73 @@ class RunCommandThread(common_threads.QubesThread):
                 exc.QubesException) as ex:
             self.msg = (self.tr("Error while running command!"), str(ex))
 
+
 class QubesProxyModel(QSortFilterProxyModel):
-    def __init__(self, window):
+    """Filters rows of QubesTableModel. The proxy itself is never sorted,
+    sorting is passed to the source model (see QubesTableModel.sort) and
+    the rows keep its order."""
+    def __init__(self):
         super().__init__()
-        self.window = window
+        # shown kinds of qubes (see ViewPreset.show_options) and lowercase
+        # search query, kept here so that filtering a row needs no widgets
+        self.show = frozenset(ViewPreset.show_options)
+        self.search = ""
 
-    def lessThan(self, left, right):
-        if left.data(self.sortRole()) != right.data(self.sortRole()):
-            return super().lessThan(left, right)
+    def set_filter(self, show, search):
+        """Sets the filters, without filtering the rows again"""
+        self.show = frozenset(show)
+        self.search = search.lower()
 
-        left_vm = left.data(Qt.UserRole)
-        right_vm = right.data(Qt.UserRole)
+    def sort(self, column, order=Qt.AscendingOrder):
+        # the source model emits layoutChanged, which filters rows again
+        return self.sourceModel().sort(column, order)
 
-        return left_vm.name.lower() < right_vm.name.lower()
+    # pylint: disable=invalid-name
+    def sortColumn(self):
+        return self.sourceModel().sort_column
+
+    # pylint: disable=invalid-name
+    def sortOrder(self):
+        return self.sourceModel().sort_order
+
+    def invalidate(self):
+        """Filters the rows again, and sorts them if they got out of
+        order"""
+        if not self.sort(self.sortColumn(), self.sortOrder()):
+            self.invalidateFilter()
+
+    def apply_view(self, show, search, sort_column, sort_order):
+        """Sets filters and sorting together, so that the rows are filtered
+        and sorted only once"""
+        self.set_filter(show, search)
+        if not self.sort(sort_column, sort_order):
+            self.invalidateFilter()
 
     # pylint: disable=too-many-return-statements
-    def filterAcceptsRow(self, sourceRow, sourceParent):
-        if self.window.show_all.isChecked():
-            return super().filterAcceptsRow(sourceRow, sourceParent)
-
-        index = self.sourceModel().index(sourceRow, 0, sourceParent)
-        vm = self.sourceModel().data(index, Qt.UserRole)
-
-        if self.window.show_running.isChecked() and \
-                vm.state['power'] != 'Halted':
-            return super().filterAcceptsRow(sourceRow, sourceParent)
-        if self.window.show_halted.isChecked() and \
-                vm.state['power'] == 'Halted':
-            return super().filterAcceptsRow(sourceRow, sourceParent)
-        if self.window.show_network.isChecked() and \
+    def filterAcceptsRow(self, sourceRow, _sourceParent):
+        vm = self.sourceModel().qubes_cache.get_vm(sourceRow)
+
+        if self.search and self.search not in vm.name.lower():
+            return False
+        if 'all' in self.show:
+            return True
+
+        if 'running' in self.show and vm.state['power'] != 'Halted':
+            return True
+        if 'halted' in self.show and vm.state['power'] == 'Halted':
+            return True
+        if 'network' in self.show and \
                 getattr(vm.vm, 'provides_network', False):
-            return super().filterAcceptsRow(sourceRow, sourceParent)
-        if self.window.show_templates.isChecked() and vm.klass == 'TemplateVM':
-            return super().filterAcceptsRow(sourceRow, sourceParent)
-        if self.window.show_standalone.isChecked() \
-                and vm.klass == 'StandaloneVM':
-            return super().filterAcceptsRow(sourceRow, sourceParent)
+            return True
+        if 'templates' in self.show and vm.klass == 'TemplateVM':
+            return True
+        if 'standalone' in self.show and vm.klass == 'StandaloneVM':
+            return True
 
         return False
 
 
+# pylint: disable=too-many-instance-attributes
 class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
     # suppress saving settings while initializing widgets
     settings_loaded = False
@@ -704,7 +906,9 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
         super().__init__()
         self.setupUi(self)
 
-        self.manager_settings = QSettings(self)
+        # written out in batches, resizing or re-sorting writes often
+        self.manager_settings = manager_utils.BufferedSettings(
+            QSettings(self), parent=self)
 
         self.qubes_app = qubes_app
         self.qt_app = qt_app
@@ -718,13 +922,15 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
         self.search_shortcut = QShortcut(QKeySequence('Ctrl+F'), self)
         self.search_shortcut.activated.connect(self.searchbox.setFocus)
 
-        self.settings_windows = {}
+        self.settings_windows = manager_utils.OpenWindows(self)
+        # workers of the fancy manager installations, created when needed
+        self.worker_pool = None
 
         self.frame_width = 0
         self.frame_height = 0
 
         self.init_template_menu()
-        self.init_network_menu()
+        # the network menu is filled once the qubes are loaded, see fill_cache
         self.__init_context_menu()
 
         self.tools_context_menu = QMenu(self)
@@ -749,12 +955,8 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
         self.fill_cache()
         self.qubes_model = QubesTableModel(self.qubes_cache)
 
-        self.proxy = QubesProxyModel(self)
+        self.proxy = QubesProxyModel()
         self.proxy.setSourceModel(self.qubes_model)
-        self.proxy.setSortRole(Qt.UserRole + 1)
-        self.proxy.setSortCaseSensitivity(Qt.CaseInsensitive)
-        self.proxy.setFilterKeyColumn(2)
-        self.proxy.setFilterCaseSensitivity(Qt.CaseInsensitive)
         self.proxy.layoutChanged.connect(self.save_sorting)
         self.proxy.layoutChanged.connect(self.update_template_menu)
         self.proxy.layoutChanged.connect(self.update_network_menu)
@@ -775,6 +977,8 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
         self.table.setContextMenuPolicy(Qt.CustomContextMenu)
         self.table.customContextMenuRequested.connect(self.open_context_menu)
 
+        self.__init_group_view()
+
         # Create view menu
         for col_no, column in enumerate(self.qubes_model.columns_indices):
             action = self.menu_view.addAction(column)
@@ -788,6 +992,10 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
         self.menu_view.addSeparator()
         self.menu_view.addAction(self.action_compact_view)
 
+        self.preset_menu = self.menu_view.addMenu(self.tr("Views"))
+        self.init_preset_menu()
+        self.__init_group_menu()
+
         try:
             self.load_manager_settings()
         except Exception as ex:  # pylint: disable=broad-except
@@ -803,7 +1011,7 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
         # Connect events
         self.dispatcher = dispatcher
         dispatcher.add_handler('connection-established',
-                               self.qubes_cache.update_model_data)
+                               self.on_connection_established)
         dispatcher.add_handler('domain-pre-start',
                                self.on_domain_status_changed)
         dispatcher.add_handler('domain-start', self.on_domain_status_changed)
@@ -835,11 +1043,10 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
         dispatcher.add_handler('domain-feature-delete:updates-available',
                                self.on_domain_updates_available)
 
-        # It needs to store threads until they finish
-        self.threads_list = []
-        self.progress = None
+        self.__init_threads()
 
-        self.check_updates()
+        # the window is shown with placeholders, filled in as they load
+        self.cache_loader.start()
 
     def change_template(self, template):
         selected_vms = self.get_selected_vms()
@@ -907,6 +1114,48 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
                     .format(error[0]), error[1])
 
 
+    def __init_group_view(self):
+        # optional tree of grouped qubes, shown instead of the table
+        self.group_model = None
+        self.group_view = QTreeView(self.centralwidget)
+        self.group_view.setAlternatingRowColors(True)
+        self.group_view.setUniformRowHeights(True)
+        self.group_view.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.group_view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.group_view.setItemDelegateForColumn(3, StateIconDelegate())
+        self.group_view.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.group_view.customContextMenuRequested.connect(
+            self.open_context_menu)
+        self.group_view.hide()
+        self.gridLayout.addWidget(self.group_view, 1, 0, 1, 1)
+
+    def __init_group_menu(self):
+        self.group_menu = self.menu_view.addMenu(self.tr("Group by"))
+        self.group_actions = QActionGroup(self)
+        for group_by, title in ((None, self.tr("None")),
+                                ('template', self.tr("Template")),
+                                ('netvm', self.tr("NetVM")),
+                                ('label', self.tr("Label")),
+                                ('klass', self.tr("Type"))):
+            action = self.group_menu.addAction(title)
+            action.setData(group_by)
+            action.setCheckable(True)
+            action.setChecked(group_by is None)
+            self.group_actions.addAction(action)
+            action.toggled.connect(
+                lambda checked, group_by=group_by:
+                checked and self.set_group_by(group_by))
+
+    def __init_threads(self):
+        # It needs to store threads until they finish
+        self.threads_list = []
+        self.progress = None
+        self.resync_thread = None
+        self.resync_pending = False
+
+        # external tools are started without waiting for them
+        self.launcher = common_threads.get_process_launcher()
+
     def __init_context_menu(self):
         self.context_menu = QMenu(self)
         self.context_menu.addAction(self.action_settings)
@@ -950,27 +1199,88 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
         self.manager_settings.setValue('view/sort_order',
                 self.proxy.sortOrder())
 
+    def get_shown(self):
+        """Returns the ViewPreset.show_options checked in the show_*
+        checkboxes"""
+        return {option for option in ViewPreset.show_options
+                if getattr(self, 'show_' + option).isChecked()}
+
     def invalidate(self):
+        self.proxy.set_filter(self.get_shown(), self.searchbox.text())
         self.proxy.invalidate()
         self.table.resizeColumnsToContents()
+        if self.group_model is not None:
+            self.group_model.rebuild()
+            self.group_view.expandAll()
+
+    def set_group_by(self, group_by):
+        """Shows qubes grouped by the given attribute (one of
+        QubesGroupModel.group_by_options) in a tree, or in the flat table
+        if group_by is None"""
+        if self.settings_loaded:
+            self.manager_settings.setValue('view/group_by', group_by or "")
 
-    def fill_cache(self):
-        progress = QProgressDialog(
-            self.tr(
-                "Loading Qube Manager..."), "", 0,
-                len(self.qubes_app.domains.keys()))
-        progress.setWindowTitle(self.tr("Qube Manager"))
-        progress.setMinimumDuration(1000)
-        progress.setWindowModality(Qt.WindowModal)
-        progress.setCancelButton(None)
-
-        row_no = 0
-        for vm in self.qubes_app.domains:
-            progress.setValue(row_no)
-            self.qubes_cache.add_vm(vm)
-            row_no += 1
+        if group_by is None:
+            self.group_view.hide()
+            self.table.show()
+            self.table_selection_changed()
+            return
+
+        if self.group_model is None:
+            self.group_model = QubesGroupModel(
+                self.qubes_model, group_by,
+                lambda row: self.proxy.filterAcceptsRow(row, QModelIndex()))
+            self.group_model.rowsInserted.connect(self.on_groups_inserted)
+            self.group_view.setModel(self.group_model)
+            self.group_view.selectionModel().selectionChanged.connect(
+                self.table_selection_changed)
+            for col_no in range(self.qubes_model.columnCount(None)):
+                self.group_view.setColumnHidden(
+                    col_no, self.table.isColumnHidden(col_no))
+        else:
+            self.group_model.group_by = group_by
+            self.group_model.rebuild()
+
+        self.group_view.expandAll()
+        self.table.hide()
+        self.group_view.show()
+        self.table_selection_changed()
 
-        progress.setValue(row_no)
+    def on_groups_inserted(self, parent, first, last):
+        if not parent.isValid():
+            for row in range(first, last + 1):
+                self.group_view.expand(self.group_model.index(row, 0))
+
+    def is_grouped(self):
+        return self.group_model is not None and \
+            not self.group_view.isHidden()
+
+    def fill_cache(self):
+        """Adds placeholders of all domains (a single qubesd call lists them)
+        and loads the rest in the background, chunk by chunk"""
+        domains = list(self.qubes_app.domains)
+        for vm in domains:
+            self.qubes_cache.add_placeholder(vm)
+
+        self.cache_loader = CacheLoaderThread(domains)
+        self.cache_loader.chunk_loaded.connect(self.on_chunk_loaded)
+        self.cache_loader.finished.connect(self.init_network_menu)
+
+    def resume_cache_loader(self):
+        """Loads the placeholders left when the loader was stopped by
+        closing the window"""
+        placeholders = self.qubes_cache.get_placeholders()
+        if placeholders and self.cache_loader.isFinished():
+            self.cache_loader = CacheLoaderThread(placeholders)
+            self.cache_loader.chunk_loaded.connect(self.on_chunk_loaded)
+            self.cache_loader.finished.connect(self.init_network_menu)
+            self.cache_loader.start()
+
+    def on_chunk_loaded(self, vm_infos):
+        rows = self.qubes_cache.replace_placeholders(vm_infos)
+        self.qubes_model.rows_loaded(rows)
+        self.proxy.invalidate()
+        self.table_selection_changed()
 
     def init_template_menu(self):
         self.template_menu.clear()
@@ -981,11 +1291,13 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
                 action.triggered.connect(partial(self.change_template, vm.name))
 
     def _get_default_netvm(self):
-        for vm in self.qubes_app.domains:
-            if vm.klass == 'AppVM':
-                return vm.property_get_default('netvm')
+        for vm_info in self.qubes_cache:
+            if vm_info.klass == 'AppVM':
+                return vm_info.vm.property_get_default('netvm')
 
     def init_network_menu(self):
+        """Fills the menu from the loaded qubes, without a qubesd call for
+        each of them"""
         default = self._get_default_netvm()
         self.network_menu.clear()
         action = self.network_menu.addAction("None")
@@ -993,11 +1305,13 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
         action = self.network_menu.addAction("default ({0})".format(default))
         action.triggered.connect(partial(self.change_network, 'default'))
 
-        for vm in self.qubes_app.domains:
-            if vm.qid != 0 and vm.provides_network:
-                action = self.network_menu.addAction(vm.name)
-                action.setData(vm.name)
-                action.triggered.connect(partial(self.change_network, vm.name))
+        for vm_info in self.qubes_cache:
+            # placeholders do not know yet
+            if vm_info.qid != 0 and vm_info.provides_network:
+                action = self.network_menu.addAction(vm_info.name)
+                action.setData(vm_info.name)
+                action.triggered.connect(
+                    partial(self.change_network, vm_info.name))
 
     def setup_application(self):
         self.qt_app.setApplicationName(self.tr("Qube Manager"))
@@ -1037,24 +1351,61 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
     def resizeEvent(self, event):
         self.manager_settings.setValue("window_size", event.size())
 
-    def check_updates(self, info=None):
-        if info is None:
-            for info_iter in self.qubes_cache:
-                self.check_updates(info_iter)
+    def on_connection_established(self, *_args, **_kwargs):
+        if self.resync_thread is not None:
+            # reconnected again while resyncing; start over once finished
+            self.resync_pending = True
             return
-
+        states = self.qubes_cache.get_states()
         try:
-            if info.vm.klass in {'TemplateVM', 'StandaloneVM'} and \
-                    manager_utils.get_feature(
-                        info.vm, 'updates-available', False):
-                info.state['outdated'] = 'update'
-        except exc.QubesDaemonAccessError:
+            # a single admin.vm.List call for names and power states; done
+            # here, as the domain collection is shared with the GUI thread
+            self.qubes_app.domains.refresh_cache(force=True)
+            vms = list(self.qubes_app.domains)
+        except exc.QubesException as ex:
+            # the next connection-established will retry
+            manager_utils.debug("resync failed: {}".format(ex))
             return
+        self.resync_thread = ResyncThread(vms, states)
+        self.resync_thread.finished.connect(self.on_resync_finished)
+        self.resync_thread.start()
+
+    def on_resync_finished(self):
+        thread = self.resync_thread
+        self.resync_thread = None
+
+        if thread.isInterruptionRequested():
+            # stopped by closing the window, its results are incomplete;
+            # started over once the window is shown again
+            self.resync_pending = True
+
+        elif thread.msg is None:
+            self.qubes_model.apply_changes(
+                thread.added, thread.changed, thread.removed)
+            self.proxy.invalidate()
+            if thread.added or thread.removed:
+                self.init_template_menu()
+                self.init_network_menu()
+            self.table_selection_changed()
+
+        else:
+            # qubesd is probably gone again, the next connection-established
+            # will retry
+            manager_utils.debug("resync failed: {}".format(thread.msg))
+
+        if self.resync_pending and self.isVisible():
+            self.resync_pending = False
+            self.on_connection_established()
 
     def on_domain_added(self, _submitter, _event, vm, **_kwargs):
         try:
             domain = self.qubes_app.domains[vm]
+            row_count = len(self.qubes_cache)
             self.qubes_cache.add_vm(domain)
+            if len(self.qubes_cache) > row_count:
+                self.qubes_model.rows_added()
+            else:
+                self.qubes_model.vm_changed(domain.name)
             self.proxy.invalidate()
             if domain.klass == 'TemplateVM':
                 self.init_template_menu()
@@ -1062,18 +1413,20 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
             pass
 
     def on_domain_removed(self, _submitter, _event, **kwargs):
-        self.qubes_cache.remove_vm(name=kwargs['vm'])
+        self.qubes_model.remove_vm(kwargs['vm'])
         self.proxy.invalidate()
         self.init_template_menu()
         self.init_network_menu()
 
     def on_domain_status_changed(self, vm, event, **_kwargs):
         try:
-            self.qubes_cache.get_vm(qid=vm.qid).update(event=event)
+            self.qubes_cache.get_vm(name=vm.name).update(event=event)
+            self.qubes_model.vm_changed(vm.name)
             if vm.klass in {'TemplateVM'}:
                 for appvm in vm.appvms:
-                    self.qubes_cache.get_vm(qid=appvm.qid).\
+                    self.qubes_cache.get_vm(name=appvm.name).\
                             update(event="outdated")
+                    self.qubes_model.vm_changed(appvm.name)
             self.proxy.invalidate()
             self.table_selection_changed()
         except (exc.QubesDaemonAccessError, exc.QubesVMNotFoundError):
@@ -1081,8 +1434,17 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
         except KeyError:  # adding the VM failed for some reason
             self.on_domain_added(None, None, vm)
 
-    def on_domain_updates_available(self, vm, _event, **_kwargs):
-        self.check_updates(self.qubes_cache.get_vm(qid=vm.qid))
+    def on_domain_updates_available(self, vm, event, **kwargs):
+        try:
+            info = self.qubes_cache.get_vm(name=vm.name)
+        except KeyError:
+            return
+        if event.startswith('domain-feature-set:'):
+            info.set_updates_available(kwargs.get('value', False))
+        else:
+            info.set_updates_available(False)
+        self.qubes_model.vm_changed(vm.name)
+        self.proxy.invalidate()
 
     def on_domain_changed(self, vm, event, **_kwargs):
         if not vm:  # change of global properties occured
@@ -1092,42 +1454,20 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
             if event.endswith(':default_dispvm'):
                 for vm_info in self.qubes_cache:
                     vm_info.update(event='property-set:default_dispvm')
+            self.qubes_model.all_changed()
             return
 
         try:
+            self.qubes_cache.get_vm(name=vm.name).update(event=event)
             if event.endswith(':provides_network'):
                 self.init_network_menu()
-            self.qubes_cache.get_vm(qid=vm.qid).update(event=event)
+            self.qubes_model.vm_changed(vm.name)
             self.proxy.invalidate()
         except exc.QubesDaemonAccessError:
             return  # the VM was deleted before its status could be updated
 
     def load_manager_settings(self):
-        # Load view menu settings
-        # QSettings stores True as 'true' string and False as 'false' string
-        for action in self.menu_view.actions():
-            column = action.data()
-            if column is not None:
-                col_no = self.qubes_model.columns_indices.index(column)
-                if column == 'Name':
-                    # 'Name' column should be always visible
-                    action.setChecked(True)
-                else:
-                    visible = self.manager_settings.value('columns/%s' % column,
-                        defaultValue="true")
-                    action.setChecked(visible == "true")
-                    self.showhide_column(col_no, visible == "true")
-
-        # Restore sorting
-        sort_column = int(self.manager_settings.value("view/sort_column",
-                                 defaultValue=2))
-        order = Qt.SortOrder(self.manager_settings.value("view/sort_order",
-                                 defaultValue=Qt.AscendingOrder))
-
-        if not sort_column: # Default sort by name
-            self.table.sortByColumn(2, Qt.AscendingOrder)
-        else:
-            self.table.sortByColumn(sort_column, order)
+        self.apply_view_preset(self.load_view_preset())
 
         if self.manager_settings.value("view/menubar_visible") == 'false':
             self.action_menubar.setChecked(False)
@@ -1138,28 +1478,141 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
         if self.manager_settings.value("view/compactview",
                                            defaultValue="false") != "false":
             self.action_compact_view.setChecked(True)
-
-        # Restore show checkboxes
-        self.show_running.setChecked(self.manager_settings.value(
-            'show/running', "true") == "true")
-        self.show_halted.setChecked(self.manager_settings.value(
-            'show/halted', "true") == "true")
-        self.show_network.setChecked(self.manager_settings.value(
-            'show/network', "true") == "true")
-        self.show_templates.setChecked(self.manager_settings.value(
-            'show/templates', "true") == "true")
-        self.show_standalone.setChecked(self.manager_settings.value(
-            'show/standalone', "true") == "true")
-        self.show_all.setChecked(self.manager_settings.value(
-            'show/all', "true") == "true")
+        group_by = self.manager_settings.value("view/group_by",
+                                               defaultValue="")
+        for action in self.group_actions.actions():
+            if group_by and action.data() == group_by:
+                action.setChecked(True)
 
         # load last window size
         self.resize(self.manager_settings.value("window_size",
                                                 QSize(1100, 600)))
 
+    def load_view_preset(self):
+        """Returns the view last used, as saved by save_showing,
+        save_sorting and showhide_column"""
+        # QSettings stores True as 'true' string and False as 'false' string
+        show = [option for option in ViewPreset.show_options
+                if self.manager_settings.value(
+                    'show/' + option, "true") == "true"]
+        hidden_columns = [
+            column for column in self.qubes_model.columns_indices
+            if column != 'Name' and self.manager_settings.value(
+                'columns/%s' % column, defaultValue="true") != "true"]
+
+        sort_column = int(self.manager_settings.value("view/sort_column",
+                                 defaultValue=2))
+        order = Qt.SortOrder(int(self.manager_settings.value(
+            "view/sort_order", defaultValue=Qt.AscendingOrder)))
+        if not sort_column: # Default sort by name
+            sort_column, order = 2, Qt.AscendingOrder
+
+        return ViewPreset(show, sort_column, order, hidden_columns)
+
+    def get_view_preset(self):
+        """Returns the current view"""
+        return ViewPreset(
+            show=self.get_shown(),
+            sort_column=self.proxy.sortColumn(),
+            sort_order=self.proxy.sortOrder(),
+            hidden_columns=[
+                column for col_no, column
+                in enumerate(self.qubes_model.columns_indices)
+                if self.table.isColumnHidden(col_no)],
+            search=self.searchbox.text())
+
+    def apply_view_preset(self, preset):
+        """Applies the view at once: the widgets are set with their signals
+        blocked, as each of them would filter or sort the table again, and
+        the table is then filtered and sorted only once"""
+        widgets = [getattr(self, 'show_' + option)
+                   for option in ViewPreset.show_options]
+        widgets += [self.searchbox, self.table.horizontalHeader()]
+        column_actions = {action.data(): action
+                          for action in self.menu_view.actions()
+                          if action.data() is not None}
+        widgets += column_actions.values()
+
+        blocked = [widget.blockSignals(True) for widget in widgets]
+        try:
+            for option in ViewPreset.show_options:
+                getattr(self, 'show_' + option).setChecked(
+                    option in preset.show)
+            self.searchbox.setText(preset.search)
+            self.table.horizontalHeader().setSortIndicator(
+                preset.sort_column, preset.sort_order)
+            for col_no, column in enumerate(self.qubes_model.columns_indices):
+                # 'Name' column should be always visible
+                show = column == 'Name' or column not in preset.hidden_columns
+                if column in column_actions:
+                    column_actions[column].setChecked(show)
+                self.showhide_column(col_no, show)
+        finally:
+            for widget, was_blocked in zip(widgets, blocked):
+                widget.blockSignals(was_blocked)
+
+        self.proxy.apply_view(preset.show, preset.search,
+                              preset.sort_column, preset.sort_order)
+        if self.group_model is not None:
+            self.group_model.rebuild()
+            self.group_view.expandAll()
+        if self.settings_loaded:
+            self.save_showing()
+
+    def get_view_presets(self):
+        """Returns dict of name: ViewPreset of the saved presets"""
+        try:
+            presets = json.loads(self.manager_settings.value(
+                'view/presets', defaultValue="{}"))
+            return {name: ViewPreset.from_dict(data)
+                    for name, data in presets.items()}
+        except (TypeError, ValueError, AttributeError):
+            return {}
+
+    def set_view_presets(self, presets):
+        self.manager_settings.setValue('view/presets', json.dumps(
+            {name: preset.to_dict() for name, preset in presets.items()}))
+        self.init_preset_menu()
+
+    def init_preset_menu(self):
+        self.preset_menu.clear()
+        for name, preset in sorted(self.get_view_presets().items()):
+            action = self.preset_menu.addAction(name)
+            action.triggered.connect(
+                partial(self.apply_view_preset, preset))
+        self.preset_menu.addSeparator()
+        self.preset_menu.addAction(
+            self.tr("Save current view...")).triggered.connect(
+                self.save_view_preset)
+        delete_action = self.preset_menu.addAction(self.tr("Delete..."))
+        delete_action.triggered.connect(self.delete_view_preset)
+        delete_action.setEnabled(bool(self.get_view_presets()))
+
+    def save_view_preset(self):
+        name, ok = QInputDialog.getText(
+            self, self.tr("Save view"), self.tr("Name of the view:"))
+        if not ok or not name.strip():
+            return
+        presets = self.get_view_presets()
+        presets[name.strip()] = self.get_view_preset()
+        self.set_view_presets(presets)
+
+    def delete_view_preset(self):
+        presets = self.get_view_presets()
+        name, ok = QInputDialog.getItem(
+            self, self.tr("Delete view"), self.tr("View to delete:"),
+            sorted(presets), editable=False)
+        if ok and name in presets:
+            del presets[name]
+            self.set_view_presets(presets)
+
     @pyqtSlot(str)
     def do_search(self, search):
-        self.proxy.setFilterFixedString(search)
+        self.proxy.set_filter(self.get_shown(), search)
+        self.proxy.invalidateFilter()
+        if self.group_model is not None:
+            self.group_model.rebuild()
+            self.group_view.expandAll()
 
     # noinspection PyArgumentList
     @pyqtSlot(name='on_action_search_triggered')
@@ -1169,13 +1622,18 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
     def get_selected_vms(self):
         vms = []
 
-        selection = self.table.selectionModel().selection()
-        indexes = self.proxy.mapSelectionToSource(selection).indexes()
+        if self.is_grouped():
+            indexes = self.group_view.selectionModel().selection().indexes()
+        else:
+            selection = self.table.selectionModel().selection()
+            indexes = self.proxy.mapSelectionToSource(selection).indexes()
 
         for index in indexes:
             if index.column() != 0:
                 continue
-            vms.append(index.data(Qt.UserRole))
+            vm = index.data(Qt.UserRole)
+            if vm is not None:  # not a group
+                vms.append(vm)
 
         return vms
 
@@ -1298,9 +1756,12 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
     # noinspection PyArgumentList
     @pyqtSlot(name='on_action_create3rd_triggered')
     def action_create3rd_triggered(self):
+        if self.worker_pool is None:
+            self.worker_pool = worker_pool.WorkerPool(
+                self.qubes_app, self.manager_settings, self)
         with common_threads.busy_cursor():
             create_window = create_worker.NewWorkerDlg(
-                    self.qt_app, self.qubes_app, self)
+                    self.qt_app, self.qubes_app, self, self.worker_pool)
         create_window.exec_()
 
     # noinspection PyArgumentList
@@ -1472,12 +1933,20 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
 
         self.shutdown_monitor[vm.qid] = VmShutdownMonitor(vm, check_time,
                                                           and_restart, self)
+        self.shutdown_monitor[vm.qid].finished.connect(
+            self.shutdown_monitor_finished)
         # noinspection PyCallByClass,PyTypeChecker
         QTimer.singleShot(check_time, self.shutdown_monitor[
             vm.qid].check_if_vm_has_shutdown)
 
         return True
 
+    def shutdown_monitor_finished(self):
+        monitor = self.sender()
+        for qid, vm_monitor in list(self.shutdown_monitor.items()):
+            if vm_monitor is monitor:
+                del self.shutdown_monitor[qid]
+
     # noinspection PyArgumentList
     @pyqtSlot(name='on_action_restartvm_triggered')
     def action_restartvm_triggered(self):
@@ -1548,7 +2017,7 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
                 settings_window = settings.VMSettingsWindow(
                     vm, tab, self.qt_app, self.qubes_app, self)
             settings_window.show()
-            self.settings_windows[vm.name] = settings_window
+            self.settings_windows.add(vm.name, settings_window)
         except exc.QubesException as ex:
             QMessageBox.warning(
                 self,
@@ -1559,8 +2028,24 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
                     "\nError: {}".format(str(ex))))
             return
 
+    def showEvent(self, event):
+        super().showEvent(event)
+        # the window is kept around and shown again by the app server
+        self.resume_cache_loader()
+        if self.resync_pending and self.resync_thread is None:
+            self.resync_pending = False
+            self.on_connection_established()
+
     def closeEvent(self, _):
         self.save_showing()
+        self.manager_settings.flush()
+        # a QThread must not be destroyed while running
+        for thread in (self.cache_loader, self.resync_thread):
+            if thread is not None:
+                thread.requestInterruption()
+                thread.wait()
+        if self.worker_pool is not None:
+            self.worker_pool.shutdown_idle()
 
     # noinspection PyArgumentList
     @pyqtSlot(name='on_action_settings_triggered')
@@ -1577,8 +2062,17 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
     # noinspection PyArgumentList
     @pyqtSlot(name='on_action_updatevm_triggered')
     def action_updatevm_triggered(self):
-        for vm_info in self.get_selected_vms():
-            vm = vm_info.vm
+        vms = [vm_info.vm for vm_info in self.get_selected_vms()]
+        domains = [vm for vm in vms if vm.klass != 'AdminVM']
+        if len(domains) > 1:
+            # many qubes are updated a few at a time, and started and shut
+            # down as needed, so there is nothing to confirm
+            if len(domains) < len(vms):
+                self.start_dom0_update()
+            self.open_update_dialog(domains)
+            return
+
+        for vm in vms:
             if not manager_utils.is_running(vm, True):
                 reply = QMessageBox.question(
                     self, self.tr("Qube Update Confirmation"),
@@ -1590,16 +2084,89 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
                 if reply != QMessageBox.Yes:
                     return
 
+            if vm.klass == 'AdminVM':
+                self.start_dom0_update()
+                continue
+
             thread = UpdateVMThread(vm)
             self.threads_list.append(thread)
             thread.finished.connect(self.clear_threads)
             thread.start()
 
+    def start_dom0_update(self):
+        # dom0 update is a separate GUI tool, no need to wait for it
+        self.launcher.start(
+            "/usr/bin/qubes-dom0-update", ["--clean", "--gui"],
+            on_finished=self.dom0_update_finished)
+
+    def dom0_update_finished(self, exit_code):
+        if exit_code != 0:
+            QMessageBox.warning(
+                self,
+                self.tr("Error on qube update!"),
+                self.tr("dom0 update failed (exit code {}).").format(
+                    exit_code))
+
+    def open_update_dialog(self, vms):
+        update_dialog = update_orchestrator.UpdateProgressDialog(vms, self)
+        update_dialog.show()
+        self.settings_windows.add('update_dialog', update_dialog)
+
+    # noinspection PyArgumentList
+    @pyqtSlot(name='on_action_export_triggered')
+    def action_export_triggered(self):
+        file_name, _ = QFileDialog.getSaveFileName(
+            self, self.tr("Export qubes"), "qubes.csv",
+            self.tr("CSV files (*.csv);;JSON files (*.json)"))
+        if not file_name:
+            return
+        export_format = 'json' if file_name.endswith('.json') else 'csv'
+
+        # qubes and columns as shown in the table
+        columns = table_export.columns_for_table(
+            [name for col_no, name
+             in enumerate(self.qubes_model.columns_indices)
+             if not self.table.isColumnHidden(col_no)])
+        vm_infos = (self.proxy.index(row, 0).data(Qt.UserRole)
+                    for row in range(self.proxy.rowCount()))
+        try:
+            with open(file_name, 'w', encoding='utf-8', newline='') as file:
+                table_export.export(file, vm_infos, columns, export_format)
+        except OSError as ex:
+            QMessageBox.warning(
+                self, self.tr("Error exporting qubes!"), str(ex))
+
+    @pyqtSlot(name='on_action_update_available_triggered')
+    def action_update_available_triggered(self):
+        vms = [vm_info.vm for vm_info in self.qubes_cache
+               if vm_info.updates_available and
+               vm_info.klass in ('TemplateVM', 'StandaloneVM')]
+        if not vms:
+            QMessageBox.information(
+                self,
+                self.tr("No updates available"),
+                self.tr("There are no qubes with updates available."))
+            return
+        self.open_update_dialog(vms)
+
     # noinspection PyArgumentList
     @pyqtSlot(name='on_action_run_command_in_vm_triggered')
     def action_run_command_in_vm_triggered(self):
         # pylint: disable=invalid-name
-        for vm_info in self.get_selected_vms():
+        vm_infos = [vm_info for vm_info in self.get_selected_vms()
+                    if vm_info.vm.klass != 'AdminVM']
+        skipped = [vm_info.name for vm_info in self.get_selected_vms()
+                   if vm_info.vm.klass == 'AdminVM']
+        if skipped:
+            QMessageBox.information(
+                self, self.tr("Qubes command entry"),
+                self.tr("Commands cannot be run in {}, it is skipped.").format(
+                    ", ".join(skipped)))
+        if len(vm_infos) > 1:
+            self.run_command_in_vms([vm_info.vm for vm_info in vm_infos])
+            return
+
+        for vm_info in vm_infos:
             (command_to_run, ok) = QInputDialog.getText(
                 self, self.tr('Qubes command entry'),
                 self.tr('Run command in <b>{}</b>:').format(vm_info.name))
@@ -1611,6 +2178,18 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
             thread.finished.connect(self.clear_threads)
             thread.start()
 
+    def run_command_in_vms(self, vms):
+        (command_to_run, ok) = QInputDialog.getText(
+            self, self.tr('Qubes command entry'),
+            self.tr('Run command in <b>{}</b> qubes:').format(len(vms)))
+        if not ok or command_to_run == "":
+            return
+
+        run_dialog = run_command.RunCommandDialog(vms, command_to_run, self)
+        run_dialog.show()
+        self.settings_windows.add('run_command_dialog', run_dialog)
+        run_dialog.start()
+
     # noinspection PyArgumentList
     @pyqtSlot(name='on_action_open_console_triggered')
     def action_open_console_triggered(self):
@@ -1653,12 +2232,18 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
                 self.qubes_app,
                 self)
         global_settings_window.show()
-        self.settings_windows['global_settings_window'] = global_settings_window
+        self.settings_windows.add('global_settings_window',
+                                  global_settings_window)
 
     # noinspection PyArgumentList
     @pyqtSlot(name='on_action_manage_templates_triggered')
     def action_manage_templates_triggered(self):
-        subprocess.check_call('qubes-template-manager')
+        dispatcher = manager_utils.WindowDispatcher(self.dispatcher)
+        self.launcher.open_tool(
+            'qubes-template-manager', module='qubesmanager.template_manager',
+            create_window=lambda module: module.TemplateManagerWindow(
+                self.qt_app, self.qubes_app, dispatcher),
+            dispatcher=dispatcher)
 
     # noinspection PyArgumentList
     @pyqtSlot(name='on_action_show_network_triggered')
@@ -1717,6 +2302,7 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
 
     def showhide_column(self, col_num, show):
         self.table.setColumnHidden(col_num, not show)
+        self.group_view.setColumnHidden(col_num, not show)
         col_name = self.qubes_model.columns_indices[col_num]
         self.manager_settings.setValue('columns/%s' % col_name, show)
 
@@ -1737,7 +2323,8 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
 
     @pyqtSlot('const QPoint&')
     def open_context_menu(self, point):
-        self.context_menu.exec_(self.table.mapToGlobal(
+        view = self.group_view if self.is_grouped() else self.table
+        self.context_menu.exec_(view.mapToGlobal(
             point + QPoint(10, 0)))
 
     def show_log(self):
@@ -1772,9 +2359,58 @@ class VmManagerWindow(ui_qubemanager.Ui_VmManagerWindow, QMainWindow):
         except exc.QubesDaemonAccessError:
             pass
 
-def main():
+parser = argparse.ArgumentParser(
+    description="Qube Manager; with --dump, prints the table of qubes "
+                "instead of showing the window")
+parser.add_argument('--dump', action='store_true',
+                    help="print the table of qubes and exit")
+parser.add_argument('--format', dest='export_format',
+                    choices=table_export.FORMATS, default='csv',
+                    help="format of the printed table (default: csv)")
+parser.add_argument('--columns', type=table_export.parse_columns,
+                    default=None,
+                    help="comma separated list of printed columns, out of: "
+                         "{} (default: all)".format(
+                             ", ".join(table_export.COLUMNS)))
+parser.add_argument('--output', '-o', metavar='FILE',
+                    help="write the table to FILE instead of standard output")
+
+
+def dump(qubes_app, output, export_format='csv', columns=None,
+         max_workers=8):
+    """Writes the table of all qubes to the output file without a window;
+    qubes are loaded a chunk at a time and written as soon as loaded.
+    :return: number of qubes written"""
+    start_time = time.monotonic()
+    vm_infos = itertools.chain.from_iterable(load_vm_infos(
+        qubes_app.domains, CacheLoaderThread.chunk_size, max_workers))
+    count = table_export.export(output, vm_infos, columns, export_format)
+    manager_utils.debug("dumped {} domains in {:.2f} s".format(
+        count, time.monotonic() - start_time))
+    return count
+
+
+def main(args=None):
+    # the rest of the arguments is left to Qt
+    args, _ = parser.parse_known_args(args)
+    if args.dump:
+        qubes_app = qubesadmin.Qubes()
+        try:
+            if args.output:
+                with open(args.output, 'w', encoding='utf-8',
+                          newline='') as output:
+                    dump(qubes_app, output, args.export_format, args.columns)
+            else:
+                dump(qubes_app, sys.stdout, args.export_format, args.columns)
+        except (OSError, exc.QubesException) as ex:
+            print("qubes-qube-manager: {}".format(ex), file=sys.stderr)
+            return 1
+        return 0
+
     manager_utils.run_asynchronous(VmManagerWindow)
+    common_threads.wait_for_processes()
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,276 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+#
+"""Running a single command in many qubes at once."""
+
+import asyncio
+import codecs
+import collections
+import functools
+import logging
+import subprocess
+
+from PyQt5 import QtWidgets  # pylint: disable=import-error
+
+from qubesadmin import exc
+
+logger = logging.getLogger('qubesmanager.run_command')
+
+# default number of qubes the command runs in at the same time
+DEFAULT_MAX_PARALLEL = 4
+# lines of output kept for each qube (and for all of them together)
+MAX_LINES = 5000
+
+
+class OutputBuffer:
+    """Keeps the last max_lines complete lines of output, plus the
+    unfinished last line."""
+    def __init__(self, max_lines=MAX_LINES):
+        self.lines = collections.deque(maxlen=max_lines)
+        self.partial = ''
+        self.dropped = 0
+
+    def append(self, text):
+        """Adds text to the buffer, returns the lines it completed"""
+        lines = (self.partial + text).split('\n')
+        self.partial = lines.pop()
+        self.add_lines(lines)
+        return lines
+
+    def add_lines(self, lines):
+        overflow = len(self.lines) + len(lines) - self.lines.maxlen
+        if overflow > 0:
+            self.dropped += overflow
+        self.lines.extend(lines)
+
+    def flush(self):
+        """Finishes the unfinished last line, returns it (if any)"""
+        if not self.partial:
+            return []
+        lines = [self.partial]
+        self.partial = ''
+        self.add_lines(lines)
+        return lines
+
+    def get_text(self):
+        lines = list(self.lines)
+        if self.partial:
+            lines.append(self.partial)
+        if self.dropped:
+            lines.insert(0, "[{} earlier lines dropped]".format(self.dropped))
+        return "\n".join(lines)
+
+
+def _start_shell(vm, command, user=None):
+    """Starts the command in the qube, returns its process"""
+    proc = vm.run_service('qubes.VMShell', user=user,
+                          stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                          stderr=subprocess.STDOUT)
+    proc.stdin.write(command.encode() + b'; exit\n')
+    proc.stdin.close()
+    return proc
+
+
+async def run_command(vm, command, on_output, user=None):
+    """
+    Runs the command in the qube, passing its output (stdout and stderr
+    together) to on_output as it comes.
+    :return: exit code of the command
+    """
+    loop = asyncio.get_event_loop()
+    # starting a halted qube blocks until it has booted
+    proc = await loop.run_in_executor(
+        None, functools.partial(_start_shell, vm, command, user))
+
+    reader = asyncio.StreamReader()
+    transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), proc.stdout)
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    try:
+        while True:
+            data = await reader.read(4096)
+            if not data:
+                break
+            on_output(decoder.decode(data))
+    finally:
+        transport.close()
+
+    return await loop.run_in_executor(None, proc.wait)
+
+
+async def run_in_vms(vms, command, on_output, on_finished=None,
+                     max_parallel=DEFAULT_MAX_PARALLEL, user=None):
+    """
+    Runs the command in all the given qubes, at most max_parallel at a time.
+    :param on_output: called with (qube name, text)
+    :param on_finished: called with (qube name, exit code, error message)
+    :return: dict of qube name: exit code (None if it could not be run)
+    """
+    semaphore = asyncio.Semaphore(max(1, max_parallel))
+    results = {}
+
+    async def _run(vm):
+        async with semaphore:
+            error = ""
+            try:
+                exit_code = await run_command(
+                    vm, command, lambda text: on_output(vm.name, text), user)
+            except (OSError, exc.QubesException) as ex:
+                exit_code = None
+                error = str(ex)
+        results[vm.name] = exit_code
+        if on_finished is not None:
+            on_finished(vm.name, exit_code, error)
+
+    await asyncio.gather(*(_run(vm) for vm in vms))
+    return results
+
+
+class RunCommandDialog(QtWidgets.QDialog):
+    """Shows output of a command run in many qubes: interleaved, with each
+    line prefixed with the name of the qube, and separately for each qube"""
+    def __init__(self, vms, command, parent=None,
+                 max_parallel=DEFAULT_MAX_PARALLEL):
+        super().__init__(parent)
+        self.vms = list(vms)
+        self.command = command
+        self.max_parallel = max_parallel
+
+        self.buffers = {vm.name: OutputBuffer() for vm in self.vms}
+        self.all_output = OutputBuffer()
+        self.exit_codes = {}
+        self.errors = {}
+        # kept, so that the running task is not garbage collected
+        self.task = None
+        # closed by the user while running, see reject
+        self.hidden_while_running = False
+
+        self.setWindowTitle(self.tr("Run command in qubes"))
+        self.resize(700, 500)
+
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addWidget(QtWidgets.QLabel(
+            self.tr("Command: <b>{}</b>").format(
+                self.command.replace('&', '&amp;').replace('<', '&lt;'))))
+
+        self.tabs = QtWidgets.QTabWidget()
+        self.all_pane = self._create_pane()
+        self.tabs.addTab(self.all_pane, self.tr("All qubes"))
+        self.panes = {}
+        for vm in self.vms:
+            self.panes[vm.name] = self._create_pane()
+            self.tabs.addTab(self.panes[vm.name], vm.name)
+        layout.addWidget(self.tabs)
+
+        self.summary = QtWidgets.QLabel(self.tr("Running..."))
+        self.summary.setWordWrap(True)
+        layout.addWidget(self.summary)
+
+        self.button_box = QtWidgets.QDialogButtonBox(
+            QtWidgets.QDialogButtonBox.Save |
+            QtWidgets.QDialogButtonBox.Close)
+        self.button_box.button(QtWidgets.QDialogButtonBox.Save).clicked.\
+            connect(self.save_output)
+        self.button_box.rejected.connect(self.reject)
+        layout.addWidget(self.button_box)
+
+    @staticmethod
+    def _create_pane():
+        pane = QtWidgets.QPlainTextEdit()
+        pane.setReadOnly(True)
+        pane.setMaximumBlockCount(MAX_LINES)
+        pane.setLineWrapMode(QtWidgets.QPlainTextEdit.NoWrap)
+        return pane
+
+    async def run(self):
+        await run_in_vms(self.vms, self.command, self.add_output,
+                         self.command_finished, self.max_parallel)
+        self.summary.setText(self.get_summary())
+
+    def start(self):
+        """Runs the command in the background, see run"""
+        self.task = asyncio.ensure_future(self.run())
+        self.task.add_done_callback(self.run_done)
+        return self.task
+
+    def run_done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            ex = task.exception()
+            logger.error("running %r failed", self.command, exc_info=ex)
+            self.summary.setText(self.tr("Error: {}").format(ex))
+        if self.hidden_while_running:
+            # finished only now, so that the dialog is released
+            super().reject()
+
+    def add_output(self, name, text):
+        self._add_lines(name, self.buffers[name].append(text))
+
+    def _add_lines(self, name, lines):
+        if not lines:
+            return
+        prefixed = ["{}: {}".format(name, line) for line in lines]
+        self.all_output.add_lines(prefixed)
+        self.panes[name].appendPlainText("\n".join(lines))
+        self.all_pane.appendPlainText("\n".join(prefixed))
+
+    def command_finished(self, name, exit_code, error):
+        self._add_lines(name, self.buffers[name].flush())
+        self.exit_codes[name] = exit_code
+        if error:
+            self.errors[name] = error
+        index = self.tabs.indexOf(self.panes[name])
+        self.tabs.setTabText(index, "{} ({})".format(
+            name, exit_code if exit_code is not None else self.tr("error")))
+        self.summary.setText(self.tr("Finished in {} of {} qubes.").format(
+            len(self.exit_codes), len(self.vms)))
+
+    def get_summary(self):
+        succeeded = [name for name, code in self.exit_codes.items()
+                     if code == 0]
+        failed = ["{} ({})".format(name, self.errors.get(name, code))
+                  for name, code in sorted(self.exit_codes.items())
+                  if code != 0]
+        summary = self.tr("Succeeded in {} of {} qubes.").format(
+            len(succeeded), len(self.vms))
+        if failed:
+            summary += " " + self.tr("Failed: {}").format(", ".join(failed))
+        return summary
+
+    def save_output(self):
+        file_name, _ = QtWidgets.QFileDialog.getSaveFileName(
+            self, self.tr("Save output"))
+        if not file_name:
+            return
+        try:
+            with open(file_name, 'w', encoding='utf-8') as file:
+                file.write("$ {}\n".format(self.command))
+                file.write(self.all_output.get_text() + "\n")
+                for name in sorted(self.exit_codes):
+                    file.write("{}: exit code {}\n".format(
+                        name, self.exit_codes[name]))
+        except OSError as ex:
+            QtWidgets.QMessageBox.warning(
+                self, self.tr("Error saving output!"), str(ex))
+
+    def reject(self):
+        if self.task is not None and not self.task.done():
+            # the commands keep running, only hide the window
+            self.hidden_while_running = True
+            self.hide()
+            return
+        super().reject()
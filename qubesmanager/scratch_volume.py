@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+#
+"""Scratch space for installations in dom0.
+
+A sparse file, formatted once as ext4 and mounted through a loop device,
+which stays mounted between runs: a run only makes its own directory in it
+and removes it afterwards (fstrim then returns the space to the sparse
+file). The file grows when a run needs more space than it has. Loop devices
+of the file left by crashed runs are detached before mounting it again.
+"""
+
+import os
+import shlex
+
+from .step_runner import FAILED_ENV
+
+DEFAULT_SIZE = 10 * 1024 ** 3
+# directories of runs not resumed for this long (in days) are removed
+MAX_RUN_AGE_DAYS = 7
+# names of the run directories, i.e. run ids made by create_worker; nothing
+# else in the volume (e.g. lost+found) is removed
+RUN_PATTERN = 'fancy_manager_*'
+
+
+class ScratchVolume:
+    """Generates the scripts managing the scratch volume"""
+    def __init__(self, backing_file, mount_point):
+        self.backing_file = backing_file
+        self.mount_point = mount_point
+
+    def run_directory(self, run_id):
+        return os.path.join(self.mount_point, run_id)
+
+    def mount_script(self, run_id, size=DEFAULT_SIZE):
+        """Returns a shell script mounting the volume (if it is not yet),
+        at least size bytes big, and making a directory of the run in
+        it"""
+        run_directory = shlex.quote(self.run_directory(run_id))
+        return f"""
+        backing_file={shlex.quote(self.backing_file)}
+        mount_point={shlex.quote(self.mount_point)}
+        mkdir -p "$mount_point"
+        # runs share the volume, one of them sets it up at a time
+        exec 9>"$backing_file.lock"
+        flock 9
+
+        if mountpoint -q "$mount_point"; then
+            loop_device=$(findmnt -n -o SOURCE "$mount_point")
+        else
+            # loop devices left by crashed runs
+            for device in $(sudo losetup -j "$backing_file" -n -O NAME); do
+                echo "detaching leftover loop device $device"
+                sudo umount "$device" 2>/dev/null
+                sudo losetup -d "$device"
+            done
+            if [ ! -e "$backing_file" ]; then
+                truncate -s {size} "$backing_file"
+            fi
+            # formatted only the first time
+            if [ "$(blkid -p -s TYPE -o value "$backing_file")" != ext4 ]; then
+                mkfs.ext4 -q -F "$backing_file"
+            fi
+            loop_device=$(sudo losetup --find --show "$backing_file")
+            sudo mount "$loop_device" "$mount_point"
+        fi
+
+        if [ "$(stat -c %s "$backing_file")" -lt {size} ]; then
+            echo "growing scratch volume to {size} bytes"
+            truncate -s {size} "$backing_file"
+            sudo losetup -c "$loop_device"
+            sudo resize2fs "$loop_device"
+        fi
+
+        find "$mount_point" -mindepth 1 -maxdepth 1 -type d \\
+            -name {shlex.quote(RUN_PATTERN)} -mtime +{MAX_RUN_AGE_DAYS} \\
+            -exec sudo rm -rf {{}} +
+        # kept when resuming a failed run
+        sudo mkdir -p {run_directory}
+        sudo chown "$(id -u):$(id -g)" {run_directory}
+        flock -u 9
+        """
+
+    def check_script(self, run_id):
+        """Returns a shell command succeeding if the volume is mounted with
+        the directory of the run in it"""
+        return "mountpoint -q {} && [ -d {} ]".format(
+            shlex.quote(self.mount_point),
+            shlex.quote(self.run_directory(run_id)))
+
+    def cleanup_script(self, run_id):
+        """Returns a shell script removing the directory of the run; after a
+        failure, it is kept for resuming the run"""
+        return f"""
+        if [ "${FAILED_ENV}" != 1 ]; then
+            sudo rm -rf {shlex.quote(self.run_directory(run_id))}
+            # give the space back to the sparse backing file
+            sudo fstrim {shlex.quote(self.mount_point)} || true
+        fi
+        """
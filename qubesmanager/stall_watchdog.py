@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+#
+"""Reporting stalls of the Qt event loop.
+
+A timer on the GUI thread records a heartbeat, which a helper thread checks.
+When the loop has not run for longer than the threshold (usually because of
+a synchronous qubesd call), the helper thread captures the Python stack of
+the GUI thread; the stall is logged with its duration once the loop runs
+again. Enabled by setting QUBES_MANAGER_WATCHDOG to the threshold in ms.
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from PyQt5 import QtCore  # pylint: disable=import-error
+
+env_name = 'QUBES_MANAGER_WATCHDOG'
+# threshold (in ms) used when the variable is set, but not to a number
+DEFAULT_THRESHOLD = 200
+
+logger = logging.getLogger('qubesmanager.watchdog')
+
+
+class StallWatchdog(QtCore.QObject):
+    """Measures latency of the event loop of the thread it is started on"""
+    def __init__(self, threshold=DEFAULT_THRESHOLD / 1000, interval=0.05,
+                 parent=None):
+        """
+        :param threshold: shortest stall reported, in seconds
+        :param interval: how often the loop is checked, in seconds
+        """
+        super().__init__(parent)
+        self.threshold = threshold
+        self.interval = interval
+
+        self.count = 0
+        self.total = 0.0
+        self.longest = 0.0
+        # location (see get_location): [count, total, longest]
+        self.locations = {}
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(int(interval * 1000))
+        self.timer.timeout.connect(self._beat)
+
+        self._lock = threading.Lock()
+        self._last_beat = None
+        # stack of the GUI thread captured during the current stall
+        self._stack = None
+        self._gui_thread_id = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._gui_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self.timer.start()
+        self._thread = threading.Thread(
+            target=self._watch, name='stall-watchdog', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.timer.stop()
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _beat(self):
+        now = time.monotonic()
+        with self._lock:
+            stalled = now - self._last_beat - self.interval
+            stack = self._stack
+            self._last_beat = now
+            self._stack = None
+        if stalled > self.threshold:
+            self._record(stalled, stack)
+
+    def _watch(self):
+        while not self._stop.wait(self.interval / 2):
+            with self._lock:
+                stalled = time.monotonic() - self._last_beat - self.interval
+                if stalled <= self.threshold or self._stack is not None:
+                    continue
+                # pylint: disable=protected-access
+                frame = sys._current_frames().get(self._gui_thread_id)
+                self._stack = traceback.extract_stack(frame) \
+                    if frame is not None else []
+
+    @staticmethod
+    def get_location(stack):
+        """Returns the innermost frame of the manager code in the stack (or
+        the innermost frame at all), as file:line in function"""
+        if not stack:
+            return "unknown"
+        frame = stack[-1]
+        for stack_frame in reversed(stack):
+            if os.sep + 'qubesmanager' + os.sep in stack_frame.filename:
+                frame = stack_frame
+                break
+        return "{}:{} in {}".format(os.path.basename(frame.filename),
+                                    frame.lineno, frame.name)
+
+    def _record(self, duration, stack):
+        self.count += 1
+        self.total += duration
+        self.longest = max(self.longest, duration)
+
+        location = self.get_location(stack)
+        stats = self.locations.setdefault(location, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += duration
+        stats[2] = max(stats[2], duration)
+
+        logger.warning("event loop blocked for %.0f ms at %s\n%s",
+                       duration * 1000, location,
+                       "".join(traceback.format_list(stack or [])))
+
+    def report(self):
+        if not self.count:
+            return "no event loop stalls over {:.0f} ms".format(
+                self.threshold * 1000)
+        lines = ["{} event loop stalls over {:.0f} ms, {:.0f} ms in total, "
+                 "longest {:.0f} ms".format(
+                     self.count, self.threshold * 1000, self.total * 1000,
+                     self.longest * 1000)]
+        for location, (count, total, longest) in sorted(
+                self.locations.items(), key=lambda item: -item[1][1]):
+            lines.append("  {}: {} times, {:.0f} ms in total, longest "
+                         "{:.0f} ms".format(location, count, total * 1000,
+                                            longest * 1000))
+        return "\n".join(lines)
+
+
+def start_from_env(parent=None):
+    """Starts a StallWatchdog if QUBES_MANAGER_WATCHDOG is set, see
+    stop_and_report; returns None otherwise"""
+    value = os.getenv(env_name, '')
+    if value in ('', '0'):
+        return None
+    try:
+        threshold = int(value)
+    except ValueError:
+        threshold = DEFAULT_THRESHOLD
+    watchdog = StallWatchdog(threshold / 1000, parent=parent)
+    watchdog.start()
+    return watchdog
+
+
+def stop_and_report(watchdog):
+    if watchdog is None:
+        return
+    watchdog.stop()
+    logger.warning("%s", watchdog.report())
@@ -0,0 +1,269 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+#
+"""Running installation steps, each in its own bash process.
+
+A step (see create_worker.get_step) runs once the steps it comes after have
+ended; by default that is the step before it, steps with an empty `after`
+start right away, so independent steps run concurrently. After a step
+fails, only the steps marked run_on_fail (cleanup) still run, the others
+are skipped; they see FANCY_RUN_FAILED=1 in their environment. Start,
+duration and exit code of every step are appended to a JSON lines file, to
+see where installation time goes.
+
+A run can be resumed by starting it again with the steps that completed
+before: those are not run again, unless their `check` (a shell condition
+telling whether what the step made is still there) fails. Cleanup steps
+always run.
+"""
+
+import codecs
+import json
+import os
+import time
+
+from PyQt5 import QtCore  # pylint: disable=import-error
+
+DEFAULT_TIMINGS_PATH = os.path.expanduser(
+    '~/.qubes-fancy-manager/step_timings.jsonl')
+# the timings file is rotated (to .1) when it grows over this size
+MAX_TIMINGS_SIZE = 1024 ** 2
+
+PENDING = 'pending'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+# completed in an earlier attempt of the run
+DONE = 'done'
+
+FAILED_ENV = 'FANCY_RUN_FAILED'
+# exit code of an aborted run, as of a shell interrupted by SIGINT
+ABORTED_EXIT_CODE = 130
+
+
+class StepRecord:
+    """State and timing of a step of a run"""
+    # pylint: disable=too-few-public-methods
+    def __init__(self, name, run_on_fail, after):
+        self.name = name
+        self.run_on_fail = run_on_fail
+        # indexes of the steps this one comes after
+        self.after = after
+        self.status = PENDING
+        self.started = None
+        self.duration = None
+        self.exit_code = None
+
+    def to_dict(self):
+        return {'step': self.name, 'status': self.status,
+                'started': self.started, 'duration': self.duration,
+                'exit_code': self.exit_code}
+
+
+def get_records(steps):
+    """Returns StepRecords of the steps, with `after` resolved to indexes
+    :raises ValueError: if a step comes after an unknown or later step
+    """
+    records = []
+    indexes = {}
+    for index, step in enumerate(steps):
+        name = step.get('name') or 'step {}'.format(index + 1)
+        after = step.get('after')
+        if after is None:
+            after = [index - 1] if index else []
+        else:
+            try:
+                after = [indexes[after_name] for after_name in after]
+            except KeyError as ex:
+                raise ValueError("Step {} comes after unknown step {}".format(
+                    name, ex)) from ex
+        indexes[name] = index
+        records.append(StepRecord(name, step.get('run_on_fail', False),
+                                  after))
+    return records
+
+
+def format_timings(records):
+    lines = []
+    for record in records:
+        if record.duration is None:
+            lines.append("{}: {}".format(record.name, record.status))
+        else:
+            lines.append("{}: {} in {:.1f} s (exit code {})".format(
+                record.name, record.status, record.duration,
+                record.exit_code))
+    return "\n".join(lines)
+
+
+class StepRunner(QtCore.QObject):
+    """Runs steps of an installation, see the module documentation"""
+    # text of output of any of the steps
+    output = QtCore.pyqtSignal(str)
+    # step index
+    step_started = QtCore.pyqtSignal(int)
+    # step index, exit code
+    step_finished = QtCore.pyqtSignal(int, int)
+    # exit code of the run: of the first failed step, or 0
+    finished = QtCore.pyqtSignal(int)
+
+    def __init__(self, run_id=None, timings_path=DEFAULT_TIMINGS_PATH,
+                 shell='bash', parent=None):
+        """
+        :param timings_path: JSON lines file timings are appended to; None
+            to not keep them
+        """
+        super().__init__(parent)
+        self.run_id = run_id
+        self.timings_path = timings_path
+        self.shell = shell
+        self.steps = []
+        self.records = []
+        # step index: QProcess
+        self.processes = {}
+        # step index: decoder of its output, characters can be split
+        # between reads
+        self.decoders = {}
+        self.failed_exit_code = None
+        self.started = None
+
+    def start(self, steps, completed=()):
+        """
+        Starts running the steps.
+        :param steps: list of get_step dicts
+        :param completed: names of the steps completed in an earlier attempt
+        """
+        self.steps = [dict(step) for step in steps]
+        self.records = get_records(self.steps)
+        self.failed_exit_code = None
+        self.started = time.time()
+        for step, record in zip(self.steps, self.records):
+            if record.name not in completed or record.run_on_fail:
+                continue
+            if step.get('check'):
+                step['script'] = "if {}; then echo 'already done'; " \
+                    "exit 0; fi\n{}".format(step['check'], step['script'])
+            else:
+                record.status = DONE
+        self._schedule()
+
+    def is_running(self):
+        return bool(self.processes)
+
+    def _schedule(self):
+        for index, record in enumerate(self.records):
+            if record.status != PENDING or any(
+                    self.records[after].status in (PENDING, RUNNING)
+                    for after in record.after):
+                continue
+            if self.failed_exit_code is not None and not record.run_on_fail:
+                record.status = SKIPPED
+                continue
+            self._start_step(index)
+
+        if not self.processes and all(
+                record.status != PENDING for record in self.records):
+            self._save_timings()
+            self.finished.emit(self.failed_exit_code or 0)
+
+    def _start_step(self, index):
+        record = self.records[index]
+        record.status = RUNNING
+        record.started = time.time()
+
+        process = QtCore.QProcess(self)
+        process.setProcessChannelMode(QtCore.QProcess.MergedChannels)
+        if self.failed_exit_code is not None:
+            environment = QtCore.QProcessEnvironment.systemEnvironment()
+            environment.insert(FAILED_ENV, '1')
+            process.setProcessEnvironment(environment)
+        process.setProperty('step_index', index)
+        process.readyRead.connect(self._ready_read)
+        process.finished.connect(self._process_finished)
+        process.errorOccurred.connect(self._process_error)
+        self.processes[index] = process
+        self.decoders[index] = codecs.getincrementaldecoder('utf-8')(
+            errors='replace')
+
+        self.step_started.emit(index)
+        process.start(self.shell, ['-c', self.steps[index]['script']])
+
+    def _ready_read(self):
+        process = self.sender()
+        decoder = self.decoders.get(process.property('step_index'))
+        if decoder is None:
+            return
+        text = decoder.decode(process.readAll().data())
+        if text:
+            self.output.emit(text)
+
+    def _process_error(self, error):
+        if error == QtCore.QProcess.FailedToStart:
+            # no finished signal comes
+            self._step_ended(self.sender(), 127)
+
+    def _process_finished(self, exit_code, exit_status):
+        if exit_status == QtCore.QProcess.CrashExit and exit_code == 0:
+            exit_code = 1
+        self._step_ended(self.sender(), exit_code)
+
+    def _step_ended(self, process, exit_code):
+        index = process.property('step_index')
+        if self.processes.pop(index, None) is None:
+            return
+        text = self.decoders.pop(index).decode(process.readAll().data(),
+                                               final=True)
+        if text:
+            self.output.emit(text)
+        record = self.records[index]
+        record.duration = time.time() - record.started
+        record.exit_code = exit_code
+        record.status = SUCCEEDED if exit_code == 0 else FAILED
+        if exit_code != 0 and self.failed_exit_code is None:
+            self.failed_exit_code = exit_code
+        process.deleteLater()
+
+        self.step_finished.emit(index, exit_code)
+        self._schedule()
+
+    def abort(self):
+        """Kills the running steps, the remaining ones are skipped; cleanup
+        steps are not killed and still run, finished is emitted once they
+        ended"""
+        if self.failed_exit_code is None:
+            self.failed_exit_code = ABORTED_EXIT_CODE
+        for index, process in list(self.processes.items()):
+            if not self.records[index].run_on_fail:
+                process.kill()
+
+    def _save_timings(self):
+        if not self.timings_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.timings_path), exist_ok=True)
+            if os.path.exists(self.timings_path) and \
+                    os.path.getsize(self.timings_path) > MAX_TIMINGS_SIZE:
+                os.replace(self.timings_path, self.timings_path + '.1')
+            with open(self.timings_path, 'a', encoding='utf-8') as file:
+                for record in self.records:
+                    line = record.to_dict()
+                    line['run_id'] = self.run_id
+                    file.write(json.dumps(line) + '\n')
+        except OSError:
+            # timings are for diagnostics only
+            pass
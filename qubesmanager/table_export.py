@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+#
+"""Exporting the Qube Manager table as CSV or JSON.
+
+Rows are written one by one as they come, so that the whole document never
+has to be kept in memory. This module does not use Qt, it is used both by
+the export action of the manager and by its headless --dump mode.
+"""
+
+import csv
+import json
+
+FORMATS = ('csv', 'json')
+
+# export column: column of the Qube Manager table
+COLUMNS = {
+    'type': 'Type',
+    'label': 'Label',
+    'name': 'Name',
+    'state': 'State',
+    'template': 'Template',
+    'netvm': 'NetVM',
+    'disk_usage': 'Disk Usage',
+    'internal': 'Internal',
+    'ip': 'IP',
+    'backup': 'Backup',
+    'last_backup': 'Last backup',
+    'default_dispvm': 'Default DispVM',
+    'is_dvm_template': 'Is DVM Template',
+    'virt_mode': 'Virt Mode',
+}
+
+
+def parse_columns(value):
+    """Parses a comma separated list of export columns (see COLUMNS);
+    table column names, e.g. 'Disk Usage', are accepted as well.
+    :raises ValueError: on unknown column
+    """
+    by_table_name = {table_name.lower(): column
+                     for column, table_name in COLUMNS.items()}
+    columns = []
+    for name in value.split(','):
+        name = name.strip().lower()
+        if not name:
+            continue
+        column = name if name in COLUMNS else by_table_name.get(name)
+        if column is None:
+            raise ValueError("Unknown column: {}".format(name))
+        columns.append(column)
+    return columns
+
+
+def columns_for_table(table_columns):
+    """Returns export columns of the given table columns"""
+    by_table_name = {table_name: column
+                     for column, table_name in COLUMNS.items()}
+    return [by_table_name[name] for name in table_columns
+            if name in by_table_name]
+
+
+def get_value(vm_info, column):
+    # pylint: disable=too-many-return-statements
+    """Returns value of the column for the VmInfo, as a string, number,
+    bool or None"""
+    if column == 'type':
+        return vm_info.klass
+    if column == 'label':
+        return getattr(vm_info.label, 'name', None)
+    if column == 'name':
+        return vm_info.name
+    if column == 'state':
+        return vm_info.state['power'] or None
+    if column == 'template':
+        return vm_info.template
+    if column == 'netvm':
+        return vm_info.netvm
+    if column == 'disk_usage':
+        # in MiB, as shown in the table
+        if vm_info.disk_float is None:
+            return None
+        return round(vm_info.disk_float / (1024 * 1024), 2)
+    if column == 'internal':
+        return bool(vm_info.internal)
+    if column == 'ip':
+        return vm_info.ip
+    if column == 'backup':
+        return vm_info.inc_backup
+    if column == 'last_backup':
+        return vm_info.last_backup
+    if column == 'default_dispvm':
+        return vm_info.dvm
+    if column == 'is_dvm_template':
+        return bool(vm_info.dvm_template)
+    if column == 'virt_mode':
+        return vm_info.virt_mode
+    raise KeyError(column)
+
+
+def write_csv(file, vm_infos, columns):
+    writer = csv.writer(file)
+    writer.writerow(columns)
+    count = 0
+    for vm_info in vm_infos:
+        writer.writerow(['' if value is None else value for value in
+                         (get_value(vm_info, column) for column in columns)])
+        count += 1
+    return count
+
+
+def write_json(file, vm_infos, columns):
+    # a list of objects, written object by object
+    file.write('[')
+    count = 0
+    for vm_info in vm_infos:
+        file.write(',\n' if count else '\n')
+        file.write(json.dumps(
+            {column: get_value(vm_info, column) for column in columns}))
+        count += 1
+    file.write('\n]\n' if count else ']\n')
+    return count
+
+
+def export(file, vm_infos, columns=None, export_format='csv'):
+    """
+    Writes rows of the table to the file.
+    :param file: text file to write to
+    :param vm_infos: iterable of VmInfo, consumed as the rows are written
+    :param columns: list of export columns; default all of them
+    :param export_format: one of FORMATS
+    :return: number of rows written
+    """
+    if columns is None:
+        columns = list(COLUMNS)
+    if export_format == 'csv':
+        return write_csv(file, vm_infos, columns)
+    if export_format == 'json':
+        return write_json(file, vm_infos, columns)
+    raise ValueError("Unknown format: {}".format(export_format))
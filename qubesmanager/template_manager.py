@@ -111,7 +111,7 @@ class TemplateManagerWindow(
     def vm_added(self, _submitter, _event, vm, **_kwargs):
         # unfortunately, a VM just in the moment of creation may not have
         # a template it will have in a second - e.g., when cloning
-        timer = QtCore.QTimer()
+        timer = QtCore.QTimer(self)
         timer.setSingleShot(True)
         timer.timeout.connect(lambda: self._vm_added(vm, timer))
         self.timers.append(timer)
@@ -119,6 +119,7 @@ class TemplateManagerWindow(
 
     def _vm_added(self, vm_name, timer):
         self.timers.remove(timer)
+        timer.deleteLater()
         try:
             vm = self.qubes_app.domains[vm_name]
             if not getattr(vm, 'template', None) or vm.klass == 'DispVM':
@@ -15,3 +15,46 @@ def init_qtapp():
         asyncio.set_event_loop(loop)
     qtapp.processEvents()
     return qtapp, loop
+
+
+def patch_fancy_manager(test):
+    """Makes FancyManager keep all its files (state, scratch volume, artifact
+    cache, downloads) in a temporary directory removed after the test;
+    returns the directory"""
+    # pylint: disable=import-outside-toplevel
+    import os
+    import tempfile
+    import unittest.mock
+    from qubesmanager import artifact_cache
+    from qubesmanager import create_worker
+
+    tmpdir = tempfile.TemporaryDirectory()
+    test.addCleanup(tmpdir.cleanup)
+    for attribute, path in (
+            ('fancy_directory', tmpdir.name),
+            ('fancy_state_path', os.path.join(tmpdir.name, 'state')),
+            ('fancy_tools_path', os.path.join(tmpdir.name, 'tools')),
+            ('fancy_mount_path', os.path.join(tmpdir.name, 'scratch.img')),
+            ('fancy_mount_point_path', os.path.join(tmpdir.name, 'scratch')),
+            ('tmp_directory', tmpdir.name)):
+        patcher = unittest.mock.patch.object(
+            create_worker.FancyManager, attribute, path)
+        patcher.start()
+        test.addCleanup(patcher.stop)
+    patcher = unittest.mock.patch.dict(
+        os.environ, {artifact_cache.env_name: tmpdir.name})
+    patcher.start()
+    test.addCleanup(patcher.stop)
+    return tmpdir.name
+
+
+def create_fancy_manager(pool=None):
+    """Creates a FancyManager without touching the qubes, see
+    patch_fancy_manager"""
+    # pylint: disable=import-outside-toplevel
+    import unittest.mock
+    from qubesmanager import create_worker
+
+    with unittest.mock.patch.object(
+            create_worker.FancyManager, 'add_in_options'):
+        return create_worker.FancyManager(pool)
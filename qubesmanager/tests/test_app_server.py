@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, https://www.qubes-os.org/
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+import concurrent.futures
+import logging.handlers
+import os
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+from qubesmanager import app_client
+from qubesmanager import app_server
+from qubesmanager import utils
+from qubesmanager.tests import init_qtapp
+
+
+class AppServerTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.qtapp, self.loop = init_qtapp()
+
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, 'test.sock')
+
+        self.server = app_server.AppServer(
+            self.qtapp, unittest.mock.Mock(), unittest.mock.Mock(),
+            path=self.path)
+        self.assertTrue(self.server.listen())
+        self.addCleanup(self.server.close)
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(self.executor.shutdown)
+
+    def _request(self, window, args=()):
+        # the client blocks, so run it aside and keep the Qt loop going
+        future = self.executor.submit(
+            app_client.request_window, window, args, self.path)
+        deadline = time.monotonic() + 10
+        while not future.done() and time.monotonic() < deadline:
+            self.qtapp.processEvents()
+            time.sleep(0.01)
+        return future.result(timeout=0)
+
+    def test_00_no_service(self):
+        self.assertFalse(app_client.request_window(
+            'global-settings', path=self.path + '-nonexistent'))
+
+    def test_01_open_window(self):
+        with unittest.mock.patch.object(
+                app_server.AppServer, 'open_global_settings') as mock_open:
+            self.assertTrue(self._request('global-settings'))
+            self.assertTrue(self._request('global-settings'))
+
+        self.assertEqual(mock_open.call_count, 2)
+        latencies = self.server.latencies['global-settings']
+        self.assertEqual(len(latencies), 2)
+        # the second open never needs to import the module
+        self.assertFalse(latencies[1][0])
+        self.assertIn('global-settings', self.server.latency_report())
+
+    def test_02_arguments_passed(self):
+        with unittest.mock.patch.object(
+                app_server.AppServer, 'open_vm_settings') as mock_open:
+            self.assertTrue(self._request('vm-settings',
+                                          ['work', '--tab', 'firewall']))
+
+        mock_open.assert_called_once_with(
+            unittest.mock.ANY, ['work', '--tab', 'firewall'])
+
+    def test_03_unknown_window(self):
+        with self.assertRaises(app_client.ServiceError):
+            self._request('no-such-window')
+
+    def test_04_window_error(self):
+        with unittest.mock.patch.object(
+                app_server.AppServer, 'open_restore',
+                side_effect=ValueError('cannot restore')):
+            with self.assertRaises(app_client.ServiceError) as context:
+                self._request('restore')
+        self.assertIn('cannot restore', str(context.exception))
+
+        # anything else raised by the window is replied with as well
+        with unittest.mock.patch.object(
+                app_server.AppServer, 'open_restore',
+                side_effect=TypeError('bad window')):
+            with self.assertLogs('qubesmanager.app_server', 'ERROR'):
+                start_time = time.monotonic()
+                with self.assertRaises(app_client.ServiceError) as context:
+                    self._request('restore')
+        self.assertIn('TypeError: bad window', str(context.exception))
+        self.assertLess(time.monotonic() - start_time, 5)
+
+    def test_05_second_instance(self):
+        second = app_server.AppServer(
+            self.qtapp, unittest.mock.Mock(), unittest.mock.Mock(),
+            path=self.path)
+        future = self.executor.submit(second.listen)
+        # ping of the running service needs the Qt loop as well
+        deadline = time.monotonic() + 10
+        while not future.done() and time.monotonic() < deadline:
+            self.qtapp.processEvents()
+            time.sleep(0.01)
+        self.assertFalse(future.result(timeout=0))
+
+
+class AppClientTest(unittest.TestCase):
+    @unittest.mock.patch('importlib.import_module')
+    @unittest.mock.patch('qubesmanager.app_client.request_window',
+                         return_value=False)
+    def test_01_fallback_in_process(self, _mock_request, mock_import):
+        app_client.open_window('vm-create', 'qubesmanager.create_new_vm', [])
+        mock_import.assert_called_once_with('qubesmanager.create_new_vm')
+        mock_import.return_value.main.assert_called_once_with()
+
+    @unittest.mock.patch('importlib.import_module')
+    @unittest.mock.patch('qubesmanager.app_client.request_window',
+                         return_value=True)
+    def test_02_opened_by_service(self, _mock_request, mock_import):
+        self.assertEqual(app_client.open_window(
+            'vm-create', 'qubesmanager.create_new_vm', []), 0)
+        mock_import.assert_not_called()
+
+    @unittest.mock.patch.dict(os.environ, {app_client.service_env: '1'})
+    @unittest.mock.patch('importlib.import_module')
+    @unittest.mock.patch('qubesmanager.app_client.request_window')
+    def test_03_started_by_service(self, mock_request, mock_import):
+        app_client.open_window('vm-create', 'qubesmanager.create_new_vm', [])
+        mock_request.assert_not_called()
+        mock_import.return_value.main.assert_called_once_with()
+
+
+class WindowDispatcherTest(unittest.TestCase):
+    def test_01_handlers_removed(self):
+        dispatcher = unittest.mock.Mock()
+        window_dispatcher = utils.WindowDispatcher(dispatcher)
+
+        window_dispatcher.add_handler('domain-add', print)
+        window_dispatcher.add_handler('domain-delete', len)
+        window_dispatcher.remove_all_handlers()
+
+        dispatcher.add_handler.assert_has_calls(
+            [unittest.mock.call('domain-add', print),
+             unittest.mock.call('domain-delete', len)])
+        dispatcher.remove_handler.assert_has_calls(
+            [unittest.mock.call('domain-add', print),
+             unittest.mock.call('domain-delete', len)])
+        self.assertEqual(window_dispatcher.handlers, [])
+
+
+if __name__ == "__main__":
+    ha_syslog = logging.handlers.SysLogHandler('/dev/log')
+    ha_syslog.setFormatter(
+        logging.Formatter('%(name)s[%(process)d]: %(message)s'))
+    logging.root.addHandler(ha_syslog)
+    unittest.main()
@@ -0,0 +1,201 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, https://www.qubes-os.org/
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+import hashlib
+import logging.handlers
+import os
+import subprocess
+import tempfile
+import unittest
+import unittest.mock
+
+from qubesmanager import artifact_cache
+from qubesmanager.tests import create_fancy_manager, patch_fancy_manager
+
+
+class ArtifactCacheTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+        self.cache = artifact_cache.ArtifactCache(
+            os.path.join(self.tmpdir, 'cache'), max_size=100)
+
+    def _file(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'wb') as file:
+            file.write(content)
+        return path
+
+    def test_01_store_lookup(self):
+        self.assertIsNone(self.cache.lookup('https://example.com/a'))
+        path = self._file('a', b'a' * 10)
+        cached = self.cache.store('https://example.com/a', path)
+
+        self.assertEqual(self.cache.lookup('https://example.com/a'), cached)
+        with open(cached, 'rb') as file:
+            self.assertEqual(file.read(), b'a' * 10)
+        self.assertEqual(os.path.basename(cached),
+                         hashlib.sha256(b'a' * 10).hexdigest())
+        self.assertEqual(artifact_cache.file_sha256(cached),
+                         os.path.basename(cached))
+
+        # the expected hash must match as well
+        self.assertEqual(self.cache.lookup(
+            'https://example.com/a', os.path.basename(cached)), cached)
+        self.assertIsNone(self.cache.lookup('https://example.com/a', '0'))
+
+    def test_02_same_content_stored_once(self):
+        path = self._file('a', b'a' * 10)
+        first = self.cache.store('https://example.com/a', path)
+        second = self.cache.store('https://mirror.example.com/a', path)
+        self.assertEqual(first, second)
+        self.assertEqual(self.cache.size(), 10)
+
+    def test_03_hash_mismatch(self):
+        path = self._file('a', b'a' * 10)
+        with self.assertRaises(artifact_cache.HashMismatch):
+            self.cache.store('https://example.com/a', path, sha256='0' * 64)
+        self.assertIsNone(self.cache.lookup('https://example.com/a'))
+        self.assertEqual(
+            os.listdir(os.path.join(self.tmpdir, 'cache', 'objects')), [])
+
+    def test_04_lru_eviction(self):
+        for name in 'abc':
+            self.cache.store('https://example.com/' + name,
+                             self._file(name, name.encode() * 40))
+            # used more recently than b
+            self.cache.lookup('https://example.com/a')
+
+        self.assertIsNotNone(self.cache.lookup('https://example.com/a'))
+        self.assertIsNone(self.cache.lookup('https://example.com/b'))
+        self.assertIsNotNone(self.cache.lookup('https://example.com/c'))
+        self.assertEqual(self.cache.size(), 80)
+
+    def test_05_removed_file(self):
+        cached = self.cache.store('https://example.com/a',
+                                  self._file('a', b'a' * 10))
+        os.unlink(cached)
+        self.assertIsNone(self.cache.lookup('https://example.com/a'))
+
+    def test_06_command_line(self):
+        path = self._file('a', b'a' * 10)
+        with unittest.mock.patch.dict(
+                os.environ, {artifact_cache.env_name: self.tmpdir}):
+            self.assertEqual(artifact_cache.main(
+                ['lookup', 'https://example.com/a']), 1)
+            self.assertEqual(artifact_cache.main(
+                ['store', 'https://example.com/a', path]), 0)
+            self.assertEqual(artifact_cache.main(
+                ['lookup', 'https://example.com/a']), 0)
+            self.assertEqual(artifact_cache.main(
+                ['store', 'https://example.com/b', path,
+                 '--sha256', '0']), 1)
+
+    def test_07_corrupted_file(self):
+        cached = self.cache.store('https://example.com/a',
+                                  self._file('a', b'a' * 10))
+        # same size, different content: only found when the installation
+        # verifies it
+        with open(cached, 'wb') as file:
+            file.write(b'b' * 10)
+        self.assertEqual(self.cache.lookup('https://example.com/a'), cached)
+        self.assertEqual(subprocess.run(
+            ['bash', '-c', artifact_cache.verify_command(cached)],
+            check=False).returncode, 1)
+
+        self.cache.remove('https://example.com/a')
+        self.assertIsNone(self.cache.lookup('https://example.com/a'))
+        self.assertFalse(os.path.exists(cached))
+        self.assertEqual(self.cache.size(), 0)
+
+
+class FancyManagerCacheTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        tmpdir = patch_fancy_manager(self)
+        self.fancy = create_fancy_manager()
+
+        self.rpm = os.path.join(tmpdir, 'template.rpm')
+        with open(self.rpm, 'wb') as file:
+            file.write(b'rpm')
+        self.template = 'debian-12'
+        self.url = 'https://qubes.3isec.org/Templates_4.1/' \
+            'qubes-template-debian-12-4.0.6-202301242054.noarch.rpm'
+
+    def _steps(self):
+        return self.fancy.get_install_script(
+            self.template, 'run-id', 'default-dvm', 'name', 'sys-net', 'red')
+
+    def _script(self):
+        return "".join(step['script'] for step in self._steps())
+
+    def _copy_cached(self):
+        """Runs the step copying the cached file, returns the path it is
+        copied to"""
+        step = self._steps()[1]
+        self.assertEqual(step['name'], 'copy cached file')
+        directory = self.fancy.scratch_volume.run_directory('run-id')
+        os.makedirs(directory)
+        # run where python3 -m finds the package
+        subprocess.run(['bash', '-c', step['script']], check=True,
+                       stdout=subprocess.DEVNULL,
+                       cwd=os.path.dirname(os.path.dirname(
+                           artifact_cache.__file__)))
+        return os.path.join(directory, 'run-id')
+
+    def test_01_miss_downloads_and_stores(self):
+        script = self._script()
+        self.assertIn('qvm-create --disp', script)
+        self.assertIn('wget', script)
+        self.assertIn('qubesmanager.artifact_cache store ' + self.url,
+                      script)
+
+    def test_02_hit_skips_disposable(self):
+        self.fancy.artifact_cache.store(self.url, self.rpm)
+        steps = self._steps()
+        self.assertEqual([step['name'] for step in steps],
+                         ['mount scratch volume', 'copy cached file',
+                          'prepare worker', 'download', 'install',
+                          'clean up scratch volume', 'clean up worker'])
+        # the worker is set up only if the cached file was not copied
+        for step in steps[2:4]:
+            self.assertTrue(step['script'].startswith(
+                'if {}; then'.format(steps[3]['check'])))
+
+        path = self._copy_cached()
+        with open(path, 'rb') as file:
+            self.assertEqual(file.read(), b'rpm')
+
+    def test_03_corrupted_downloaded_again(self):
+        cached = self.fancy.artifact_cache.store(self.url, self.rpm)
+        with open(cached, 'wb') as file:
+            file.write(b'xyz')
+
+        path = self._copy_cached()
+        self.assertFalse(os.path.exists(path))
+        self.assertIsNone(self.fancy.artifact_cache.lookup(self.url))
+
+
+if __name__ == "__main__":
+    ha_syslog = logging.handlers.SysLogHandler('/dev/log')
+    ha_syslog.setFormatter(
+        logging.Formatter('%(name)s[%(process)d]: %(message)s'))
+    logging.root.addHandler(ha_syslog)
+    unittest.main()
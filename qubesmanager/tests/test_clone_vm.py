@@ -146,8 +146,8 @@ class CloneVMTest(unittest.TestCase):
             src_vm, dst_name, pool=None, label=self.qapp.labels['blue'])
         self.mock_thread().start.assert_called_once_with()
 
-    @unittest.mock.patch('subprocess.check_call')
-    def test_07_launch_settings(self, mock_call):
+    @unittest.mock.patch('qubesmanager.common_threads.get_process_launcher')
+    def test_07_launch_settings(self, mock_launcher):
         self.dialog.launch_settings.setChecked(True)
 
         self.dialog.name.setText("clone-test")
@@ -161,7 +161,8 @@ class CloneVMTest(unittest.TestCase):
         self.mock_thread().msg = ("Success", "Success")
         self.dialog.clone_finished()
 
-        mock_call.assert_called_once_with(['qubes-vm-settings', "clone-test"])
+        mock_launcher().open_vm_settings.assert_called_once_with(
+            self.qtapp, self.qapp, "clone-test", None)
 
     def test_08_progress_hides(self):
         self.dialog.name.setText("clone-test")
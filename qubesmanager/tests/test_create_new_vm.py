@@ -128,8 +128,8 @@ class NewVmTest(unittest.TestCase):
             unittest.mock.ANY, unittest.mock.ANY,
             {'provides_network': True}, unittest.mock.ANY)
 
-    @unittest.mock.patch('subprocess.check_call')
-    def test_07_launch_settings(self, mock_call):
+    @unittest.mock.patch('qubesmanager.common_threads.get_process_launcher')
+    def test_07_launch_settings(self, mock_launcher):
         self.dialog.launch_settings.setChecked(True)
 
         self.dialog.name.setText("test-vm")
@@ -145,7 +145,8 @@ class NewVmTest(unittest.TestCase):
         self.mock_thread().msg = None
         self.dialog.create_finished()
 
-        mock_call.assert_called_once_with(['qubes-vm-settings', "test-vm"])
+        mock_launcher().open_vm_settings.assert_called_once_with(
+            self.qtapp, self.qapp, "test-vm", None)
 
     def test_08_progress_hides(self):
         self.dialog.name.setText("test-vm")
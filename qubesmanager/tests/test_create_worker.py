@@ -0,0 +1,272 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, https://www.qubes-os.org/
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+import functools
+import logging.handlers
+import os
+import time
+import unittest
+import unittest.mock
+
+from qubesmanager import create_worker
+from qubesmanager import step_runner
+from qubesmanager import worker_pool
+from qubesmanager.tests import create_fancy_manager, init_qtapp, \
+    patch_fancy_manager
+
+
+class FancyManagerRunsTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.qtapp, self.loop = init_qtapp()
+        self.tmpdir = patch_fancy_manager(self)
+
+        settings = unittest.mock.Mock()
+        settings.value.side_effect = lambda key, default: default
+        self.pool = worker_pool.WorkerPool(settings=settings)
+        self.fancy = self._fancy_manager()
+
+        self.steps = self.fancy.get_install_script(
+            'debian-12', 'run-id',
+            'default-dvm', 'name', 'sys-net', 'red')
+        self.fancy.start_run('run-id', 'debian-12', self.steps)
+
+    def _fancy_manager(self):
+        return create_fancy_manager(self.pool)
+
+    def _create_file(self, name):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'wb') as file:
+            file.write(b'rpm')
+        return path
+
+    def test_01_steps_named_and_checked(self):
+        self.assertEqual([step['name'] for step in self.steps],
+                         ['mount scratch volume', 'prepare worker',
+                          'download', 'install', 'clean up scratch volume',
+                          'clean up worker'])
+        self.assertIn('check', self.steps[1])
+        # downloaded to the scratch volume
+        path = os.path.join(self.tmpdir, 'scratch', 'run-id', 'run-id')
+        self.assertIn('[ -s {} ]'.format(path), self.steps[2]['check'])
+        self.assertIn('install {}.rpm'.format(path), self.steps[3]['script'])
+
+    def test_02_success_forgotten(self):
+        path = self._create_file('run-id.rpm')
+        self.fancy.checkpoint('run-id', 'download')
+        self.fancy.finish_run('run-id', 0)
+        self.assertEqual(self.fancy.failed_runs(), [])
+        self.assertFalse(os.path.exists(path))
+
+    def test_03_resume_failed(self):
+        self.fancy.checkpoint('run-id', 'prepare worker')
+        self.fancy.checkpoint('run-id', 'download')
+        self.fancy.finish_run('run-id', 1)
+        self.pool.release('run-id')
+
+        runs = self.fancy.failed_runs()
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(runs[0]['installation_id'], 'debian-12')
+        self.assertEqual(runs[0]['worker'], 'fancy-worker-1')
+
+        # the worker is leased to another run
+        self.pool.acquire('other-run')
+        self.assertIsNone(self.fancy.resume_run('run-id'))
+        self.pool.release('other-run')
+
+        steps, completed = self.fancy.resume_run('run-id')
+        self.assertEqual(steps, self.steps)
+        self.assertEqual(completed, ['prepare worker', 'download'])
+        self.assertEqual(self.pool.leases, {'run-id': 'fancy-worker-1'})
+        # resumed in this process, so not resumable again
+        self.assertEqual(self.fancy.failed_runs(), [])
+
+    def test_04_interrupted_run_resumable(self):
+        self.assertEqual(self.fancy.failed_runs(), [])
+        # a manager which quit while running it
+        with unittest.mock.patch('os.getpid', return_value=2 ** 22 + 1):
+            self.fancy.start_run('run-id', 'debian-12', self.steps)
+        self.assertEqual(len(self.fancy.failed_runs()), 1)
+
+    def test_05_stale_runs_collected(self):
+        path = self._create_file('run-id')
+        scratch_path = os.path.join(self.tmpdir, 'scratch', 'run-id')
+        os.makedirs(scratch_path)
+        self.fancy.finish_run('run-id', 1)
+        self._fancy_manager()
+        self.assertEqual(len(self.fancy.failed_runs()), 1)
+        self.assertTrue(os.path.exists(path))
+
+        with unittest.mock.patch(
+                'time.time',
+                return_value=time.time() + self.fancy.run_max_age + 1):
+            self._fancy_manager()
+        self.assertEqual(self.fancy.failed_runs(), [])
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(scratch_path))
+
+    def test_06_unknown_run_ignored(self):
+        self.fancy.checkpoint('other-run', 'download')
+        self.fancy.finish_run('other-run', 1)
+        self.assertEqual(self.fancy.failed_runs(), [])
+
+    def test_07_download_verified(self):
+        self.fancy.catalog.update({
+            'format': 1,
+            'installations': [{
+                'id': 'debian-13', 'type': 'unman', 'group': 'Linux',
+                'url': 'https://example.com/debian-13.rpm',
+                'sha256': 'a' * 64}]})
+        steps = self.fancy.get_install_script(
+            'debian-13', 'run-2', 'default-dvm', 'name', 'sys-net', 'red')
+        script = steps[2]['script']
+        self.assertIn('https://example.com/debian-13.rpm', script)
+        self.assertIn('python3 -m qubesmanager.transfer fancy-worker-2 '
+                      '/tmp/run-2 {} --sha256 {}'.format(
+                          os.path.join(self.tmpdir, 'scratch', 'run-2',
+                                       'run-2'), 'a' * 64), script)
+        self.assertIn('--sha256 ' + 'a' * 64, script)
+        self.assertIn('--compress auto', script)
+
+    def test_08_scratch_volume_reused(self):
+        steps, directory = self.fancy.scratch_wrap('run-id')
+        self.assertEqual([step['name'] for step in steps],
+                         ['mount scratch volume', 'clean up scratch volume'])
+        self.assertEqual(directory, os.path.join(
+            self.fancy.fancy_mount_point_path, 'run-id'))
+        self.assertIn(directory, steps[0]['check'])
+        self.assertTrue(steps[1]['run_on_fail'])
+        self.assertNotIn('umount "$mount_point"', steps[1]['script'])
+
+    def test_09_unman_key_imported(self):
+        script = self.fancy.unman_key_exist('fancy-worker-1')
+        self.assertIn('qvm-run -p fancy-worker-1', script)
+        self.assertIn('sudo rpm --import /etc/pki/rpm-gpg/RPM-GPG-KEY-unman',
+                      script)
+
+
+class TerminalBufferTest(unittest.TestCase):
+    def test_01_progress_overwrites(self):
+        buffer = create_worker.TerminalBuffer()
+        self.assertEqual(buffer.append('downloading\n 10%'), ['downloading'])
+        buffer.append('\r 20%')
+        buffer.append('\r 30%')
+        self.assertEqual(buffer.partial, ' 30%')
+        self.assertEqual(buffer.append('\r100%\n'), ['100%'])
+        self.assertEqual(list(buffer.lines), ['downloading', '100%'])
+
+    def test_02_split_anywhere(self):
+        text = 'a\r\nprogress 1\rprogress 22\rdone\x1b[0;31m red\x1b[0m\r\n'
+        for size in range(1, 8):
+            buffer = create_worker.TerminalBuffer()
+            lines = []
+            for start in range(0, len(text), size):
+                lines.extend(buffer.append(text[start:start + size]))
+            self.assertEqual(lines, ['a', 'done red 22'], size)
+            self.assertEqual(buffer.partial, '')
+
+    def test_03_bounded(self):
+        buffer = create_worker.TerminalBuffer(max_lines=10)
+        for i in range(100):
+            buffer.append('line {}\n'.format(i))
+        self.assertEqual(len(buffer.lines), 10)
+        self.assertEqual(buffer.dropped, 90)
+
+        buffer.append('x' * (create_worker.MAX_LINE_LENGTH + 1))
+        self.assertEqual(buffer.partial, '')
+        self.assertEqual(buffer.append('\r\n'), [''])
+
+
+class LiveShellDialogTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.qtapp, self.loop = init_qtapp()
+        self.dialog = create_worker.LiveShellDialog()
+        self.addCleanup(self.dialog.deleteLater)
+
+    def _text(self):
+        return self.dialog.liveShell.toPlainText()
+
+    def test_01_repaint_rate_capped(self):
+        for percent in range(1000):
+            self.dialog.on_output('\r{:4d}'.format(percent))
+            if percent % 100 == 99:
+                self.dialog.on_output(' step\n')
+        # nothing painted until the timer fires
+        self.assertEqual(self.dialog.repaint_count, 0)
+        self.assertTrue(self.dialog.repaint_timer.isActive())
+
+        self.dialog.repaint_timer.timeout.emit()
+        self.assertEqual(self.dialog.repaint_count, 1)
+        lines = self._text().split('\n')
+        self.assertEqual(len(lines), 11)
+        self.assertEqual(lines[0], '  99 step')
+        self.assertEqual(lines[-1], '')
+
+        self.dialog.on_output('\rpartial')
+        self.dialog.repaint_output()
+        self.assertEqual(self._text().split('\n')[-1], 'partial')
+        self.dialog.on_output('\rover\n')
+        self.dialog.repaint_output()
+        self.assertEqual(self._text().split('\n')[-2:], ['overial', ''])
+
+    def test_02_scrollback_bounded(self):
+        self.dialog.liveShell.setMaximumBlockCount(50)
+        for i in range(20):
+            self.dialog.on_output('line {}\n'.format(i) * 10)
+            self.dialog.repaint_output()
+        self.assertEqual(self.dialog.liveShell.blockCount(), 50)
+        self.assertEqual(self._text().split('\n')[-2], 'line 19')
+
+    def test_03_own_lines(self):
+        self.dialog.on_output('progress')
+        self.dialog.add_line('== step ==')
+        self.dialog.repaint_output()
+        self.assertEqual(self._text(), 'progress\n== step ==\n')
+
+    def test_04_close_aborts_steps(self):
+        exit_codes = []
+        self.dialog.script_finished.connect(
+            lambda run_id, exit_code: exit_codes.append(exit_code))
+        with unittest.mock.patch.object(
+                step_runner, 'StepRunner', functools.partial(
+                    step_runner.StepRunner, timings_path=None)):
+            self.dialog.show()
+            self.dialog.run_script([
+                create_worker.get_step('sleep 10', False, 'install'),
+                create_worker.get_step('echo cleaned', True, 'cleanup')])
+        self.dialog.close()
+        # still shown while the cleanup steps run
+        self.assertTrue(self.dialog.isVisible())
+
+        deadline = time.monotonic() + 5
+        while not exit_codes and time.monotonic() < deadline:
+            self.qtapp.processEvents()
+            time.sleep(0.005)
+        self.assertEqual(exit_codes, [step_runner.ABORTED_EXIT_CODE])
+        self.assertFalse(self.dialog.isVisible())
+        self.assertIn('cleaned', self._text())
+
+
+
+if __name__ == "__main__":
+    ha_syslog = logging.handlers.SysLogHandler('/dev/log')
+    ha_syslog.setFormatter(
+        logging.Formatter('%(name)s[%(process)d]: %(message)s'))
+    logging.root.addHandler(ha_syslog)
+    unittest.main()
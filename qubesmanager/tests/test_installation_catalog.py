@@ -0,0 +1,176 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, https://www.qubes-os.org/
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+import json
+import logging.handlers
+import os
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+from qubesmanager import installation_catalog
+from qubesmanager.tests import init_qtapp
+
+
+def _catalog(*installations):
+    return {'format': installation_catalog.CATALOG_FORMAT,
+            'installations': list(installations)}
+
+
+DEBIAN_13 = {'id': 'debian-13', 'type': 'unman', 'group': 'Linux templates',
+             'version': '4.2.0', 'url': 'https://example.com/debian-13.rpm',
+             'sha256': 'a' * 64, 'icon': 'debian.png'}
+
+
+class InstallationCatalogTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.qtapp, self.loop = init_qtapp()
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+        self.cache_path = os.path.join(self.tmpdir, 'catalog.json')
+        self.catalog = installation_catalog.InstallationCatalog(
+            self.cache_path)
+
+    def test_01_builtin(self):
+        self.assertIsNone(self.catalog.fetched)
+        self.assertTrue(self.catalog.is_stale())
+        debian = self.catalog.get('debian-12')
+        self.assertEqual(debian.type, 'unman')
+        self.assertEqual(debian.version, '4.0.6-202301242054')
+        self.assertEqual(
+            debian.url, 'https://qubes.3isec.org/Templates_4.1/'
+            'qubes-template-debian-12-4.0.6-202301242054.noarch.rpm')
+        self.assertEqual(debian.name, 'debian-12 (4.0.6-202301242054)')
+        self.assertEqual(self.catalog.get('mirage-firewall').type, 'mirage')
+        self.assertIsNone(self.catalog.get('unknown'))
+
+        self.assertEqual([group for group, _ in self.catalog.groups()],
+                         ['Linux templates', 'Windows', 'Unikernels'])
+
+    def test_02_update_cached(self):
+        self.catalog.update(_catalog(DEBIAN_13))
+        self.assertEqual([installation.id for installation in self.catalog],
+                         ['debian-13'])
+        self.assertFalse(self.catalog.is_stale())
+
+        cached = installation_catalog.InstallationCatalog(self.cache_path)
+        self.assertEqual(cached.get('debian-13').sha256, 'a' * 64)
+        self.assertIsNone(cached.get('debian-12'))
+        self.assertAlmostEqual(cached.fetched, self.catalog.fetched)
+
+        with unittest.mock.patch(
+                'time.time', return_value=time.time() +
+                installation_catalog.MAX_AGE + 1):
+            self.assertTrue(cached.is_stale())
+
+    def test_03_invalid(self):
+        for data in (
+                None,
+                {'format': 0, 'installations': []},
+                _catalog({'id': 'x', 'type': 'unknown', 'group': 'g'}),
+                _catalog({'id': 'x', 'type': 'unman'}),
+                _catalog({'id': 'x', 'type': 'windows', 'group': 'g',
+                          'icon': '../../etc/passwd'}),
+                _catalog(DEBIAN_13, DEBIAN_13)):
+            with self.assertRaises(installation_catalog.InvalidCatalog):
+                self.catalog.update(data)
+        self.assertFalse(os.path.exists(self.cache_path))
+
+    def test_04_invalid_cache_ignored(self):
+        with open(self.cache_path, 'w', encoding='utf-8') as file:
+            file.write('{"fetched": 1, "catalog": {"format": 1')
+        catalog = installation_catalog.InstallationCatalog(self.cache_path)
+        self.assertIsNotNone(catalog.get('debian-12'))
+        self.assertIsNone(catalog.fetched)
+
+    def test_05_lazy_icons(self):
+        self.assertEqual(self.catalog._icons, {})
+        icon = self.catalog.icon('debian-12')
+        self.assertFalse(icon.isNull())
+        self.assertIs(self.catalog.icon('debian-12'), icon)
+        self.assertEqual(list(self.catalog._icons), ['debian-12'])
+        self.assertTrue(self.catalog.icon('unknown').isNull())
+
+    def test_06_builtin_icons_exist(self):
+        for installation in self.catalog:
+            self.assertTrue(os.path.exists(os.path.join(
+                installation_catalog.ICONS_DIRECTORY, installation.icon)),
+                installation.id)
+
+    def _refresh(self, command):
+        thread = installation_catalog.CatalogRefreshThread(command)
+        thread.start()
+        self.assertTrue(thread.wait(10000))
+        return thread
+
+    def test_07_refresh_thread(self):
+        path = os.path.join(self.tmpdir, 'fetched.json')
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(_catalog(DEBIAN_13), file)
+        thread = self._refresh(['cat', path])
+        self.assertIsNone(thread.msg)
+        self.catalog.update(thread.data)
+        self.assertIsNotNone(self.catalog.get('debian-13'))
+
+        thread = self._refresh(['sh', '-c', 'echo failed >&2; exit 1'])
+        self.assertIsNone(thread.data)
+        self.assertEqual(thread.msg, 'failed')
+
+        thread = self._refresh(['echo', '{"format": 1}'])
+        self.assertIsNone(thread.data)
+        self.assertIn('format', thread.msg)
+
+    def test_08_fetch_command(self):
+        self.assertEqual(
+            installation_catalog.fetch_command(
+                'https://example.com/catalog.json?a=1&b=2', 'default-dvm'),
+            ['qvm-run', '--dispvm=default-dvm', '--pass-io',
+             "curl -fsSL --max-time 60 "
+             "'https://example.com/catalog.json?a=1&b=2'"])
+
+    def test_09_script_values_checked(self):
+        """Values pasted into scripts in dom0 are plain"""
+        for field, value in (
+                ('url', 'https://e/"$(touch /tmp/pwn)"; id; '),
+                ('url', "https://example.com/a'b.rpm"),
+                ('url', 'http://example.com/debian-13.rpm'),
+                ('url', 'file:///etc/shadow'),
+                ('url', None),
+                ('sha256', '$(id)'),
+                ('sha256', 'A' * 64),
+                ('id', 'debian-13; id'),
+                ('id', ''),
+                ('version', '1 $(id)')):
+            data = dict(DEBIAN_13, **{field: value})
+            with self.assertRaises(installation_catalog.InvalidCatalog,
+                                   msg=field):
+                installation_catalog.Installation(data)
+        # not downloaded, so no url needed
+        installation_catalog.Installation(
+            {'id': 'win', 'type': 'windows', 'group': 'Windows'})
+
+
+if __name__ == "__main__":
+    ha_syslog = logging.handlers.SysLogHandler('/dev/log')
+    ha_syslog.setFormatter(
+        logging.Formatter('%(name)s[%(process)d]: %(message)s'))
+    logging.root.addHandler(ha_syslog)
+    unittest.main()
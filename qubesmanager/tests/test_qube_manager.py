@@ -22,20 +22,28 @@
 import asyncio
 import contextlib
 import functools
+import json
 import logging.handlers
 import unittest
 import unittest.mock
 
 import subprocess
+import threading
+import sys
+import statistics
 import datetime
 import time
+import tracemalloc
+import types
 
-from PyQt5 import QtTest, QtCore, QtWidgets
-from PyQt5.QtCore import (Qt, QSize)
+from PyQt5 import QtTest, QtCore, QtGui, QtWidgets
+from PyQt5.QtCore import (Qt, QSize, QModelIndex)
 from PyQt5.QtGui import (QIcon)
 
 from qubesadmin import Qubes, events, exc
 import qubesmanager.qube_manager as qube_manager
+from qubesmanager import common_threads
+from qubesmanager import utils as manager_utils
 from qubesmanager.tests import init_qtapp
 
 
@@ -88,6 +96,9 @@ class QubeManagerTest(unittest.TestCase):
 
         self.dialog = qube_manager.VmManagerWindow(
             self.qtapp, self.qapp, self.dispatcher)
+        # wait for the domains to be loaded in the background
+        self.dialog.cache_loader.wait()
+        self.qtapp.processEvents()
 
     def test_000_window_loads(self):
         self.assertTrue(self.dialog.table is not None, "Window did not load")
@@ -289,11 +300,34 @@ class QubeManagerTest(unittest.TestCase):
         model = self.dialog.qubes_model
         action_no = model.columns_indices.index('Is DVM Template')
         self.dialog.menu_view.actions()[action_no].trigger()
+        self.dialog.manager_settings.flush()
         mock_settings.assert_called_with('columns/Is DVM Template', True)
 
         self.dialog.menu_view.actions()[action_no].trigger()
+        self.dialog.manager_settings.flush()
         mock_settings.assert_called_with('columns/Is DVM Template', False)
 
+    def test_102_group_by(self):
+        action = next(action for action in self.dialog.group_actions.actions()
+                      if action.data() == 'klass')
+        action.trigger()
+        self.assertTrue(self.dialog.is_grouped())
+
+        # the same qubes as in the (filtered) table, grouped by class
+        groups = self.dialog.group_model
+        self.assertEqual(
+            sum(groups.rowCount(groups.index(row, 0))
+                for row in range(groups.rowCount())),
+            self.dialog.proxy.rowCount())
+        for row in range(groups.rowCount()):
+            group = groups.index(row, 0)
+            klasses = {groups.index(child, 0, group).data(Qt.UserRole).klass
+                       for child in range(groups.rowCount(group))}
+            self.assertEqual(len(klasses), 1)
+
+        self.dialog.group_actions.actions()[0].trigger()
+        self.assertFalse(self.dialog.is_grouped())
+
     @unittest.mock.patch('qubesmanager.settings.VMSettingsWindow')
     def test_200_vm_open_settings(self, mock_window):
         selected_vm = self._select_non_admin_vm()
@@ -392,11 +426,24 @@ class QubeManagerTest(unittest.TestCase):
             self.dialog.action_updatevm)
 
         with unittest.mock.patch('qubesmanager.qube_manager.UpdateVMThread') \
-                as mock_update:
+                as mock_update, \
+                unittest.mock.patch.object(self.dialog.launcher, 'start') \
+                as mock_start:
             QtTest.QTest.mouseClick(widget,
                                     QtCore.Qt.LeftButton)
-            mock_update.assert_called_once_with(selected_vm)
-            mock_update().start.assert_called_once_with()
+            mock_update.assert_not_called()
+            mock_start.assert_called_once_with(
+                "/usr/bin/qubes-dom0-update", ["--clean", "--gui"],
+                on_finished=self.dialog.dom0_update_finished)
+
+    @unittest.mock.patch('qubesmanager.qube_manager.QMessageBox.warning')
+    def test_208_dom0_update_failed(self, mock_warning):
+        self.dialog.dom0_update_finished(0)
+        mock_warning.assert_not_called()
+
+        self.dialog.dom0_update_finished(1)
+        mock_warning.assert_called_once_with(
+            self.dialog, unittest.mock.ANY, unittest.mock.ANY)
 
     @unittest.mock.patch("PyQt5.QtWidgets.QInputDialog.getText",
                          return_value=("command to run", True))
@@ -661,12 +708,15 @@ class QubeManagerTest(unittest.TestCase):
             self.dialog.action_exit.trigger()
             mock_close.assert_called_once_with()
 
-    @unittest.mock.patch('subprocess.check_call')
-    def test_231_template_manager(self, mock_subprocess):
+    def test_231_template_manager(self):
         self.assertTrue(self.dialog.action_manage_templates.isEnabled())
 
-        self.dialog.action_manage_templates.trigger()
-        mock_subprocess.assert_called_once_with('qubes-template-manager')
+        with unittest.mock.patch.object(self.dialog.launcher, 'start') \
+                as mock_start, \
+                unittest.mock.patch('qubesmanager.utils.is_imported',
+                                    return_value=False):
+            self.dialog.action_manage_templates.trigger()
+        mock_start.assert_called_once_with('qubes-template-manager', ())
 
     @unittest.mock.patch('qubesmanager.clone_vm.CloneVMDlg')
     def test_232_clonevm(self, mock_clone):
@@ -717,8 +767,10 @@ class QubeManagerTest(unittest.TestCase):
         with unittest.mock.patch('PyQt5.QtCore.QSettings.setValue')\
                 as mock_setvalue:
             self.dialog.action_menubar.trigger()
+            self.dialog.manager_settings.flush()
             mock_setvalue.assert_called_with('view/menubar_visible', False)
             self.dialog.action_toolbar.trigger()
+            self.dialog.manager_settings.flush()
             mock_setvalue.assert_called_with('view/toolbar_visible', False)
 
             self.assertFalse(self.dialog.menubar.isVisible(),
@@ -1372,8 +1424,11 @@ class QubeManagerTest(unittest.TestCase):
             if target_vm_name:
                 break
 
-        for i in range(self.dialog.table.model().rowCount()):
-            self._get_table_vminfo(i).update = unittest.mock.Mock()
+        # VmInfo uses __slots__, so the method can only be mocked on the class
+        patcher = unittest.mock.patch.object(
+            qube_manager.VmInfo, 'update', autospec=True)
+        mock_update = patcher.start()
+        self.addCleanup(patcher.stop)
 
         self.addCleanup(
             subprocess.call,
@@ -1384,8 +1439,9 @@ class QubeManagerTest(unittest.TestCase):
         # update() is called on every row once at dispatcher startup, so count
         # any _extra_ calls
         for i in range(self.dialog.table.model().rowCount()):
-            call_count = self._get_table_vminfo(
-                i).update.call_count
+            vm_info = self._get_table_vminfo(i)
+            call_count = sum(1 for call in mock_update.call_args_list
+                             if call[0][0] is vm_info)
             if self._get_table_item(i, "Template") == target_vm_name:
                 self.assertGreater(call_count, 1,
                         "'update' not called for VM '{}'".format(
@@ -1603,16 +1659,6 @@ class QubeManagerThreadTest(unittest.TestCase):
 
         self.assertIsNotNone(thread.msg)
 
-    @unittest.mock.patch('subprocess.check_call')
-    def test_20_update_vm_thread_dom0(self, check_call):
-        vm = unittest.mock.Mock(spec=['klass'])
-        vm.klass = 'AdminVM'
-        thread = qube_manager.UpdateVMThread(vm)
-        thread.run()
-
-        check_call.assert_called_once_with(
-            ["/usr/bin/qubes-dom0-update", "--clean", "--gui"])
-
     @unittest.mock.patch('subprocess.call')
     def test_21_update_vm_thread_running(self, mock_call):
         vm = unittest.mock.Mock(
@@ -1737,6 +1783,954 @@ class VMShutdownMonitorTest(unittest.TestCase):
         self.assertEqual(mock_question.call_count, 0)
         self.assertEqual(mock_timer.call_count, 1)
 
+    @unittest.mock.patch('qubesmanager.qube_manager.QMessageBox')
+    @unittest.mock.patch('PyQt5.QtCore.QTimer.singleShot')
+    def test_05_finished(self, mock_timer, _mock_question):
+        mock_vm = unittest.mock.Mock()
+        mock_vm.is_running.return_value = True
+        mock_vm.start_time = datetime.datetime.now().timestamp() - 3000
+        mock_vm.shutdown_timeout = 30
+
+        monitor = qube_manager.VmShutdownMonitor(mock_vm)
+        finished = unittest.mock.Mock()
+        monitor.finished.connect(finished)
+
+        monitor.check_if_vm_has_shutdown()
+        finished.assert_not_called()
+        self.assertEqual(mock_timer.call_count, 1)
+
+        mock_vm.is_running.return_value = False
+        monitor.check_if_vm_has_shutdown()
+        finished.assert_called_once_with()
+
+class VmInfoTest(unittest.TestCase):
+    @staticmethod
+    def _mock_vm(klass):
+        vm = unittest.mock.MagicMock()
+        vm.name = 'test-vm'
+        vm.klass = klass
+        vm.backup_timestamp = None
+        vm.is_running.return_value = False
+        return vm
+
+    def test_01_prefetched_updates_available(self):
+        vm = self._mock_vm('TemplateVM')
+
+        info = qube_manager.VmInfo(vm, updates_available=True)
+
+        self.assertNotIn(unittest.mock.call('updates-available', False),
+                         vm.features.get.call_args_list)
+        self.assertEqual(info.state['outdated'], 'update')
+
+        info.update()
+        self.assertNotIn(unittest.mock.call('updates-available', False),
+                         vm.features.get.call_args_list)
+        self.assertEqual(info.state['outdated'], 'update')
+
+    def test_02_updates_available_fetched_without_prefetch(self):
+        vm = self._mock_vm('StandaloneVM')
+        vm.features.get.return_value = '1'
+
+        info = qube_manager.VmInfo(vm)
+
+        self.assertIn(unittest.mock.call('updates-available', False),
+                      vm.features.get.call_args_list)
+        self.assertTrue(info.updates_available)
+
+    def test_03_set_updates_available(self):
+        vm = self._mock_vm('TemplateVM')
+        info = qube_manager.VmInfo(vm, updates_available=True)
+
+        info.set_updates_available(False)
+        self.assertEqual(info.state['outdated'], '')
+
+        info.set_updates_available('1')
+        self.assertEqual(info.state['outdated'], 'update')
+
+    def test_04_get_feature_for_vms(self):
+        vms = [self._mock_vm('TemplateVM') for _ in range(20)]
+        for i, vm in enumerate(vms):
+            vm.name = 'vm{}'.format(i)
+            vm.features.get.return_value = i % 2
+
+        result = manager_utils.get_feature_for_vms(
+            vms, 'updates-available', False)
+
+        self.assertDictEqual(
+            result, {'vm{}'.format(i): i % 2 for i in range(20)})
+        for vm in vms:
+            vm.features.get.assert_called_once_with(
+                'updates-available', False)
+
+    def test_05_compact_representation(self):
+        vm = self._mock_vm('AppVM')
+        info = qube_manager.VmInfo(vm, updates_available=False)
+
+        self.assertFalse(hasattr(info, '__dict__'))
+        self.assertFalse(hasattr(info.state, '__dict__'))
+
+    def test_06_vm_state(self):
+        state = qube_manager.VmState()
+        self.assertEqual(state, {'power': '', 'outdated': ''})
+
+        state['power'] = 'Running'
+        state['outdated'] = 'to-be-outdated'
+        self.assertEqual(state['power'], 'Running')
+        self.assertEqual(state.get('outdated', ''), 'to-be-outdated')
+        self.assertIsNone(state.get('nonexistent'))
+
+        with self.assertRaises(ValueError):
+            state['power'] = 'Sleeping'
+        with self.assertRaises(KeyError):
+            state['nonexistent'] = 'Running'
+
+    def test_07_repeated_strings_shared(self):
+        infos = [qube_manager.VmInfo(_FakeVm(qid), updates_available=False)
+                 for qid in range(1, 3)]
+
+        self.assertIs(infos[0].template, infos[1].template)
+        self.assertIs(infos[0].netvm, infos[1].netvm)
+        self.assertIs(infos[0].dvm, infos[1].dvm)
+        self.assertEqual(infos[0].netvm, 'default (sys-firewall)')
+
+    def test_10_memory_5k_domains(self):
+        domain_count = 5000
+        vms = [_FakeVm(qid) for qid in range(1, domain_count + 1)]
+
+        tracemalloc.start()
+        try:
+            before, _ = tracemalloc.get_traced_memory()
+            infos = [qube_manager.VmInfo(vm, updates_available=False)
+                     for vm in vms]
+            after, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        allocated = after - before
+        per_row = allocated / len(infos)
+        self.assertLess(per_row, 512, "VmInfo memory: {} domains, {:.1f} KiB "
+                        "total, {:.0f} B per row".format(
+                            domain_count, allocated / 1024, per_row))
+
+
+class _FakeVm:
+    # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    """Minimal stand-in for a qubesadmin domain, cheap enough to create by
+    thousands"""
+
+    class _Named:
+        # pylint: disable=too-few-public-methods
+        def __init__(self, name):
+            self.name = name
+
+        def __str__(self):
+            return self.name
+
+    def __init__(self, qid):
+        self.qid = qid
+        self.name = 'vm-{}'.format(qid)
+        self.klass = ''.join(['App', 'VM'])
+        self.label = None
+        self.icon = ''.join(['appvm-', 'red'])
+        self.updateable = False
+        # fresh (non-interned) copies, as returned by qubesd
+        self.template = self._Named(''.join(['fedora-', '38']))
+        self.netvm = self._Named(''.join(['sys-', 'firewall']))
+        self.default_dispvm = self._Named(''.join(['default-', 'dvm']))
+        self.ip = '10.137.0.{}'.format(qid % 250)
+        self.include_in_backups = True
+        self.backup_timestamp = None
+        self.template_for_dispvms = False
+        self.virt_mode = ''.join(['pv', 'h'])
+        self.volumes = {}
+        self.features = {}
+
+    @staticmethod
+    def get_power_state():
+        return 'Halted'
+
+    @staticmethod
+    def is_running():
+        return False
+
+    @staticmethod
+    def property_is_default(_prop):
+        return True
+
+    @staticmethod
+    def get_disk_utilization():
+        return 1024 ** 3
+
+
+class ResyncTest(unittest.TestCase):
+    class _CountingVm(_FakeVm):
+        # pylint: disable=too-few-public-methods
+        def __init__(self, qid, power_state='Halted'):
+            super().__init__(qid)
+            self.power_state = power_state
+            self.disk_queries = 0
+
+        def get_power_state(self):
+            return self.power_state
+
+        def get_disk_utilization(self):
+            self.disk_queries += 1
+            return 1024 ** 3
+
+    def setUp(self):
+        super().setUp()
+        self.vms = [self._CountingVm(qid) for qid in range(1, 6)]
+        self._load_cache()
+
+    def _load_cache(self):
+        self.cache = qube_manager.QubesCache(unittest.mock.Mock())
+        for vm in self.vms:
+            self.cache.add_vm(vm, False)
+        for vm in self.vms:
+            vm.disk_queries = 0
+
+    def _resync(self, vms):
+        thread = qube_manager.ResyncThread(vms, self.cache.get_states())
+        thread.run()
+        self.assertIsNone(thread.msg)
+        return thread
+
+    def test_01_nothing_changed(self):
+        thread = self._resync(self.vms)
+        self.assertEqual((thread.added, thread.changed, thread.removed),
+                         ([], [], []))
+        # only the power states are compared, no properties are fetched
+        self.assertEqual([vm.disk_queries for vm in self.vms], [0] * 5)
+
+    def test_02_diff(self):
+        vms = [vm for vm in self.vms if vm.name != 'vm-3']
+        vms[1].power_state = 'Running'
+        vms.append(self._CountingVm(6, 'Running'))
+
+        thread = self._resync(vms)
+
+        self.assertEqual([info.name for info in thread.added], ['vm-6'])
+        self.assertEqual([info.name for info in thread.changed], ['vm-2'])
+        self.assertEqual(thread.removed, ['vm-3'])
+
+        self.cache.apply_changes(thread.added, thread.changed, thread.removed)
+        self.assertEqual([info.name for info in self.cache],
+                         ['vm-1', 'vm-2', 'vm-4', 'vm-5', 'vm-6'])
+        self.assertEqual(self.cache.get_vm(qid=2).state['power'], 'Running')
+        self.assertIs(self.cache.get_vm(qid=2), thread.changed[0])
+        self.assertEqual(self.cache.get_vm(qid=6).name, 'vm-6')
+        with self.assertRaises(KeyError):
+            self.cache.get_vm(qid=3)
+
+    def test_03_changed_by_events_meanwhile(self):
+        thread = self._resync(
+            self.vms[:-1] + [self._CountingVm(6), self._CountingVm(7)])
+        self.assertEqual(thread.removed, ['vm-5'])
+
+        # events already added vm-6 and removed vm-5 before the resync ended
+        self.cache.add_vm(self._CountingVm(6), False)
+        self.cache.remove_vm(name='vm-5')
+
+        self.cache.apply_changes(thread.added, thread.changed, thread.removed)
+        self.assertEqual([info.name for info in self.cache],
+                         ['vm-1', 'vm-2', 'vm-3', 'vm-4', 'vm-6', 'vm-7'])
+
+    def test_04_template_started(self):
+        for vm in self.vms[2:4]:
+            vm.template = _FakeVm._Named('vm-1')
+        self.vms[2].power_state = 'Running'
+        self._load_cache()
+
+        self.vms[0].power_state = 'Running'
+        thread = self._resync(self.vms)
+
+        # the running qube based on the template is fetched again too
+        self.assertEqual(sorted(info.name for info in thread.changed),
+                         ['vm-1', 'vm-3'])
+        self.assertEqual([vm.disk_queries for vm in self.vms],
+                         [1, 0, 1, 0, 0])
+
+    def test_05_removed_meanwhile(self):
+        class _RemovedVm(self._CountingVm):
+            @property
+            def label(self):
+                raise KeyError(self.name)
+
+            @label.setter
+            def label(self, _value):
+                pass
+
+        self.vms[1].power_state = 'Running'
+        thread = self._resync(self.vms[:2] + [_RemovedVm(9)] + self.vms[2:])
+
+        self.assertEqual(thread.added, [])
+        self.assertEqual([info.name for info in thread.changed], ['vm-2'])
+        self.assertEqual(thread.removed, [])
+
+
+class IncrementalLoadTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.qtapp, self.loop = init_qtapp()
+        self.vms = [_FakeVm(qid) for qid in range(1, 501)]
+        self.cache = qube_manager.QubesCache(unittest.mock.Mock())
+        for vm in self.vms:
+            self.cache.add_placeholder(vm)
+        self.model = qube_manager.QubesTableModel(self.cache)
+
+    def _data(self, row, column, role=Qt.DisplayRole):
+        return self.model.data(self.model.index(row, column), role)
+
+    def test_01_placeholders(self):
+        self.assertFalse(self.cache.is_loaded())
+        self.assertEqual(self._data(0, 2), 'vm-1')
+        self.assertEqual(self._data(0, 4), 'loading...')
+        self.assertIsNone(self._data(0, 3))
+        self.assertIs(self._data(0, 2, Qt.UserRole), self.cache.get_vm(0))
+        # not known before loading, left out of the network menu
+        self.assertIsNone(self.cache.get_vm(0).provides_network)
+        self.assertFalse(self.model.setData(
+            self.model.index(0, 8), Qt.Checked, Qt.CheckStateRole))
+
+    def test_02_fetch_more(self):
+        root = QModelIndex()
+        chunk = self.model.fetch_chunk
+        self.assertEqual(self.model.rowCount(root), chunk)
+        self.assertTrue(self.model.canFetchMore(root))
+
+        self.model.fetchMore(root)
+        self.assertEqual(self.model.rowCount(root), 2 * chunk)
+        self.model.fetchMore(root)
+        self.assertEqual(self.model.rowCount(root), len(self.vms))
+        self.assertFalse(self.model.canFetchMore(root))
+
+    def test_03_replace_placeholders(self):
+        infos = [qube_manager.VmInfo(vm, False)
+                 for vm in self.vms[299:301]]
+        # vm-301 was meanwhile added by an event, already loaded
+        self.cache.add_vm(self.vms[300], False)
+        self.assertEqual(self.cache.replace_placeholders(infos), [299])
+        self.assertIs(self.cache.get_vm(299), infos[0])
+
+        self.model.rows_loaded([299])
+        # rows up to the loaded one are shown
+        self.assertEqual(self.model.rowCount(QModelIndex()), 300)
+        self.assertEqual(self._data(299, 4), 'fedora-38')
+        self.assertFalse(self.cache.get_vm(299).provides_network)
+
+    def test_04_loader_thread(self):
+        chunks = []
+        loader = qube_manager.CacheLoaderThread(self.vms)
+        loader.chunk_loaded.connect(chunks.append, Qt.DirectConnection)
+        loader.run()
+
+        self.assertEqual([len(chunk) for chunk in chunks],
+                         [loader.chunk_size] * 10)
+        for chunk in chunks:
+            self.cache.replace_placeholders(chunk)
+        self.assertTrue(self.cache.is_loaded())
+        self.assertEqual(loader.loaded, len(self.vms))
+
+    def test_05_first_paint(self):
+        vms = [_FakeVm(qid) for qid in range(1, 5001)]
+        start_time = time.monotonic()
+        cache = qube_manager.QubesCache(unittest.mock.Mock())
+        for vm in vms:
+            cache.add_placeholder(vm)
+        model = qube_manager.QubesTableModel(cache)
+        view = QtWidgets.QTableView()
+        view.setModel(model)
+        view.resize(800, 600)
+        view.show()
+        self.qtapp.processEvents()
+        elapsed = time.monotonic() - start_time
+        view.close()
+
+        self.assertLess(elapsed, 1)
+        self.assertLess(model.rowCount(QModelIndex()), len(vms))
+
+    def test_06_loader_thread_interrupted(self):
+        chunks = []
+        loader = qube_manager.CacheLoaderThread(self.vms)
+
+        def on_chunk_loaded(chunk):
+            chunks.append(chunk)
+            # e.g. the window was closed
+            loader.requestInterruption()
+        loader.chunk_loaded.connect(on_chunk_loaded, Qt.DirectConnection)
+        loader.start()
+        self.assertTrue(loader.wait(10000))
+        self.assertEqual(len(chunks), 1)
+
+    def test_07_loader_resumed(self):
+        # the window was closed after the first chunk, then shown again
+        loader = qube_manager.CacheLoaderThread(self.vms)
+        loader.chunk_loaded.connect(self.cache.replace_placeholders,
+                                    Qt.DirectConnection)
+        loader.chunk_loaded.connect(
+            lambda _chunk: loader.requestInterruption(), Qt.DirectConnection)
+        loader.start()
+        self.assertTrue(loader.wait(10000))
+        placeholders = self.cache.get_placeholders()
+        self.assertEqual(len(placeholders),
+                         len(self.vms) - loader.chunk_size)
+        self.assertEqual(placeholders[0].name, 'vm-51')
+
+        loader = qube_manager.CacheLoaderThread(placeholders)
+        loader.chunk_loaded.connect(self.cache.replace_placeholders,
+                                    Qt.DirectConnection)
+        loader.run()
+        self.assertTrue(self.cache.is_loaded())
+        self.assertEqual(self.cache.get_placeholders(), [])
+
+
+class GroupModelTest(unittest.TestCase):
+    class _Vm(_FakeVm):
+        # pylint: disable=too-few-public-methods
+        def __init__(self, qid, template, power_state='Halted'):
+            super().__init__(qid)
+            self.template = self._Named(template)
+            self.power_state = power_state
+
+        def get_power_state(self):
+            return self.power_state
+
+    def setUp(self):
+        super().setUp()
+        self.qtapp, self.loop = init_qtapp()
+        self.vms = [self._Vm(qid, 'fedora' if qid % 2 else 'debian')
+                    for qid in range(1, 11)]
+        self.vms[0].power_state = 'Running'
+        self.cache = qube_manager.QubesCache(unittest.mock.Mock())
+        for vm in self.vms:
+            self.cache.add_vm(vm, False)
+        self.model = qube_manager.QubesTableModel(self.cache)
+        self.groups = qube_manager.QubesGroupModel(self.model, 'template')
+
+    def _group_names(self):
+        return [self.groups.index(row, 2).data()
+                for row in range(self.groups.rowCount())]
+
+    def _assert_aggregates(self):
+        # the incrementally kept aggregates match a full recount
+        for row in range(self.groups.rowCount()):
+            group = self.groups.group_by_key(
+                self.groups._groups[row].key)  # pylint: disable=protected-access
+            infos = [self.cache.get_vm(name=name) for name in group.names]
+            self.assertEqual(
+                group.running,
+                sum(info.state['power'] == 'Running' for info in infos))
+            self.assertEqual(group.disk,
+                             sum(info.disk_float for info in infos))
+
+    def test_01_groups(self):
+        self.assertEqual(self._group_names(), ['debian (5)', 'fedora (5)'])
+        fedora = self.groups.index(1, 0)
+        self.assertEqual(self.groups.rowCount(fedora), 5)
+        self.assertEqual(self.groups.index(1, 3).data(), '1 running')
+        self.assertEqual(self.groups.index(1, 6).data(), '5120.0 MiB')
+
+        child = self.groups.index(0, 2, fedora)
+        self.assertEqual(child.data(), 'vm-1')
+        self.assertEqual(self.groups.parent(child).row(), 1)
+        self.assertIs(child.data(Qt.UserRole), self.cache.get_vm(name='vm-1'))
+        self.assertIsNone(fedora.data(Qt.UserRole))
+        self._assert_aggregates()
+
+    def test_02_incremental_update(self):
+        self.vms[2].power_state = 'Running'
+        with unittest.mock.patch.object(
+                qube_manager.QubesGroupModel, 'aggregates',
+                wraps=qube_manager.QubesGroupModel.aggregates) as mock_agg:
+            self.cache.get_vm(name='vm-3').update()
+            self.model.vm_changed('vm-3')
+        # only the changed qube was looked at
+        self.assertEqual(mock_agg.call_count, 1)
+        self.assertEqual(self.groups.index(1, 3).data(), '2 running')
+        self._assert_aggregates()
+
+    def test_03_regroup(self):
+        self.vms[0].template = self._Vm._Named('whonix')
+        self.cache.get_vm(name='vm-1').update(event='property-set:template')
+        self.model.vm_changed('vm-1')
+        self.assertEqual(self._group_names(),
+                         ['debian (5)', 'fedora (4)', 'whonix (1)'])
+        self.assertEqual(self.groups.index(1, 3).data(), '0 running')
+        self.assertEqual(self.groups.index(2, 3).data(), '1 running')
+
+        self.model.remove_vm('vm-1')
+        self.assertEqual(self._group_names(), ['debian (5)', 'fedora (4)'])
+        self._assert_aggregates()
+
+    def test_04_added(self):
+        self.cache.add_vm(self._Vm(11, 'debian', 'Running'), False)
+        self.model.rows_added()
+        self.assertEqual(self._group_names(), ['debian (6)', 'fedora (5)'])
+        self.assertEqual(self.groups.index(0, 3).data(), '1 running')
+        # vm-10, vm-11, vm-2, ...
+        child = self.groups.index(1, 2, self.groups.index(0, 0))
+        self.assertEqual(child.data(), 'vm-11')
+        self._assert_aggregates()
+
+    def test_05_placeholders_loaded(self):
+        cache = qube_manager.QubesCache(unittest.mock.Mock())
+        for vm in self.vms:
+            cache.add_placeholder(vm)
+        model = qube_manager.QubesTableModel(cache)
+        groups = qube_manager.QubesGroupModel(model, 'template')
+        self.assertEqual(groups.index(0, 2).data(), 'loading... (10)')
+
+        infos = [qube_manager.VmInfo(vm, False) for vm in self.vms[:2]]
+        model.rows_loaded(cache.replace_placeholders(infos))
+        self.assertEqual(
+            [groups.index(row, 2).data() for row in range(3)],
+            ['loading... (8)', 'debian (1)', 'fedora (1)'])
+
+    def test_06_filtered(self):
+        groups = qube_manager.QubesGroupModel(
+            self.model, 'klass',
+            lambda row: self.cache.get_vm(row).state['power'] == 'Running')
+        self.assertEqual(groups.index(0, 2).data(), 'AppVM (1)')
+
+        self.vms[0].power_state = 'Halted'
+        self.cache.get_vm(name='vm-1').update()
+        self.model.vm_changed('vm-1')
+        self.assertEqual(groups.rowCount(), 0)
+
+
+class ViewPresetTest(unittest.TestCase):
+    class _Vm(_FakeVm):
+        # pylint: disable=too-few-public-methods
+        def get_power_state(self):
+            return 'Running' if self.qid % 3 == 0 else 'Halted'
+
+    class _CountingProxy(qube_manager.QubesProxyModel):
+        def __init__(self):
+            super().__init__()
+            self.filtered = 0
+
+        def filterAcceptsRow(self, sourceRow, sourceParent):
+            self.filtered += 1
+            return super().filterAcceptsRow(sourceRow, sourceParent)
+
+    def setUp(self):
+        super().setUp()
+        self.qtapp, self.loop = init_qtapp()
+        self.cache = qube_manager.QubesCache(unittest.mock.Mock())
+        for qid in range(1, 1001):
+            self.cache.add_vm(self._Vm(qid), False)
+        self.model = qube_manager.QubesTableModel(self.cache)
+        self.model.fetch_rows(len(self.cache))
+        self.proxy = self._CountingProxy()
+        self.proxy.setSourceModel(self.model)
+        self.proxy.sort(2, Qt.AscendingOrder)
+        self.proxy.rowCount()
+
+        self.running = qube_manager.ViewPreset(
+            show=['running'], sort_column=2, sort_order=Qt.DescendingOrder,
+            hidden_columns=['IP'], search='vm-9')
+        self.all = qube_manager.ViewPreset()
+
+    def _apply(self, preset):
+        self.proxy.apply_view(preset.show, preset.search,
+                              preset.sort_column, preset.sort_order)
+        # rows are filtered lazily, when the view asks for them
+        return self.proxy.rowCount()
+
+    def _names(self, count=3):
+        return [self.proxy.index(row, 2).data() for row in range(count)]
+
+    def test_01_round_trip(self):
+        data = self.running.to_dict()
+        self.assertEqual(qube_manager.ViewPreset.from_dict(data),
+                         self.running)
+        self.assertEqual(data['show'], ['running'])
+        self.assertEqual(data['sort_order'], int(Qt.DescendingOrder))
+        self.assertNotEqual(self.running, self.all)
+        self.assertEqual(qube_manager.ViewPreset.from_dict({}), self.all)
+
+    def test_02_single_pass(self):
+        self.proxy.filtered = 0
+        # running are those divisible by 3: vm-9, 4 of vm-9x, 34 of vm-9xx
+        self.assertEqual(self._apply(self.running), 39)
+        self.assertEqual(self.proxy.filtered, len(self.cache))
+        self.assertEqual(self._names(), ['vm-999', 'vm-996', 'vm-993'])
+
+        self.proxy.filtered = 0
+        self.assertEqual(self._apply(self.all), 1000)
+        self.assertEqual(self.proxy.filtered, len(self.cache))
+        self.assertEqual(self._names(), ['vm-1', 'vm-10', 'vm-100'])
+        self.assertEqual(self.proxy.sortColumn(), 2)
+        self.assertEqual(self.proxy.sortOrder(), Qt.AscendingOrder)
+
+    def test_03_persistent_index_kept(self):
+        index = QtCore.QPersistentModelIndex(self.proxy.index(1, 2))
+        self.assertEqual(index.data(), 'vm-10')
+        self._apply(qube_manager.ViewPreset(sort_order=Qt.DescendingOrder))
+        self.assertEqual(index.data(), 'vm-10')
+        self.assertEqual(index.row(), 998)
+
+    def test_04_sort_by_state(self):
+        self.proxy.sort(3, Qt.AscendingOrder)
+        # running first, then by name
+        self.assertEqual(self._names(), ['vm-102', 'vm-105', 'vm-108'])
+        self.assertEqual(self.proxy.index(999, 2).data(), 'vm-998')
+
+    def test_05_switch_time(self):
+        durations = []
+        for _ in range(10):
+            for preset in (self.running, self.all):
+                start_time = time.monotonic()
+                self._apply(preset)
+                durations.append(time.monotonic() - start_time)
+        self.assertLess(statistics.median(durations), 0.01)
+
+    def test_06_sorted_only_when_out_of_order(self):
+        self.proxy.sort(3, Qt.AscendingOrder)
+        layout_changes = []
+        self.proxy.layoutChanged.connect(
+            lambda *_args: layout_changes.append(True))
+
+        # e.g. an event which did not move the qube
+        self.model.vm_changed('vm-1')
+        self.proxy.invalidate()
+        self.assertEqual(layout_changes, [])
+
+        self.cache.get_vm(name='vm-1').state['power'] = 'Running'
+        self.model.vm_changed('vm-1')
+        self.proxy.invalidate()
+        self.assertEqual(layout_changes, [True])
+        self.assertEqual(self._names(1), ['vm-1'])
+
+        self.proxy.invalidate()
+        self.assertEqual(layout_changes, [True])
+
+
+class BufferedSettingsTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.qtapp, self.loop = init_qtapp()
+        self.qsettings = unittest.mock.MagicMock(spec=QtCore.QSettings)
+        self.settings = manager_utils.BufferedSettings(
+            self.qsettings, delay=20, max_delay=100)
+        # stands in for the manager window in its event handlers
+        self.window = types.SimpleNamespace(
+            manager_settings=self.settings,
+            proxy=unittest.mock.Mock(**{'sortColumn.return_value': 2,
+                                        'sortOrder.return_value': 0}))
+
+    def _replay_storm(self):
+        # a window drag and proxy invalidates caused by many events
+        for i in range(1000):
+            qube_manager.VmManagerWindow.resizeEvent(
+                self.window, QtGui.QResizeEvent(QSize(800 + i, 600),
+                                                QSize(799 + i, 600)))
+            qube_manager.VmManagerWindow.save_sorting(self.window)
+
+    def test_01_storm_batched(self):
+        self._replay_storm()
+        self.assertEqual(self.qsettings.setValue.call_count, 0)
+
+        QtTest.QTest.qWait(50)
+        # only the last value of each setting was written
+        self.assertEqual(self.qsettings.setValue.call_count, 3)
+        self.qsettings.setValue.assert_any_call('window_size',
+                                                QSize(1799, 600))
+        self.assertEqual(self.qsettings.sync.call_count, 1)
+
+        # unchanged values are not written again
+        self._replay_storm()
+        self.settings.flush()
+        self.assertEqual(self.qsettings.setValue.call_count, 4)
+
+    def test_02_periodic_flush(self):
+        # changes that keep coming are still written every max_delay
+        start_time = time.monotonic()
+        while time.monotonic() - start_time < 0.35:
+            self.settings.setValue('window_size', time.monotonic())
+            QtTest.QTest.qWait(5)
+        self.assertGreaterEqual(self.qsettings.sync.call_count, 2)
+        self.assertLess(self.qsettings.setValue.call_count, 10)
+
+    def test_03_read_pending(self):
+        self.qsettings.value.return_value = 'true'
+        self.settings.setValue('columns/IP', True)
+        self.assertEqual(self.settings.value('columns/IP'), 'true')
+        # read back through QSettings after writing it
+        self.qsettings.setValue.assert_called_once_with('columns/IP', True)
+
+
+class MemoryGrowthTest(unittest.TestCase):
+    class _Thread(QtCore.QThread):
+        def __init__(self):
+            super().__init__()
+            self.event = threading.Event()
+
+        def run(self):
+            self.event.wait(10)
+
+    def setUp(self):
+        super().setUp()
+        self.qtapp, self.loop = init_qtapp()
+        self.cache = qube_manager.QubesCache(unittest.mock.Mock())
+        for qid in range(1, 101):
+            self.cache.add_vm(_FakeVm(qid), False)
+        self.model = qube_manager.QubesTableModel(self.cache)
+        self.windows = manager_utils.OpenWindows()
+
+    def _delete_later(self):
+        # twice, as deleting an object deletes its signal proxies later
+        for _ in range(2):
+            self.qtapp.sendPostedEvents(None, QtCore.QEvent.DeferredDelete)
+
+    def test_01_lru_cache(self):
+        cache = manager_utils.LruCache(3)
+        for key in 'abc':
+            cache[key] = key.upper()
+        self.assertEqual(cache['a'], 'A')
+        cache['d'] = 'D'
+        # b was the least recently used
+        self.assertNotIn('b', cache)
+        self.assertEqual(len(cache), 3)
+        with self.assertRaises(KeyError):
+            cache['b']  # pylint: disable=pointless-statement
+
+    def test_02_closed_window_released(self):
+        dialog = QtWidgets.QDialog()
+        destroyed = unittest.mock.Mock()
+        dialog.destroyed.connect(destroyed)
+        self.windows.add('vm-1', dialog)
+        self.assertIn('vm-1', self.windows)
+
+        dialog.done(0)
+        self.assertNotIn('vm-1', self.windows)
+        self._delete_later()
+        destroyed.assert_called_once_with(unittest.mock.ANY)
+
+    def test_03_window_kept_for_threads(self):
+        dialog = QtWidgets.QDialog()
+        destroyed = unittest.mock.Mock()
+        dialog.destroyed.connect(destroyed)
+        thread = self._Thread()
+        dialog.threads_list = [thread]
+        thread.start()
+        self.windows.add('vm-1', dialog)
+
+        dialog.done(0)
+        self._delete_later()
+        self.assertNotIn('vm-1', self.windows)
+        destroyed.assert_not_called()
+
+        thread.event.set()
+        thread.wait()
+        self.qtapp.processEvents()
+        self._delete_later()
+        destroyed.assert_called_once_with(unittest.mock.ANY)
+
+    def test_04_deleted_window_dropped(self):
+        parent = QtWidgets.QWidget()
+        self.windows.add('vm-1', QtWidgets.QDialog(parent))
+        self.windows.add('vm-2', QtWidgets.QDialog())
+        parent.deleteLater()
+        self._delete_later()
+        self.assertNotIn('vm-1', self.windows)
+        self.assertIn('vm-2', self.windows)
+
+    def _replay(self, first, count):
+        for step in range(first, first + count):
+            vm_info = self.cache.get_vm(step % len(self.cache))
+            # label icons come and go, more of them than pixmaps kept
+            vm_info.icon = 'appvm-color{}'.format(step % 10000)
+            self.model.vm_changed(vm_info.name)
+            row = self.cache.get_row(vm_info.name)
+            for column in (0, 1, 2, 3):
+                self.model.data(self.model.index(row, column),
+                                Qt.DecorationRole)
+                self.model.data(self.model.index(row, column),
+                                Qt.DisplayRole)
+            if step % 100 == 0:
+                dialog = QtWidgets.QDialog()
+                self.windows.add(vm_info.name, dialog)
+                dialog.done(0)
+                self._delete_later()
+
+    def test_05_soak(self):
+        # about a day of events (one in three seconds) and window opens
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        self._replay(0, 5000)
+        warm = tracemalloc.get_traced_memory()[0]
+        self._replay(5000, 25000)
+        grown = tracemalloc.get_traced_memory()[0] - warm
+
+        self.assertLessEqual(len(self.model.label_pixmap),
+                             qube_manager.pixmap_cache_size)
+        self.assertEqual(len(self.windows), 0)
+        self.assertLess(grown, 64 * 1024)
+
+
+class ImportTimeTest(unittest.TestCase):
+    lazy_modules = [
+        'qubesmanager.settings', 'qubesmanager.ui_settingsdlg',
+        'qubesmanager.global_settings', 'qubesmanager.ui_globalsettingsdlg',
+        'qubesmanager.backup', 'qubesmanager.ui_backupdlg',
+        'qubesmanager.restore', 'qubesmanager.ui_restoredlg',
+        'qubesmanager.create_new_vm', 'qubesmanager.ui_newappvmdlg',
+        'qubesmanager.create_worker', 'qubesmanager.ui_createworker',
+        'qubesmanager.worker_pool',
+        'qubesmanager.clone_vm', 'qubesmanager.ui_clonevmdlg',
+        'qubesmanager.log_dialog', 'qubesmanager.ui_logdlg',
+    ]
+
+    @staticmethod
+    def _import_times(code):
+        """Runs the code with -X importtime, returns list of (name,
+        cumulative time in us, whether imported by another module)"""
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+
+        # lines look like "import time: self [us] | cumulative | name",
+        # with the name indented for nested imports
+        imported = []
+        for line in result.stderr.decode().splitlines():
+            if not line.startswith('import time:'):
+                continue
+            _self_time, cumulative, name = \
+                line[len('import time:'):].split('|')
+            if not cumulative.strip().isdigit():
+                continue  # header
+            imported.append((name.strip(), int(cumulative),
+                             name.startswith('  ')))
+        return imported
+
+    def test_01_dialogs_not_imported_at_launch(self):
+        imported = {name: cumulative for name, cumulative, _nested
+                    in self._import_times('import qubesmanager.qube_manager')}
+        self.assertIn('qubesmanager.qube_manager', imported)
+
+        # what opening every dialog would add to the launch
+        eager = self._import_times('; '.join(
+            'import ' + module
+            for module in ['qubesmanager.qube_manager'] + self.lazy_modules))
+        names = [name for name, _cumulative, _nested in eager]
+        # nested imports are included in the time of their parent
+        deferred = sum(
+            cumulative for _name, cumulative, nested
+            in eager[names.index('qubesmanager.qube_manager') + 1:]
+            if not nested)
+        timing = "launch import {:.1f} ms, deferred dialogs {:.1f} ms".format(
+            imported['qubesmanager.qube_manager'] / 1000, deferred / 1000)
+
+        for module in self.lazy_modules:
+            self.assertNotIn(module, imported,
+                             "{} imported on launch; {}".format(
+                                 module, timing))
+        self.assertGreater(deferred, 0, timing)
+
+    def test_02_lazy_dialog_usable(self):
+        self.assertTrue(hasattr(qube_manager.settings, 'VMSettingsWindow'))
+        self.assertTrue(hasattr(qube_manager.clone_vm, 'CloneVMDlg'))
+
+
+class ProcessLauncherTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.qtapp, self.loop = init_qtapp()
+        self.launcher = common_threads.ProcessLauncher()
+
+    def _wait(self, timeout=10):
+        deadline = time.monotonic() + timeout
+        while self.launcher.processes and time.monotonic() < deadline:
+            self.qtapp.processEvents()
+            time.sleep(0.01)
+        self.qtapp.processEvents()
+
+    def test_01_exit_status(self):
+        exit_codes = []
+        failures = []
+        self.launcher.process_failed.connect(
+            lambda program, msg: failures.append(program))
+
+        start_time = time.monotonic()
+        self.launcher.start('sh', ['-c', 'sleep 0.5; exit 3'],
+                            on_finished=exit_codes.append)
+        # starting does not wait for the child
+        self.assertLess(time.monotonic() - start_time, 0.5)
+        self.assertEqual(len(self.launcher.processes), 1)
+
+        self._wait()
+        self.assertEqual(exit_codes, [3])
+        self.assertEqual(failures, ['sh'])
+        self.assertEqual(self.launcher.processes, [])
+
+    def test_02_success(self):
+        exit_codes = []
+        failures = []
+        self.launcher.process_failed.connect(
+            lambda program, msg: failures.append(program))
+
+        self.launcher.start('true', on_finished=exit_codes.append)
+        self._wait()
+        self.assertEqual(exit_codes, [0])
+        self.assertEqual(failures, [])
+
+    def test_03_not_started(self):
+        exit_codes = []
+        self.launcher.start('/nonexistent/qubes-tool',
+                            on_finished=exit_codes.append)
+        self._wait()
+        self.assertEqual(exit_codes, [-1])
+        self.assertEqual(self.launcher.processes, [])
+
+    def test_04_open_tool_in_process(self):
+        window = unittest.mock.Mock()
+        module = types.ModuleType('qubesmanager.test_tool')
+        module.Window = unittest.mock.Mock(return_value=window)
+        dispatcher = unittest.mock.Mock()
+
+        with unittest.mock.patch.dict(
+                sys.modules, {'qubesmanager.test_tool': module}), \
+                unittest.mock.patch.object(self.launcher, 'start') \
+                as mock_start:
+            self.assertIs(self.launcher.open_tool(
+                'qubes-test-tool', module='qubesmanager.test_tool',
+                create_window=lambda mod: mod.Window(),
+                dispatcher=dispatcher), window)
+
+        mock_start.assert_not_called()
+        window.show.assert_called_once_with()
+        self.assertIn(window, self.launcher.windows)
+
+    def test_05_open_tool_not_imported(self):
+        create_window = unittest.mock.Mock()
+        with unittest.mock.patch.object(self.launcher, 'start') \
+                as mock_start:
+            self.assertIsNone(self.launcher.open_tool(
+                'qubes-test-tool', ['arg'],
+                module='qubesmanager.nonexistent_tool',
+                create_window=create_window))
+
+        mock_start.assert_called_once_with('qubes-test-tool', ['arg'])
+        create_window.assert_not_called()
+
+    def test_06_lazy_module_not_imported(self):
+        with unittest.mock.patch.dict(sys.modules):
+            sys.modules.pop('colorsys', None)
+            module = manager_utils.lazy_import('colorsys')
+            # only registered by lazy_import, but not executed yet
+            self.assertFalse(manager_utils.is_imported('colorsys'))
+            self.assertTrue(hasattr(module, 'rgb_to_hsv'))
+            self.assertTrue(manager_utils.is_imported('colorsys'))
+
+    def test_07_lazy_submodule_set_on_package(self):
+        with unittest.mock.patch.dict(sys.modules), \
+                unittest.mock.patch.object(json, 'tool', create=True):
+            sys.modules.pop('json.tool', None)
+            module = manager_utils.lazy_import('json.tool')
+            self.assertIs(json.tool, module)
+            self.assertFalse(manager_utils.is_imported('json.tool'))
+
 
 if __name__ == "__main__":
     ha_syslog = logging.handlers.SysLogHandler('/dev/log')
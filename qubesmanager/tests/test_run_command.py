@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, https://www.qubes-os.org/
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+import asyncio
+import logging.handlers
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+
+from PyQt5 import QtWidgets  # pylint: disable=import-error
+
+from qubesmanager import run_command
+from qubesmanager.tests import init_qtapp
+
+
+class _ShellVm:
+    """Fake qube running qubes.VMShell in a local shell"""
+    # pylint: disable=too-few-public-methods
+    def __init__(self, name):
+        self.name = name
+
+    def run_service(self, service, user=None, **kwargs):
+        assert service == 'qubes.VMShell'
+        assert user is None
+        # pylint: disable=consider-using-with
+        return subprocess.Popen(['sh'], **kwargs)
+
+
+class OutputBufferTest(unittest.TestCase):
+    def test_01_lines(self):
+        buffer = run_command.OutputBuffer()
+        self.assertEqual(buffer.append('first\nsec'), ['first'])
+        self.assertEqual(buffer.append('ond\nthird'), ['second'])
+        self.assertEqual(buffer.get_text(), 'first\nsecond\nthird')
+        self.assertEqual(buffer.flush(), ['third'])
+        self.assertEqual(buffer.flush(), [])
+
+    def test_02_bounded(self):
+        buffer = run_command.OutputBuffer(max_lines=10)
+        for i in range(100):
+            buffer.append('line {}\n'.format(i))
+        self.assertEqual(len(buffer.lines), 10)
+        self.assertEqual(buffer.dropped, 90)
+        self.assertEqual(buffer.lines[0], 'line 90')
+        self.assertIn('90 earlier lines dropped', buffer.get_text())
+
+
+class RunCommandTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.qtapp, self.loop = init_qtapp()
+
+    def test_01_run_in_vms(self):
+        vms = [_ShellVm('vm{}'.format(i)) for i in range(4)]
+        output = {}
+        finished = []
+
+        start_time = time.monotonic()
+        results = self.loop.run_until_complete(run_command.run_in_vms(
+            vms, 'sleep 0.3; echo out; echo err >&2; exit 3',
+            lambda name, text: output.setdefault(name, []).append(text),
+            lambda name, code, error: finished.append(name),
+            max_parallel=2))
+        elapsed = time.monotonic() - start_time
+
+        self.assertEqual(results, {vm.name: 3 for vm in vms})
+        self.assertEqual(sorted(finished), [vm.name for vm in vms])
+        for vm in vms:
+            self.assertEqual(''.join(output[vm.name]), 'out\nerr\n')
+        # two rounds of two commands
+        self.assertGreater(elapsed, 0.55)
+        self.assertLess(elapsed, 0.3 * 4)
+
+    def test_02_dialog(self):
+        vms = [_ShellVm('good'), _ShellVm('bad')]
+        dialog = run_command.RunCommandDialog(
+            vms, 'echo "$0"; printf partial; [ -n "$BAD" ]', max_parallel=2)
+        dialog.add_output('bad', 'unexpected\n')
+        self.loop.run_until_complete(dialog.run())
+
+        self.assertEqual(dialog.exit_codes, {'good': 1, 'bad': 1})
+        self.assertEqual(dialog.panes['good'].toPlainText(),
+                         'sh\npartial')
+        self.assertIn('bad: unexpected', dialog.all_pane.toPlainText())
+        self.assertIn('good: partial', dialog.all_pane.toPlainText())
+        self.assertIn('Failed', dialog.summary.text())
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            file_name = os.path.join(tmpdir, 'output.txt')
+            with unittest.mock.patch(
+                    'PyQt5.QtWidgets.QFileDialog.getSaveFileName',
+                    return_value=(file_name, '')):
+                dialog.save_output()
+            with open(file_name, encoding='utf-8') as file:
+                saved = file.read()
+        self.assertIn('good: sh\n', saved)
+        self.assertIn('bad: exit code 1', saved)
+
+    def test_03_halted_qube_not_blocking(self):
+        class _HaltedVm(_ShellVm):
+            """Boots until another qube sends output"""
+            def __init__(self, name):
+                super().__init__(name)
+                self.booted = threading.Event()
+                self.boot_finished = None
+
+            def run_service(self, service, user=None, **kwargs):
+                self.boot_finished = self.booted.wait(5)
+                return super().run_service(service, user, **kwargs)
+
+        halted = _HaltedVm('halted')
+        output = []
+
+        def on_output(name, text):
+            output.append((name, text))
+            halted.booted.set()
+
+        results = self.loop.run_until_complete(run_command.run_in_vms(
+            [halted, _ShellVm('running')], 'echo out', on_output))
+
+        self.assertEqual(results, {'halted': 0, 'running': 0})
+        # the other qube ran while the halted one was booting
+        self.assertTrue(halted.boot_finished)
+        self.assertEqual(output, [('running', 'out\n'), ('halted', 'out\n')])
+
+    def test_04_not_started(self):
+        vm = unittest.mock.Mock()
+        vm.name = 'broken'
+        vm.run_service.side_effect = OSError('no qrexec')
+        finished = []
+        results = self.loop.run_until_complete(run_command.run_in_vms(
+            [vm], 'true', unittest.mock.Mock(),
+            lambda name, code, error: finished.append((name, code, error))))
+
+        self.assertEqual(results, {'broken': None})
+        self.assertEqual(finished, [('broken', None, 'no qrexec')])
+
+    def test_05_dialog_error_reported(self):
+        dialog = run_command.RunCommandDialog([_ShellVm('vm')], 'true')
+        with unittest.mock.patch.object(
+                run_command, 'run_in_vms',
+                side_effect=RuntimeError('event loop broken')), \
+                self.assertLogs('qubesmanager.run_command'):
+            task = dialog.start()
+            with self.assertRaises(RuntimeError):
+                self.loop.run_until_complete(task)
+            # done callbacks run in the next iteration
+            self.loop.run_until_complete(asyncio.sleep(0))
+
+        self.assertIn('event loop broken', dialog.summary.text())
+        with unittest.mock.patch.object(dialog, 'hide') as mock_hide:
+            dialog.reject()
+        mock_hide.assert_not_called()
+
+    def test_06_hidden_dialog_finished(self):
+        dialog = run_command.RunCommandDialog([_ShellVm('vm')], 'sleep 0.2')
+        finished = []
+        dialog.finished.connect(finished.append)
+        task = dialog.start()
+        # closed while running, only hidden
+        dialog.reject()
+        self.assertEqual(finished, [])
+
+        self.loop.run_until_complete(task)
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual(finished, [QtWidgets.QDialog.Rejected])
+
+
+if __name__ == "__main__":
+    ha_syslog = logging.handlers.SysLogHandler('/dev/log')
+    ha_syslog.setFormatter(
+        logging.Formatter('%(name)s[%(process)d]: %(message)s'))
+    logging.root.addHandler(ha_syslog)
+    unittest.main()
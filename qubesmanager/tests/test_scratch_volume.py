@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, https://www.qubes-os.org/
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+import logging.handlers
+import os
+import subprocess
+import tempfile
+import time
+import unittest
+
+from qubesmanager import scratch_volume
+
+# commands run by the scripts, faked: they log their arguments and keep
+# the state of the loop device and the mount in files
+FAKE_COMMANDS = {
+    'sudo': 'exec "$@"',
+    'mountpoint': '[ -e "$STATE/mounted" ]',
+    'findmnt': 'cat "$STATE/mounted"',
+    'blkid': '[ -e "$STATE/formatted" ] && echo ext4',
+    'mkfs.ext4': 'touch "$STATE/formatted"',
+    'losetup': '''
+case "$1" in
+    -j) cat "$STATE/attached" 2>/dev/null ;;
+    --find) echo /dev/loop7 >> "$STATE/attached"; echo /dev/loop7 ;;
+    -d) sed -i "\\|^$2\\$|d" "$STATE/attached" ;;
+esac''',
+    'mount': 'echo "$1" > "$STATE/mounted"',
+    'umount': 'true',
+    'resize2fs': 'true',
+    'fstrim': 'true',
+}
+
+
+class ScratchVolumeTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.state = os.path.join(self.directory.name, 'state')
+        bin_directory = os.path.join(self.directory.name, 'bin')
+        os.makedirs(self.state)
+        os.makedirs(bin_directory)
+        for name, body in FAKE_COMMANDS.items():
+            path = os.path.join(bin_directory, name)
+            with open(path, 'w') as file:
+                file.write('#!/bin/bash\necho "{} $*" >> "$STATE/log"\n'
+                           '{}\n'.format(name, body))
+            os.chmod(path, 0o755)
+        self.env = dict(os.environ, STATE=self.state,
+                        PATH=bin_directory + os.pathsep + os.environ['PATH'])
+        self.volume = scratch_volume.ScratchVolume(
+            os.path.join(self.directory.name, 'scratch.img'),
+            os.path.join(self.directory.name, 'scratch'))
+
+    def run_script(self, script, **env):
+        with open(os.path.join(self.state, 'log'), 'w'):
+            pass
+        subprocess.run(['bash', '-e', '-c', script], check=True,
+                       env=dict(self.env, **env))
+        with open(os.path.join(self.state, 'log')) as file:
+            return [line.split()[0] for line in file
+                    if not line.startswith('sudo ')]
+
+    def test_01_formats_once(self):
+        commands = self.run_script(self.volume.mount_script('run-a', 4096))
+        self.assertIn('mkfs.ext4', commands)
+        self.assertIn('mount', commands)
+        self.assertEqual(os.path.getsize(self.volume.backing_file), 4096)
+        self.assertTrue(os.path.isdir(self.volume.run_directory('run-a')))
+
+        commands = self.run_script(self.volume.mount_script('run-b', 4096))
+        self.assertNotIn('mkfs.ext4', commands)
+        self.assertNotIn('mount', commands)
+        self.assertTrue(os.path.isdir(self.volume.run_directory('run-b')))
+
+    def test_02_remounts_formatted(self):
+        self.run_script(self.volume.mount_script('run-a', 4096))
+        # e.g. after a reboot
+        os.unlink(os.path.join(self.state, 'mounted'))
+        os.unlink(os.path.join(self.state, 'attached'))
+        commands = self.run_script(self.volume.mount_script('run-b', 4096))
+        self.assertNotIn('mkfs.ext4', commands)
+        self.assertIn('mount', commands)
+        # files of a run are kept for resuming it
+        self.assertTrue(os.path.isdir(self.volume.run_directory('run-a')))
+
+    def test_03_detaches_leftover(self):
+        self.run_script(self.volume.mount_script('run-a', 4096))
+        # crashed with the device attached, but not mounted
+        os.unlink(os.path.join(self.state, 'mounted'))
+        self.run_script(self.volume.mount_script('run-b', 4096))
+        with open(os.path.join(self.state, 'attached')) as file:
+            self.assertEqual(file.read().split(), ['/dev/loop7'])
+        with open(os.path.join(self.state, 'log')) as file:
+            self.assertIn('losetup -d /dev/loop7\n', file.readlines())
+
+    def test_04_grows(self):
+        self.run_script(self.volume.mount_script('run-a', 4096))
+        commands = self.run_script(self.volume.mount_script('run-b', 2048))
+        self.assertNotIn('resize2fs', commands)
+        self.assertEqual(os.path.getsize(self.volume.backing_file), 4096)
+        commands = self.run_script(self.volume.mount_script('run-c', 8192))
+        self.assertIn('resize2fs', commands)
+        self.assertEqual(os.path.getsize(self.volume.backing_file), 8192)
+
+    def test_05_cleanup(self):
+        self.run_script(self.volume.mount_script('run-a', 4096))
+        self.run_script(self.volume.mount_script('run-b', 4096))
+        self.assertEqual(
+            subprocess.run(['bash', '-c', self.volume.check_script('run-a')],
+                           env=self.env, check=False).returncode, 0)
+
+        self.run_script(self.volume.cleanup_script('run-a'),
+                        FANCY_RUN_FAILED='1')
+        self.assertTrue(os.path.isdir(self.volume.run_directory('run-a')))
+        commands = self.run_script(self.volume.cleanup_script('run-a'))
+        self.assertIn('fstrim', commands)
+        self.assertFalse(os.path.exists(self.volume.run_directory('run-a')))
+        self.assertTrue(os.path.isdir(self.volume.run_directory('run-b')))
+        self.assertNotEqual(
+            subprocess.run(['bash', '-c', self.volume.check_script('run-a')],
+                           env=self.env, check=False).returncode, 0)
+
+    def test_06_stale_runs_removed(self):
+        self.run_script(self.volume.mount_script('fancy_manager_old', 4096))
+        lost_found = os.path.join(self.volume.mount_point, 'lost+found')
+        os.makedirs(lost_found)
+        old = time.time() - (scratch_volume.MAX_RUN_AGE_DAYS + 1) * 86400
+        for path in (self.volume.run_directory('fancy_manager_old'),
+                     lost_found):
+            os.utime(path, (old, old))
+
+        self.run_script(self.volume.mount_script('fancy_manager_new', 4096))
+        self.assertFalse(os.path.exists(
+            self.volume.run_directory('fancy_manager_old')))
+        self.assertTrue(os.path.isdir(lost_found))
+
+
+if __name__ == "__main__":
+    ha_syslog = logging.handlers.SysLogHandler('/dev/log')
+    ha_syslog.setFormatter(
+        logging.Formatter('%(name)s[%(process)d]: %(message)s'))
+    logging.root.addHandler(ha_syslog)
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, https://www.qubes-os.org/
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+import logging.handlers
+import os
+import time
+import unittest
+import unittest.mock
+
+from qubesmanager import stall_watchdog
+from qubesmanager.tests import init_qtapp
+
+
+def _blocking_call(duration):
+    # stands for a synchronous qubesd call on the GUI thread
+    time.sleep(duration)
+
+
+class StallWatchdogTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.qtapp, self.loop = init_qtapp()
+        self.watchdog = stall_watchdog.StallWatchdog(
+            threshold=0.1, interval=0.02)
+        self.watchdog.start()
+        self.addCleanup(self.watchdog.stop)
+
+    def _run_loop(self, duration):
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            self.qtapp.processEvents()
+            time.sleep(0.005)
+
+    def test_01_no_stall(self):
+        self._run_loop(0.3)
+        self.assertEqual(self.watchdog.count, 0)
+        self.assertIn('no event loop stalls', self.watchdog.report())
+
+    def test_02_stall_captured(self):
+        self._run_loop(0.05)
+        with self.assertLogs('qubesmanager.watchdog') as logs:
+            _blocking_call(0.4)
+            self._run_loop(0.1)
+
+        self.assertEqual(self.watchdog.count, 1)
+        self.assertGreater(self.watchdog.longest, 0.3)
+        location, = self.watchdog.locations
+        self.assertIn('in _blocking_call', location)
+        self.assertIn('time.sleep(duration)', logs.output[0])
+
+    def test_03_report(self):
+        self._run_loop(0.05)
+        with self.assertLogs('qubesmanager.watchdog'):
+            for _ in range(2):
+                _blocking_call(0.2)
+                self._run_loop(0.05)
+        report = self.watchdog.report()
+        self.assertIn('2 event loop stalls over 100 ms', report)
+        self.assertIn('_blocking_call: 2 times', report)
+
+    def test_04_from_env(self):
+        with unittest.mock.patch.dict(os.environ, {}, clear=True):
+            self.assertIsNone(stall_watchdog.start_from_env())
+        with unittest.mock.patch.dict(
+                os.environ, {stall_watchdog.env_name: '500'}):
+            watchdog = stall_watchdog.start_from_env()
+        self.addCleanup(watchdog.stop)
+        self.assertEqual(watchdog.threshold, 0.5)
+
+
+if __name__ == "__main__":
+    ha_syslog = logging.handlers.SysLogHandler('/dev/log')
+    ha_syslog.setFormatter(
+        logging.Formatter('%(name)s[%(process)d]: %(message)s'))
+    logging.root.addHandler(ha_syslog)
+    unittest.main()
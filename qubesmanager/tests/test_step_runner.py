@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, https://www.qubes-os.org/
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+import json
+import logging.handlers
+import os
+import tempfile
+import time
+import unittest
+
+from PyQt5 import QtCore
+
+from qubesmanager import step_runner
+from qubesmanager.create_worker import get_step
+from qubesmanager.tests import init_qtapp
+
+
+class StepRunnerTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.qtapp, self.loop = init_qtapp()
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.timings_path = os.path.join(tmpdir.name, 'timings.jsonl')
+        self.runner = step_runner.StepRunner(
+            'run-id', timings_path=self.timings_path)
+        self.output = []
+        self.runner.output.connect(self.output.append)
+        self.exit_codes = []
+        self.runner.finished.connect(self.exit_codes.append)
+
+    def _run(self, steps, timeout=10, completed=()):
+        self.runner.start(steps, completed)
+        deadline = time.monotonic() + timeout
+        while not self.exit_codes and time.monotonic() < deadline:
+            self.qtapp.processEvents()
+            time.sleep(0.005)
+        self.assertEqual(len(self.exit_codes), 1, "steps did not finish")
+        return self.exit_codes[0]
+
+    def _statuses(self):
+        return [record.status for record in self.runner.records]
+
+    def test_01_sequential(self):
+        exit_code = self._run([
+            get_step("echo one", False, "first"),
+            get_step('echo two', False, 'second'),
+        ])
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(self._statuses(),
+                         [step_runner.SUCCEEDED, step_runner.SUCCEEDED])
+        self.assertIn('two\n', "".join(self.output))
+        first, second = self.runner.records
+        self.assertGreaterEqual(second.started,
+                                first.started + first.duration)
+
+    def test_02_failure_runs_cleanup_only(self):
+        exit_code = self._run([
+            get_step('exit 3', False, 'setup'),
+            get_step('echo install', False, 'install'),
+            get_step('echo cleanup', True, 'cleanup'),
+        ])
+        self.assertEqual(exit_code, 3)
+        self.assertEqual(self._statuses(), [
+            step_runner.FAILED, step_runner.SKIPPED, step_runner.SUCCEEDED])
+        output = "".join(self.output)
+        self.assertNotIn('install', output)
+        self.assertIn('cleanup', output)
+
+    def test_03_independent_steps_concurrent(self):
+        start = time.monotonic()
+        exit_code = self._run([
+            get_step('sleep 0.5', False, 'a'),
+            get_step('sleep 0.5', False, 'b', after=[]),
+            get_step('echo done', False, 'c', after=['a', 'b']),
+        ])
+        self.assertEqual(exit_code, 0)
+        self.assertLess(time.monotonic() - start, 0.9)
+        a, b, c = self.runner.records
+        self.assertGreaterEqual(c.started, a.started + a.duration)
+        self.assertGreaterEqual(c.started, b.started + b.duration)
+
+    def test_04_timings_saved(self):
+        self._run([get_step('true', False, 'ok'),
+                   get_step('exit 1', False, 'bad'),
+                   get_step('true', False, 'skipped')])
+        with open(self.timings_path, encoding='utf-8') as file:
+            lines = [json.loads(line) for line in file]
+        self.assertEqual([line['step'] for line in lines],
+                         ['ok', 'bad', 'skipped'])
+        self.assertEqual([line['exit_code'] for line in lines],
+                         [0, 1, None])
+        self.assertTrue(all(line['run_id'] == 'run-id' for line in lines))
+        self.assertIsNotNone(lines[0]['duration'])
+        self.assertIn('bad: failed', step_runner.format_timings(
+            self.runner.records))
+
+    def test_05_unknown_after(self):
+        with self.assertRaises(ValueError):
+            step_runner.get_records([get_step('true', False, 'a',
+                                              after=['b'])])
+
+    def test_06_missing_shell(self):
+        self.runner.shell = '/nonexistent/shell'
+        exit_code = self._run([get_step('true', False, 'a'),
+                               get_step('true', True, 'cleanup')])
+        self.assertEqual(exit_code, 127)
+        self.assertEqual(self._statuses(),
+                         [step_runner.FAILED, step_runner.FAILED])
+
+    def test_07_after_resolved(self):
+        records = step_runner.get_records([
+            get_step('', False, 'prepare worker'),
+            get_step('', False, 'install windows tools', after=[]),
+            get_step('', False, 'install',
+                     after=['prepare worker', 'install windows tools']),
+            get_step('', True, 'clean up worker')])
+        self.assertEqual([record.after for record in records],
+                         [[], [], [0, 1], [2]])
+
+    def test_08_resume(self):
+        exit_code = self._run([
+            get_step('echo first', False, 'first'),
+            get_step('echo second', False, 'second', check='true'),
+            get_step('echo third', False, 'third', check='false'),
+            get_step('echo cleanup', True, 'cleanup'),
+        ], completed=['first', 'second', 'third', 'cleanup'])
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(self._statuses(), [
+            step_runner.DONE, step_runner.SUCCEEDED, step_runner.SUCCEEDED,
+            step_runner.SUCCEEDED])
+        output = "".join(self.output)
+        self.assertNotIn('first', output)
+        self.assertNotIn('second', output)
+        self.assertIn('already done', output)
+        self.assertIn('third', output)
+        self.assertIn('cleanup', output)
+
+    def test_09_cleanup_knows_about_failure(self):
+        self._run([
+            get_step('echo "ok:${}"'.format(step_runner.FAILED_ENV),
+                     True, 'a'),
+            get_step('exit 1', False, 'b'),
+            get_step('echo "failed:${}"'.format(step_runner.FAILED_ENV),
+                     True, 'c'),
+        ])
+        output = "".join(self.output)
+        self.assertIn('ok:\n', output)
+        self.assertIn('failed:1\n', output)
+
+    def test_10_split_characters(self):
+        self._run([get_step(
+            "printf '\\303'; sleep 0.2; printf '\\251\\n'", False, 'a')])
+        self.assertEqual("".join(self.output), 'é\n')
+
+    def test_11_abort_runs_cleanup(self):
+        QtCore.QTimer.singleShot(200, self.runner.abort)
+        exit_code = self._run([
+            get_step('sleep 10', False, 'install'),
+            get_step('echo install done', False, 'finish'),
+            get_step('echo "cleanup:${}"'.format(step_runner.FAILED_ENV),
+                     True, 'cleanup'),
+        ], timeout=5)
+        self.assertEqual(exit_code, step_runner.ABORTED_EXIT_CODE)
+        self.assertEqual(self._statuses(), [
+            step_runner.FAILED, step_runner.SKIPPED, step_runner.SUCCEEDED])
+        output = "".join(self.output)
+        self.assertNotIn('install done', output)
+        self.assertIn('cleanup:1\n', output)
+
+
+if __name__ == "__main__":
+    ha_syslog = logging.handlers.SysLogHandler('/dev/log')
+    ha_syslog.setFormatter(
+        logging.Formatter('%(name)s[%(process)d]: %(message)s'))
+    logging.root.addHandler(ha_syslog)
+    unittest.main()
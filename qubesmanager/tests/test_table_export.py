@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, https://www.qubes-os.org/
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+import csv
+import io
+import json
+import logging.handlers
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+from qubesmanager import qube_manager
+from qubesmanager import table_export
+from qubesmanager.tests.test_qube_manager import _FakeVm
+
+
+class TableExportTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.vm_infos = [qube_manager.VmInfo(_FakeVm(qid), False)
+                         for qid in range(1, 4)]
+
+    def test_01_parse_columns(self):
+        self.assertEqual(
+            table_export.parse_columns('name, State,Disk Usage,'),
+            ['name', 'state', 'disk_usage'])
+        with self.assertRaises(ValueError):
+            table_export.parse_columns('name,size')
+
+    def test_02_csv(self):
+        output = io.StringIO()
+        self.assertEqual(table_export.export(
+            output, self.vm_infos, ['name', 'template', 'disk_usage',
+                                    'last_backup']), 3)
+
+        rows = list(csv.reader(io.StringIO(output.getvalue())))
+        self.assertEqual(rows[0],
+                         ['name', 'template', 'disk_usage', 'last_backup'])
+        self.assertEqual(rows[1], ['vm-1', 'fedora-38', '1024.0', ''])
+        self.assertEqual(len(rows), 4)
+
+    def test_03_json(self):
+        output = io.StringIO()
+        table_export.export(output, self.vm_infos, None, 'json')
+
+        rows = json.loads(output.getvalue())
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(list(rows[0]), list(table_export.COLUMNS))
+        self.assertEqual(rows[2]['name'], 'vm-3')
+        self.assertEqual(rows[2]['state'], 'Halted')
+        self.assertIs(rows[2]['backup'], True)
+
+        output = io.StringIO()
+        table_export.export(output, [], None, 'json')
+        self.assertEqual(json.loads(output.getvalue()), [])
+
+    def test_04_streamed(self):
+        output = io.StringIO()
+
+        def _vm_infos():
+            for vm_info in self.vm_infos:
+                yield vm_info
+                # the row is written before the next one is even loaded
+                self.assertIn(vm_info.name, output.getvalue())
+
+        for export_format in table_export.FORMATS:
+            output = io.StringIO()
+            table_export.export(output, _vm_infos(), ['name'], export_format)
+
+    def test_05_columns_for_table(self):
+        self.assertEqual(
+            table_export.columns_for_table(['Name', 'Disk Usage', 'Other']),
+            ['name', 'disk_usage'])
+
+
+class DumpTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.qubes_app = unittest.mock.Mock()
+        self.qubes_app.domains = [_FakeVm(qid) for qid in range(1, 301)]
+
+    def test_01_dump(self):
+        output = io.StringIO()
+        self.assertEqual(qube_manager.dump(
+            self.qubes_app, output, 'json', ['name', 'netvm']), 300)
+
+        rows = json.loads(output.getvalue())
+        # in the order of the domains, although loaded concurrently
+        self.assertEqual([row['name'] for row in rows],
+                         ['vm-{}'.format(qid) for qid in range(1, 301)])
+        self.assertEqual(rows[0]['netvm'], 'default (sys-firewall)')
+
+    def test_02_main(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'qubes.csv')
+            with unittest.mock.patch('qubesadmin.Qubes',
+                                     return_value=self.qubes_app):
+                self.assertEqual(qube_manager.main(
+                    ['--dump', '--columns', 'name,state', '-o', path]), 0)
+            with open(path, encoding='utf-8') as file:
+                rows = list(csv.reader(file))
+
+        self.assertEqual(rows[0], ['name', 'state'])
+        self.assertEqual(rows[300], ['vm-300', 'Halted'])
+
+
+if __name__ == "__main__":
+    ha_syslog = logging.handlers.SysLogHandler('/dev/log')
+    ha_syslog.setFormatter(
+        logging.Formatter('%(name)s[%(process)d]: %(message)s'))
+    logging.root.addHandler(ha_syslog)
+    unittest.main()
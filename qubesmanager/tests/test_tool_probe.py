@@ -0,0 +1,178 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, https://www.qubes-os.org/
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+import logging.handlers
+import multiprocessing
+import os
+import subprocess
+import tempfile
+import unittest
+import unittest.mock
+
+from qubesmanager import tool_probe
+
+
+class MockDomains:
+    def __init__(self, vms):
+        self.vms = {vm.name: vm for vm in vms}
+
+    def __getitem__(self, name):
+        return self.vms[name]
+
+
+def _mock_vm(name, template=None):
+    vm = unittest.mock.Mock(spec=['name', 'template', 'features', 'volumes'])
+    vm.name = name
+    vm.features = {}
+    volume = unittest.mock.Mock()
+    volume.revisions = ['1700000000-back']
+    volume.usage = 1024
+    vm.volumes = {'root': volume}
+    if template is None:
+        del vm.template
+    else:
+        vm.template = template
+    return vm
+
+
+class ToolProbeTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.cache = tool_probe.ToolCache(os.path.join(tmpdir.name, 'state'))
+
+        self.template = _mock_vm('debian-12')
+        dvm = _mock_vm('fancy-worker-dvm', self.template)
+        self.qubes_app = unittest.mock.Mock()
+        self.qubes_app.domains = MockDomains(
+            [self.template, dvm, _mock_vm('fancy-worker-1', dvm)])
+
+        # tools the worker has
+        self.installed = {'wget', 'curl'}
+        patcher = unittest.mock.patch('subprocess.run', self._run)
+        self.run = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.probes = []
+        # the install script ran in the worker since it started
+        self.install_ran = False
+
+    def _run(self, command, **_kwargs):
+        self.assertEqual(command[:3], ['qvm-run', '-p', 'fancy-worker-1'])
+        tools = command[3].split(';')[1].split()[3:]
+        self.probes.append(tools)
+        found = [tool for tool in tools if tool in self.installed]
+        if self.install_ran:
+            found.append('/installed')
+        return subprocess.CompletedProcess(
+            command, 0, '\n'.join(found).encode())
+
+    def test_01_base_template(self):
+        self.assertIs(tool_probe.base_template(
+            self.qubes_app.domains['fancy-worker-1']), self.template)
+        self.assertIs(tool_probe.base_template(self.template), self.template)
+
+    def test_02_probed_once(self):
+        self.assertEqual(tool_probe.check(
+            self.qubes_app, 'fancy-worker-1', ['wget'], self.cache), [])
+        self.assertEqual(tool_probe.check(
+            self.qubes_app, 'fancy-worker-1', ['wget'], self.cache), [])
+        self.assertEqual(self.probes, [['wget']])
+
+    def test_03_missing_probed_again(self):
+        self.assertEqual(tool_probe.check(
+            self.qubes_app, 'fancy-worker-1', ['curl', 'genisoimage'],
+            self.cache), ['genisoimage'])
+        # installed in the running worker, not in its template
+        self.installed.add('genisoimage')
+        self.install_ran = True
+        for _ in range(2):
+            self.assertEqual(tool_probe.check(
+                self.qubes_app, 'fancy-worker-1', ['curl', 'genisoimage'],
+                self.cache), [])
+        # curl is known to be there, genisoimage is not recorded
+        self.assertEqual(self.probes, [['curl', 'genisoimage'],
+                                       ['genisoimage'], ['genisoimage']])
+
+        # restarted, with genisoimage now in its template
+        self.install_ran = False
+        self.assertEqual(tool_probe.check(
+            self.qubes_app, 'fancy-worker-1', ['genisoimage'], self.cache),
+            [])
+        self.assertEqual(tool_probe.check(
+            self.qubes_app, 'fancy-worker-1', ['genisoimage'], self.cache),
+            [])
+        self.assertEqual(len(self.probes), 4)
+
+    def test_04_invalidated_by_update(self):
+        tool_probe.check(self.qubes_app, 'fancy-worker-1', ['wget'],
+                         self.cache)
+        self.template.features['last-updated'] = '2024-01-01 00:00:00'
+        self.installed.discard('wget')
+        self.assertEqual(tool_probe.check(
+            self.qubes_app, 'fancy-worker-1', ['wget'], self.cache),
+            ['wget'])
+        self.assertEqual(self.cache.present(
+            'debian-12', tool_probe.template_fingerprint(self.template)),
+            set())
+
+    def test_05_main(self):
+        args = ['--state', self.cache.state_path,
+                'check', 'fancy-worker-1', 'wget']
+        with unittest.mock.patch('builtins.print'):
+            self.assertEqual(tool_probe.main(args, self.qubes_app), 0)
+            self.assertEqual(tool_probe.main(args + ['datefudge'],
+                                             self.qubes_app), 1)
+
+    def test_06_ensure_command(self):
+        command = tool_probe.ensure_command(
+            'fancy-worker-1', ['wget'], "sudo dnf -y install 'wget'",
+            '/state')
+        self.assertEqual(
+            command,
+            "python3 -m qubesmanager.tool_probe --state /state check "
+            "fancy-worker-1 wget || qvm-run -p fancy-worker-1 "
+            "'sudo touch /run/qubes-fancy-manager-installed\n"
+            "sudo dnf -y install '\"'\"'wget'\"'\"''")
+
+    def test_07_recorded_concurrently(self):
+        # several installations record tools of the same template at once
+        def record(tool):
+            for _ in range(20):
+                self.cache.record('debian-12', 'fingerprint', [tool])
+
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=record, args=(tool,))
+                     for tool in ('wget', 'curl', 'genisoimage', 'bzip2')]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        self.assertEqual([process.exitcode for process in processes],
+                         [0] * 4)
+        self.assertEqual(self.cache.present('debian-12', 'fingerprint'),
+                         {'wget', 'curl', 'genisoimage', 'bzip2'})
+
+
+if __name__ == "__main__":
+    ha_syslog = logging.handlers.SysLogHandler('/dev/log')
+    ha_syslog.setFormatter(
+        logging.Formatter('%(name)s[%(process)d]: %(message)s'))
+    logging.root.addHandler(ha_syslog)
+    unittest.main()
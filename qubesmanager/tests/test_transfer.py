@@ -0,0 +1,288 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, https://www.qubes-os.org/
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+import hashlib
+import io
+import logging.handlers
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+from qubesmanager import artifact_cache
+from qubesmanager import transfer
+
+
+class TransferTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+        self.source = os.path.join(self.tmpdir, 'source')
+        self.target = os.path.join(self.tmpdir, 'target')
+
+    def _create_source(self, size):
+        data = os.urandom(size)
+        with open(self.source, 'wb') as file:
+            file.write(data)
+        return hashlib.sha256(data).hexdigest()
+
+    def assertNoTarget(self):
+        self.assertEqual([name for name in os.listdir(self.tmpdir)
+                          if name.startswith('target')], [])
+
+    def test_01_transfer(self):
+        sha256 = self._create_source(3 * transfer.CHUNK_SIZE + 17)
+        reports = []
+        self.assertEqual(transfer.transfer(
+            transfer.local_source(self.source), self.target, sha256,
+            3 * transfer.CHUNK_SIZE + 17,
+            lambda progress: reports.append(progress.done)), sha256)
+        self.assertEqual(artifact_cache.file_sha256(self.target), sha256)
+        self.assertEqual(reports[-1], 3 * transfer.CHUNK_SIZE + 17)
+        self.assertEqual(reports, sorted(reports))
+
+    def test_02_empty(self):
+        sha256 = self._create_source(0)
+        transfer.transfer(transfer.local_source(self.source), self.target,
+                          sha256)
+        self.assertEqual(os.path.getsize(self.target), 0)
+
+    def test_03_hash_mismatch(self):
+        self._create_source(1000)
+        with self.assertRaises(artifact_cache.HashMismatch):
+            transfer.transfer(transfer.local_source(self.source),
+                              self.target, 'a' * 64)
+        self.assertNoTarget()
+
+    def test_04_size_mismatch_before_transfer(self):
+        self._create_source(1000)
+        # nothing read after the size
+        command = ['sh', '-c', 'echo 1000; sleep 60']
+        start = time.monotonic()
+        with self.assertRaises(transfer.SizeMismatch):
+            transfer.transfer(command, self.target, size=999)
+        self.assertLess(time.monotonic() - start, 30)
+        self.assertNoTarget()
+
+    def test_05_stream_longer_or_shorter(self):
+        with self.assertRaises(transfer.SizeMismatch):
+            transfer.transfer(['sh', '-c', 'echo 3; echo none; printf abcdef'],
+                              self.target)
+        with self.assertRaises(transfer.SizeMismatch):
+            transfer.transfer(['sh', '-c', 'echo 9; echo none; printf abcdef'],
+                              self.target)
+        self.assertNoTarget()
+
+    def test_06_source_failed(self):
+        with self.assertRaises(transfer.TransferError):
+            transfer.transfer(transfer.local_source(self.source),
+                              self.target)
+        with self.assertRaises(transfer.TransferError):
+            transfer.transfer(['sh', '-c', 'echo 3; echo none; printf abc; exit 1'],
+                              self.target)
+        self.assertNoTarget()
+
+    def test_07_progress(self):
+        now = [0.0]
+        progress = transfer.Progress(100 * 1024 ** 2, lambda: now[0])
+        self.assertIsNone(progress.eta)
+        self.assertIn('ETA --:--', progress.format())
+        now[0] = 2.0
+        progress.done = 10 * 1024 ** 2
+        self.assertEqual(progress.rate, 5 * 1024 ** 2)
+        self.assertEqual(progress.eta, 18)
+        self.assertEqual(progress.format(),
+                         '10.0/100.0 MiB, 5.0 MiB/s, ETA 0:18')
+
+        output = io.StringIO()
+        report = transfer.terminal_report(output, 0.5, lambda: now[0])
+        report(progress)
+        now[0] = 2.1
+        report(progress)
+        self.assertEqual(output.getvalue().count('\r'), 1)
+        progress.done = progress.total
+        report(progress)
+        self.assertEqual(output.getvalue().count('\r'), 2)
+
+    def test_08_benchmark(self):
+        """Transfer against a local stand-in for the qube, compared with
+        copying it by cat and hashing it afterwards, as before"""
+        size = 64 * 1024 ** 2
+        sha256 = self._create_source(size)
+
+        start = time.monotonic()
+        subprocess.run(['sh', '-c', 'cat "$0" > "$1" && sha256sum "$1"',
+                        self.source, self.target],
+                       stdout=subprocess.DEVNULL, check=True)
+        baseline = time.monotonic() - start
+        os.unlink(self.target)
+
+        start = time.monotonic()
+        transfer.transfer(transfer.local_source(self.source), self.target,
+                          sha256)
+        elapsed = time.monotonic() - start
+
+        throughput = size / 1024 ** 2 / elapsed
+        self.assertLess(elapsed, 2 * baseline + 0.5,
+                        "{:.0f} MiB/s, cat and sha256sum took {:.2f} s"
+                        .format(throughput, baseline))
+
+
+# stand-in for qrexec: passes stdin through at most argv[1] bytes per second
+THROTTLE = """
+import sys, time
+rate = int(sys.argv[1])
+start = time.monotonic()
+sent = 0
+while True:
+    chunk = sys.stdin.buffer.read1(64 * 1024)
+    if not chunk:
+        break
+    sys.stdout.buffer.write(chunk)
+    sent += len(chunk)
+    time.sleep(max(0, start + sent / rate - time.monotonic()))
+"""
+
+
+class CompressedTransferTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.source = os.path.join(tmpdir.name, 'source')
+        self.target = os.path.join(tmpdir.name, 'target')
+
+        if not any(shutil.which(codec) for codec in transfer.CODECS):
+            # gzip does the same, if much slower
+            for name, value in (
+                    ('CODECS', {'gzip': (['gzip', '-c'],
+                                         ['gzip', '-d', '-c'])}),
+                    ('DEFAULT_LEVELS', {'gzip': 1})):
+                patcher = unittest.mock.patch.object(transfer, name, value)
+                patcher.start()
+                self.addCleanup(patcher.stop)
+        self.codec = next(codec for codec in transfer.CODECS
+                          if shutil.which(codec))
+
+    def _create_source(self, size, compressible):
+        if compressible:
+            line = b''.join(b'%d: fetched package %d\n' % (number, number * 7)
+                            for number in range(1000))
+            data = (line * (size // len(line) + 1))[:size]
+        else:
+            data = os.urandom(size)
+        with open(self.source, 'wb') as file:
+            file.write(data)
+        return hashlib.sha256(data).hexdigest()
+
+    def test_01_entropy(self):
+        self.assertEqual(transfer.entropy(b''), 0.0)
+        self.assertEqual(transfer.entropy(b'aaaa'), 0.0)
+        self.assertEqual(transfer.entropy(b'abab'), 1.0)
+        self.assertGreater(transfer.entropy(os.urandom(65536)),
+                           transfer.ENTROPY_THRESHOLD)
+
+    def test_02_choose_codec(self):
+        sample = ['sh', '-c', transfer.sample_script(self.source)]
+        self._create_source(1024 ** 2, True)
+        self.assertEqual(transfer.choose_codec('auto', sample), self.codec)
+        self.assertIsNone(transfer.choose_codec('none', sample))
+        self.assertEqual(transfer.choose_codec(self.codec), self.codec)
+        self._create_source(1024 ** 2, False)
+        self.assertIsNone(transfer.choose_codec('auto', sample))
+        # no sample, e.g. a missing file
+        os.unlink(self.source)
+        self.assertIsNone(transfer.choose_codec('auto', sample))
+
+    def test_03_transfer(self):
+        sha256 = self._create_source(3 * transfer.CHUNK_SIZE + 17, True)
+        self.assertEqual(transfer.transfer(
+            transfer.local_source(self.source, self.codec), self.target,
+            sha256), sha256)
+        self.assertEqual(artifact_cache.file_sha256(self.target), sha256)
+
+    def test_04_codec_missing_in_source(self):
+        sha256 = self._create_source(1000, True)
+        with unittest.mock.patch.dict(
+                transfer.CODECS, {'missing-codec': (['missing-codec'], [])}):
+            command = transfer.local_source(self.source, 'missing-codec', 1)
+        self.assertEqual(transfer.transfer(command, self.target), sha256)
+
+    def test_05_corrupted(self):
+        command = ['sh', '-c', 'echo 3; echo {}; printf abc'.format(
+            self.codec)]
+        with self.assertRaises(transfer.TransferError):
+            transfer.transfer(command, self.target)
+        with self.assertRaises(transfer.TransferError):
+            transfer.transfer(['sh', '-c', 'echo 3; echo rar; printf abc'],
+                              self.target)
+        self.assertFalse(os.path.exists(self.target))
+
+    def _throughput(self, compression, rate):
+        """Returns effective throughput (in bytes per second) of the transfer
+        through a channel of the rate, and the codec chosen"""
+        codec = transfer.choose_codec(
+            compression, ['sh', '-c', transfer.sample_script(self.source)])
+        command = ['sh', '-c', '({}) | {} -c {} {}'.format(
+            transfer.source_script(self.source, codec),
+            shlex.quote(sys.executable), shlex.quote(THROTTLE), rate)]
+        start = time.monotonic()
+        transfer.transfer(command, self.target)
+        return os.path.getsize(self.target) / (time.monotonic() - start), \
+            codec
+
+    def test_06_benchmark(self):
+        """Effective throughput through a slow channel, with and without
+        compression, of compressible and incompressible data"""
+        size = 16 * 1024 ** 2
+        rate = 32 * 1024 ** 2
+        results = {}
+        for compressible in (True, False):
+            self._create_source(size, compressible)
+            for compression in ('none', 'auto'):
+                results[compressible, compression] = \
+                    self._throughput(compression, rate)
+        message = ", ".join(
+            "{} {} ({}): {:.0f} MiB/s".format(
+                'compressible' if compressible else 'incompressible',
+                compression, codec, throughput / 1024 ** 2)
+            for (compressible, compression), (throughput, codec)
+            in results.items())
+
+        # the channel is the bottleneck, unless compressed
+        self.assertEqual(results[True, 'auto'][1], self.codec, message)
+        self.assertGreater(results[True, 'auto'][0],
+                           1.5 * results[True, 'none'][0], message)
+        # not worth it, so not compressed
+        self.assertIsNone(results[False, 'auto'][1], message)
+        self.assertLess(results[False, 'none'][0], 1.1 * rate, message)
+
+
+if __name__ == "__main__":
+    ha_syslog = logging.handlers.SysLogHandler('/dev/log')
+    ha_syslog.setFormatter(
+        logging.Formatter('%(name)s[%(process)d]: %(message)s'))
+    logging.root.addHandler(ha_syslog)
+    unittest.main()
@@ -0,0 +1,235 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, https://www.qubes-os.org/
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+import logging.handlers
+import threading
+import time
+import unittest
+import unittest.mock
+
+from PyQt5 import QtWidgets  # pylint: disable=import-error
+
+from qubesadmin import exc
+
+from qubesmanager import update_orchestrator
+from qubesmanager.tests import init_qtapp
+
+
+class _UpdatedVm:
+    """Fake qube counting how many of its kind are updated at once"""
+    # pylint: disable=too-few-public-methods
+    lock = threading.Lock()
+    concurrent = 0
+    max_concurrent = 0
+
+    def __init__(self, name, running=True, memory=400, fail=False):
+        self.name = name
+        self.klass = 'AppVM'
+        self.app = unittest.mock.Mock()
+        self.memory = memory
+        self.running = running
+        self.fail = fail
+        self.calls = []
+
+    def is_running(self):
+        return self.running
+
+    def start(self):
+        self.calls.append('start')
+        self.running = True
+
+    def shutdown(self, wait=False):
+        self.calls.append(('shutdown', wait))
+        self.running = False
+
+    def run_service_for_stdio(self, service, user=None):
+        self.calls.append((service, user))
+        cls = type(self)
+        with cls.lock:
+            cls.concurrent += 1
+            cls.max_concurrent = max(cls.max_concurrent, cls.concurrent)
+        time.sleep(0.1)
+        with cls.lock:
+            cls.concurrent -= 1
+        if self.fail:
+            raise exc.QubesException('update failed')
+        return b'', b''
+
+
+class UpdateOrchestratorTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.qtapp, self.loop = init_qtapp()
+        _UpdatedVm.concurrent = 0
+        _UpdatedVm.max_concurrent = 0
+
+    def _run(self, orchestrator):
+        wall_times = []
+        orchestrator.finished.connect(wall_times.append)
+        orchestrator.start()
+        deadline = time.monotonic() + 20
+        while not wall_times and time.monotonic() < deadline:
+            self.qtapp.processEvents()
+            time.sleep(0.01)
+        return wall_times
+
+    def test_01_parallelism_limit(self):
+        vms = [_UpdatedVm('vm{}'.format(i)) for i in range(6)]
+        orchestrator = update_orchestrator.UpdateOrchestrator(
+            vms, max_parallel=2, free_memory=lambda: None)
+        statuses = []
+        orchestrator.status_changed.connect(
+            lambda name, status: statuses.append((name, status)))
+
+        wall_times = self._run(orchestrator)
+
+        self.assertEqual(len(wall_times), 1)
+        self.assertEqual(_UpdatedVm.max_concurrent, 2)
+        self.assertEqual(len(orchestrator.results), 6)
+        for vm in vms:
+            self.assertEqual(vm.calls, [('qubes.InstallUpdatesGUI', 'root')])
+            self.assertIn((vm.name, 'done'), statuses)
+        # three rounds of two, so faster than one by one
+        self.assertLess(wall_times[0], 0.1 * 6)
+        self.assertIn('total: 6 qubes', orchestrator.report())
+
+    def test_02_started_qubes_shut_down(self):
+        halted = _UpdatedVm('halted', running=False)
+        running = _UpdatedVm('running')
+        orchestrator = update_orchestrator.UpdateOrchestrator(
+            [halted, running], free_memory=lambda: None)
+        self._run(orchestrator)
+
+        self.assertEqual(halted.calls, [
+            'start', ('qubes.InstallUpdatesGUI', 'root'), ('shutdown', True)])
+        self.assertFalse(halted.running)
+        self.assertEqual(running.calls, [('qubes.InstallUpdatesGUI', 'root')])
+        self.assertTrue(running.running)
+
+    def test_03_free_memory_limit(self):
+        vms = [_UpdatedVm('vm{}'.format(i), running=False, memory=1000)
+               for i in range(4)]
+        def free_memory():
+            # enough memory for one more qube than is running
+            return 1500 + update_orchestrator.MEMORY_RESERVE - sum(
+                vm.memory for vm in vms if vm.running)
+        orchestrator = update_orchestrator.UpdateOrchestrator(
+            vms, max_parallel=4, free_memory=free_memory)
+        self._run(orchestrator)
+
+        self.assertEqual(_UpdatedVm.max_concurrent, 1)
+        self.assertEqual(len(orchestrator.results), 4)
+
+    def test_04_failure_reported(self):
+        vms = [_UpdatedVm('good'), _UpdatedVm('bad', fail=True)]
+        orchestrator = update_orchestrator.UpdateOrchestrator(
+            vms, free_memory=lambda: None)
+        finished = []
+        orchestrator.vm_finished.connect(
+            lambda name, success, duration, msg: finished.append(
+                (name, success, msg)))
+        self._run(orchestrator)
+
+        self.assertIn(('good', True, ''), finished)
+        self.assertIn(('bad', False, 'update failed'), finished)
+        self.assertIn('bad: ', orchestrator.report())
+        self.assertGreater(orchestrator.results['bad'][1], 0)
+
+    def test_05_free_memory_estimated(self):
+        app = unittest.mock.Mock()
+        dom0 = unittest.mock.Mock(klass='AdminVM')
+        dom0.get_mem.return_value = 4000 * 1024
+        running = _UpdatedVm('running', memory=2000)
+        vms = [_UpdatedVm('vm{}'.format(i), running=False, memory=1000)
+               for i in range(4)]
+        app.domains = [dom0, running] + vms
+        # enough memory for one more qube than is running
+        app.host.memory_total = (4000 + 2000 + 1500 +
+                                 update_orchestrator.MEMORY_RESERVE) * 1024
+        for vm in vms:
+            vm.app = app
+        self.assertEqual(update_orchestrator.get_free_memory(app),
+                         1500 + update_orchestrator.MEMORY_RESERVE)
+
+        self._run(update_orchestrator.UpdateOrchestrator(vms, max_parallel=4))
+
+        self.assertEqual(_UpdatedVm.max_concurrent, 1)
+
+    def test_06_free_memory_unknown(self):
+        app = unittest.mock.Mock()
+        type(app.host).memory_total = unittest.mock.PropertyMock(
+            side_effect=NotImplementedError)
+        self.assertIsNone(update_orchestrator.get_free_memory(app))
+
+    def test_07_hidden_dialog_finished(self):
+        dialog = update_orchestrator.UpdateProgressDialog(
+            [_UpdatedVm('vm{}'.format(i)) for i in range(2)],
+            free_memory=lambda: None)
+        finished = []
+        dialog.finished.connect(finished.append)
+        with unittest.mock.patch('PyQt5.QtCore.QSettings'):
+            dialog.start()
+        # closed while updating, only hidden
+        dialog.reject()
+        self.assertEqual(finished, [])
+
+        deadline = time.monotonic() + 20
+        while not finished and time.monotonic() < deadline:
+            self.qtapp.processEvents()
+            time.sleep(0.01)
+        self.assertEqual(finished, [QtWidgets.QDialog.Rejected])
+        self.assertEqual(len(dialog.threads_list), 2)
+
+
+    def test_08_free_memory_per_pass(self):
+        calls = []
+        vms = [_UpdatedVm('vm{}'.format(i), running=False) for i in range(4)]
+        orchestrator = update_orchestrator.UpdateOrchestrator(
+            vms, max_parallel=4, free_memory=lambda: calls.append(None))
+        self._run(orchestrator)
+
+        self.assertEqual(len(orchestrator.results), 4)
+        self.assertEqual(len(calls), 1)
+
+    def test_09_started_counted_once(self):
+        # pylint: disable=protected-access
+        vm = _UpdatedVm('vm1', running=False, memory=1000)
+        orchestrator = update_orchestrator.UpdateOrchestrator(
+            [vm], max_parallel=2, free_memory=lambda: 1000 +
+            update_orchestrator.MEMORY_RESERVE)
+        # another qube started for the update, with as much memory
+        starting = unittest.mock.Mock(started_vm=False)
+        orchestrator.running['vm0'] = starting
+        orchestrator.reserved_memory['vm0'] = 1000
+
+        # not counted in the free memory until it runs
+        orchestrator.start()
+        self.assertEqual(orchestrator.queue, [vm])
+
+        # then counted in the free memory only
+        starting.started_vm = True
+        orchestrator._schedule()
+        self.assertEqual(orchestrator.queue, [])
+        self.assertTrue(orchestrator.running['vm1'].wait(10000))
+
+if __name__ == "__main__":
+    ha_syslog = logging.handlers.SysLogHandler('/dev/log')
+    ha_syslog.setFormatter(
+        logging.Formatter('%(name)s[%(process)d]: %(message)s'))
+    logging.root.addHandler(ha_syslog)
+    unittest.main()
@@ -0,0 +1,183 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, https://www.qubes-os.org/
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+import logging.handlers
+import time
+import unittest
+import unittest.mock
+
+from qubesadmin import exc
+
+from qubesmanager import worker_pool
+from qubesmanager.tests import create_fancy_manager, init_qtapp, \
+    patch_fancy_manager
+
+
+class MockDomains:
+    def __init__(self, vms):
+        self.vms = {vm.name: vm for vm in vms}
+
+    def __getitem__(self, name):
+        return self.vms[name]
+
+    def __iter__(self):
+        return iter(self.vms.values())
+
+
+def _mock_vm(name, running):
+    vm = unittest.mock.Mock()
+    vm.name = name
+    vm.is_running.return_value = running
+    return vm
+
+
+class WorkerPoolTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.qtapp, self.loop = init_qtapp()
+        self.settings = {worker_pool.POOL_SIZE_KEY: '2',
+                         worker_pool.IDLE_TIMEOUT_KEY: '60'}
+        self.vms = [_mock_vm('fancy-worker-dvm', False),
+                    _mock_vm('fancy-worker-1', False),
+                    _mock_vm('fancy-worker-2', True),
+                    _mock_vm('work', True)]
+        self.qubes_app = unittest.mock.Mock()
+        self.qubes_app.domains = MockDomains(self.vms)
+        settings = unittest.mock.Mock()
+        settings.value.side_effect = self.settings.get
+        self.pool = worker_pool.WorkerPool(self.qubes_app, settings)
+
+    def test_01_settings(self):
+        self.assertEqual(self.pool.size, 2)
+        self.assertEqual(self.pool.idle_timeout, 60)
+        self.settings[worker_pool.POOL_SIZE_KEY] = 'many'
+        self.assertEqual(self.pool.size, worker_pool.DEFAULT_POOL_SIZE)
+        self.settings[worker_pool.POOL_SIZE_KEY] = '0'
+        self.assertEqual(self.pool.worker_names(), ['fancy-worker-1'])
+
+    def test_02_acquire_prefers_running(self):
+        self.assertEqual(self.pool.acquire('run-a'), 'fancy-worker-2')
+        self.assertEqual(self.pool.acquire('run-b'), 'fancy-worker-1')
+        self.pool.release('run-a')
+        self.assertEqual(self.pool.acquire('run-c'), 'fancy-worker-2')
+
+    def test_03_temporary_when_busy(self):
+        self.pool.acquire('run-a')
+        self.pool.acquire('run-b')
+        name = self.pool.acquire('fancy_manager_0123456789')
+        self.assertEqual(name, 'fancy-worker-0123456789')
+        self.assertLessEqual(len(name), 31)
+
+        cleanup = self.pool.cleanup_script(name, ['/tmp/file'])
+        self.assertIn('qvm-remove -f fancy-worker-0123456789', cleanup)
+        self.assertNotIn('qvm-remove',
+                         self.pool.cleanup_script('fancy-worker-1',
+                                                  ['/tmp/file']))
+
+        self.pool.release('fancy_manager_0123456789')
+        self.assertNotIn(name, self.pool.temporary)
+
+    def test_04_idle_shutdown(self):
+        self.pool.acquire('run-a')
+        self.pool.acquire('run-b')
+        self.pool.release('run-a')
+        # one worker still busy
+        self.assertFalse(self.pool.idle_timer.isActive())
+
+        self.pool.release('run-b')
+        self.assertTrue(self.pool.idle_timer.isActive())
+        self.assertEqual(self.pool.idle_timer.interval(), 60000)
+
+        # a new installation keeps the workers running
+        self.pool.acquire('run-c')
+        self.assertFalse(self.pool.idle_timer.isActive())
+        self.pool.release('run-c')
+
+        self.pool.idle_timer.setInterval(10)
+        deadline = time.monotonic() + 2
+        while self.pool.idle_timer.isActive() and \
+                time.monotonic() < deadline:
+            self.qtapp.processEvents()
+            time.sleep(0.005)
+
+        self.vms[2].shutdown.assert_called_once_with()
+        self.vms[0].shutdown.assert_not_called()
+        self.vms[1].shutdown.assert_not_called()
+        self.vms[3].shutdown.assert_not_called()
+
+    def test_05_idle_shutdown_skips_busy(self):
+        self.pool.acquire('run-a')
+        self.vms[1].is_running.return_value = True
+        self.vms[1].shutdown.side_effect = exc.QubesException('error')
+        self.pool.shutdown_idle()
+        self.vms[2].shutdown.assert_not_called()
+        self.vms[1].shutdown.assert_called_once_with()
+
+    def test_06_setup_script(self):
+        script = self.pool.setup_script('fancy-worker-1', 'default-dvm')
+        self.assertIn('if ! qvm-check --quiet fancy-worker-dvm', script)
+        self.assertIn('qvm-clone default-dvm fancy-worker-dvm', script)
+        self.assertIn('qvm-create --disp --template fancy-worker-dvm',
+                      script)
+        self.assertIn('qvm-start --skip-if-running fancy-worker-1', script)
+        self.assertIn('qvm-run -p fancy-worker-1 true', script)
+
+
+class FancyManagerPoolTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.qtapp, self.loop = init_qtapp()
+        patch_fancy_manager(self)
+
+        settings = unittest.mock.Mock()
+        settings.value.side_effect = lambda key, default: default
+        self.pool = worker_pool.WorkerPool(settings=settings)
+        self.fancy = create_fancy_manager(self.pool)
+
+    def test_01_no_clone_per_installation(self):
+        steps = self.fancy.get_install_script(
+            'debian-12', 'run-id',
+            'default-dvm', 'name', 'sys-net', 'red')
+        self.assertEqual(len(steps), 6)
+        _mount, setup, download, _install, _clean_scratch, cleanup = steps
+        # the template clone is guarded, only the first run creates it
+        self.assertIn('if ! qvm-check --quiet fancy-worker-dvm',
+                      setup['script'])
+        self.assertIn("qvm-run -p fancy-worker-1 'wget",
+                      download['script'])
+        self.assertTrue(cleanup['run_on_fail'])
+        self.assertIn('rm -rf /tmp/run-id', cleanup['script'])
+        self.assertNotIn('qvm-remove', cleanup['script'])
+        self.assertEqual(self.pool.leases, {'run-id': 'fancy-worker-1'})
+
+    def test_02_windows_cleans_resources(self):
+        steps = self.fancy.get_install_script(
+            'win10x64-ltsc-eval', 'run-id', 'default-dvm', 'win',
+            'sys-net', 'red')
+        self.assertIn('/home/user/Documents/qvm-create-windows-qube',
+                      steps[-1]['script'])
+        self.assertIn('--resources-qube "fancy-worker-1"',
+                      steps[-2]['script'])
+
+
+if __name__ == "__main__":
+    ha_syslog = logging.handlers.SysLogHandler('/dev/log')
+    ha_syslog.setFormatter(
+        logging.Formatter('%(name)s[%(process)d]: %(message)s'))
+    logging.root.addHandler(ha_syslog)
+    unittest.main()
@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+#
+"""Tools present in the templates of the worker disposables.
+
+The installations need a few tools (wget, genisoimage...) in the worker
+they download in. Instead of running the package manager of the worker
+every time, the tools are looked for once and the ones found are recorded
+in a store of their own, per template of the worker; the record is dropped when
+the template is updated (its root volume changes). Tools are only
+recorded if nothing was installed in the worker since it started: the
+install leaves a marker in its /run (a tmpfs), so tools installed in a
+running worker are not taken for tools of its template. The installation
+scripts use `python3 -m qubesmanager.tool_probe check WORKER TOOL...`,
+which fails if any of the tools is missing, see ensure_command.
+"""
+
+import argparse
+import contextlib
+import dbm
+import fcntl
+import os
+import shelve
+import shlex
+import subprocess
+import sys
+
+from qubesadmin import exc
+
+# apart from the state of the installations, which the GUI writes to
+DEFAULT_STATE_PATH = os.path.expanduser('~/.qubes-fancy-manager/tools')
+KEY_PREFIX = 'tools:'
+PROBE_TIMEOUT = 60  # seconds
+# left in the worker by ensure_command before installing anything
+INSTALLED_MARKER = '/run/qubes-fancy-manager-installed'
+
+
+def base_template(vm):
+    """Returns the template the root volume of the qube comes from (the
+    qube itself, if it has no template)"""
+    while True:
+        try:
+            template = vm.template
+        except AttributeError:
+            return vm
+        if template is None:
+            return vm
+        vm = template
+
+
+def template_fingerprint(template):
+    """Returns a string changing when the template is updated"""
+    parts = [str(template.features.get('last-updated', ''))]
+    try:
+        volume = template.volumes['root']
+        revisions = volume.revisions
+        parts.append(revisions[-1] if revisions else '')
+        parts.append(str(volume.usage))
+    except (KeyError, exc.QubesException):
+        parts.append('')
+    return '/'.join(parts)
+
+
+class ToolCache:
+    """Tools found in templates, kept in a store written by the
+    installations running at the same time"""
+    def __init__(self, state_path=DEFAULT_STATE_PATH):
+        self.state_path = state_path
+
+    @contextlib.contextmanager
+    def _open(self, flag='c'):
+        """Yields the store, locked against other processes"""
+        with open(self.state_path + '.lock', 'w', encoding='utf-8') as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH if flag == 'r' else fcntl.LOCK_EX)
+            with shelve.open(self.state_path, flag) as store:
+                yield store
+
+    def present(self, template, fingerprint):
+        """Returns set of the tools recorded in the template, empty if the
+        template was updated since"""
+        try:
+            with self._open('r') as store:
+                record = store.get(KEY_PREFIX + template)
+        except dbm.error:
+            return set()
+        if record is None or record['fingerprint'] != fingerprint:
+            return set()
+        return set(record['tools'])
+
+    def record(self, template, fingerprint, tools):
+        """Adds the tools found in the template"""
+        key = KEY_PREFIX + template
+        with self._open() as store:
+            record = store.get(key)
+            if record is None or record['fingerprint'] != fingerprint:
+                record = {'fingerprint': fingerprint, 'tools': []}
+            record['tools'] = sorted(set(record['tools']) | set(tools))
+            store[key] = record
+
+    def forget(self, template):
+        with self._open() as store:
+            store.pop(KEY_PREFIX + template, None)
+
+
+def probe(worker, tools):
+    """Returns set of the tools found in the running worker, and whether
+    anything was installed in it since it started"""
+    script = '[ -e {} ] && echo /installed; ' \
+        'for tool in {}; do command -v "$tool" >/dev/null && ' \
+        'echo "$tool"; done; true'.format(
+            INSTALLED_MARKER, ' '.join(shlex.quote(tool) for tool in tools))
+    try:
+        result = subprocess.run(
+            ['qvm-run', '-p', worker, script], stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, timeout=PROBE_TIMEOUT, check=True)
+    except (OSError, subprocess.SubprocessError):
+        return set(), True
+    lines = set(result.stdout.decode(errors='replace').split())
+    return lines & set(tools), '/installed' in lines
+
+
+def check(qubes_app, worker, tools, cache):
+    """Returns the tools missing in the worker; the ones known to be in its
+    template are not looked for"""
+    try:
+        template = base_template(qubes_app.domains[worker])
+        fingerprint = template_fingerprint(template)
+    except (KeyError, exc.QubesException):
+        return sorted(set(tools) - probe(worker, tools)[0])
+    missing = set(tools) - cache.present(template.name, fingerprint)
+    if not missing:
+        return []
+    found, installed = probe(worker, sorted(missing))
+    # installed ones may be missing in the template
+    if found and not installed:
+        try:
+            cache.record(template.name, fingerprint, found)
+        except dbm.error:
+            # looked for again the next time
+            pass
+    return sorted(missing - found)
+
+
+def ensure_command(worker, tools, install_script,
+                   state_path=DEFAULT_STATE_PATH):
+    """Returns a shell command running the install script in the worker,
+    unless it has all the tools"""
+    install_script = 'sudo touch {}\n{}'.format(
+        INSTALLED_MARKER, install_script)
+    return "python3 -m qubesmanager.tool_probe --state {} check {} {} || " \
+        "qvm-run -p {} {}".format(
+            shlex.quote(state_path), shlex.quote(worker),
+            ' '.join(shlex.quote(tool) for tool in tools),
+            shlex.quote(worker), shlex.quote(install_script))
+
+
+def main(args=None, qubes_app=None):
+    parser = argparse.ArgumentParser(
+        description="Check tools in the fancy manager worker disposables")
+    parser.add_argument('--state', default=DEFAULT_STATE_PATH)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    check_parser = subparsers.add_parser('check')
+    check_parser.add_argument('worker')
+    check_parser.add_argument('tools', nargs='+')
+    args = parser.parse_args(args)
+
+    if qubes_app is None:
+        import qubesadmin  # pylint: disable=import-outside-toplevel
+        qubes_app = qubesadmin.Qubes()
+    missing = check(qubes_app, args.worker, args.tools,
+                    ToolCache(args.state))
+    if missing:
+        print("missing in {}: {}".format(args.worker, ' '.join(missing)))
+        return 1
+    print("found in {}: {}".format(args.worker, ' '.join(args.tools)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,334 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+#
+"""Copying files from a qube to dom0.
+
+The file is read from the qrexec stream of `qvm-run -p` in large chunks and
+hashed while it streams, so it does not have to be read again to be
+verified. The qube sends the size of the file first: the target is
+preallocated, progress comes with an ETA, and a transfer of the wrong size
+is stopped as soon as that is known. The file only gets its name once it is
+complete and verified.
+
+qrexec is slow next to compression, so the file can be compressed (zstd or
+lz4) in the qube and decompressed in dom0 as it streams. With 'auto', a
+sample of the file is looked at first and files which look compressed
+already (rpm, bz2...) are sent as they are. The installation scripts use
+`python3 -m qubesmanager.transfer VM SOURCE TARGET [--sha256 HASH]
+[--compress auto]`.
+"""
+
+import argparse
+import collections
+import contextlib
+import fcntl
+import hashlib
+import math
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import time
+
+from .artifact_cache import HashMismatch
+
+CHUNK_SIZE = 1024 ** 2
+# Linux only, not in the fcntl module before Python 3.10
+F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+# shortest time (in seconds) between two progress reports
+REPORT_INTERVAL = 0.5
+
+# codec: (compress command, decompress command); the level is added to
+# the compress command as -LEVEL
+CODECS = {
+    'zstd': (['zstd', '-q', '-c', '-T0'], ['zstd', '-q', '-d', '-c']),
+    'lz4': (['lz4', '-q', '-c'], ['lz4', '-q', '-d', '-c']),
+}
+DEFAULT_LEVELS = {'zstd': 3, 'lz4': 1}
+COMPRESSION_CHOICES = ('auto', 'none') + tuple(CODECS)
+SAMPLE_SIZE = 64 * 1024
+# entropy (bits per byte) of a sample over which the file is taken as
+# compressed already; about 8 for compressed data, 4-6 for text and code
+ENTROPY_THRESHOLD = 7.5
+SAMPLE_TIMEOUT = 60  # seconds
+
+
+class SizeMismatch(ValueError):
+    """File does not have the expected size"""
+
+
+class TransferError(OSError):
+    """Source of the file failed"""
+
+
+def source_script(path, codec=None, level=None):
+    """Returns shell script sending the size of the file and the codec it
+    is compressed with (each on a line of its own), and then the file; the
+    file is not compressed ('none') if the codec is missing"""
+    quoted = shlex.quote(path)
+    script = 'stat -L -c %s -- {} || exit 1\n'.format(quoted)
+    if codec is not None:
+        compress = CODECS[codec][0] + [
+            '-{}'.format(level or DEFAULT_LEVELS[codec])]
+        script += 'command -v {0} >/dev/null && echo {0} && ' \
+            'exec {1} -- {2}\n'.format(codec, ' '.join(compress), quoted)
+    return script + 'echo none && exec cat -- {}'.format(quoted)
+
+
+def vm_source(vm_name, path, codec=None, level=None):
+    """Returns command sending the file in the qube, see source_script"""
+    return ['qvm-run', '-p', vm_name, source_script(path, codec, level)]
+
+
+def local_source(path, codec=None, level=None):
+    """Returns command doing the same as vm_source, for a local file"""
+    return ['sh', '-c', source_script(path, codec, level)]
+
+
+def sample_script(path):
+    """Returns shell script sending SAMPLE_SIZE bytes from the middle of
+    the file; the start is often a header (of rpm, iso...) which compresses
+    well even when the rest does not"""
+    quoted = shlex.quote(path)
+    return 'size=$(stat -L -c %s -- {0}) && ' \
+        'tail -c $((size / 2)) -- {0} | head -c {1}'.format(
+            quoted, SAMPLE_SIZE)
+
+
+def entropy(data):
+    """Returns Shannon entropy of the data, in bits per byte"""
+    if not data:
+        return 0.0
+    return -sum(count / len(data) * math.log2(count / len(data))
+                for count in collections.Counter(data).values())
+
+
+def choose_codec(compression, sample_command=None):
+    """
+    Returns the codec to transfer a file with, or None.
+    :param compression: one of COMPRESSION_CHOICES
+    :param sample_command: command sending a sample of the file (see
+        sample_script), for 'auto'
+    """
+    # dom0 has to decompress it
+    available = [codec for codec in CODECS if shutil.which(codec)]
+    if compression != 'auto':
+        return compression if compression in available else None
+    if not available or sample_command is None:
+        return None
+    try:
+        sample = subprocess.run(
+            sample_command, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, timeout=SAMPLE_TIMEOUT,
+            check=True).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if entropy(sample) > ENTROPY_THRESHOLD:
+        return None
+    return available[0]
+
+
+class Progress:
+    """Throughput and ETA of a transfer"""
+    def __init__(self, total, clock=time.monotonic):
+        self.total = total
+        self.done = 0
+        self.clock = clock
+        self.start = clock()
+
+    @property
+    def rate(self):
+        """Average throughput, in bytes per second"""
+        elapsed = self.clock() - self.start
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        """Seconds left, or None if not known yet"""
+        rate = self.rate
+        if not rate:
+            return None
+        return max(0, self.total - self.done) / rate
+
+    def format(self):
+        eta = self.eta
+        return "{:.1f}/{:.1f} MiB, {:.1f} MiB/s, ETA {}".format(
+            self.done / 1024 ** 2, self.total / 1024 ** 2,
+            self.rate / 1024 ** 2,
+            "--:--" if eta is None else "{}:{:02d}".format(
+                int(eta) // 60, int(eta) % 60))
+
+
+def _read_line(stream, what):
+    line = b''
+    while not line.endswith(b'\n'):
+        byte = stream.read(1)
+        if not byte or len(line) > 20:
+            raise TransferError("no {} received: {!r}".format(what, line))
+        line += byte
+    return line.decode('ascii', errors='replace').strip()
+
+
+def _start(stack, command, **kwargs):
+    """Starts the command; when the stack exits, it is killed (if still
+    running) and waited for"""
+    # entered into the stack, which the caller uses as a with block
+    # pylint: disable=consider-using-with
+    process = stack.enter_context(subprocess.Popen(command, **kwargs))
+    stack.callback(_kill, process)
+    return process
+
+
+def _kill(process):
+    if process.poll() is None:
+        process.kill()
+
+
+def _remove(path):
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(path)
+
+
+def transfer(command, target, sha256=None, size=None, report=None):
+    """
+    Runs the command (see vm_source) and writes the file it sends to the
+    target.
+    :param sha256: expected hash of the file
+    :param size: expected size of the file
+    :param report: called with Progress after every chunk
+    :raises SizeMismatch, HashMismatch: on a wrong file; the target is not
+        written
+    :raises TransferError: if the command (or decompressing) fails
+    :return: sha256 of the file
+    """
+    tmp_path = target + '.part'
+    with contextlib.ExitStack() as stack:
+        stack.callback(_remove, tmp_path)
+        process = _start(stack, command, stdout=subprocess.PIPE, bufsize=0)
+        processes = [process]
+        stream = process.stdout
+        line = _read_line(process.stdout, 'size')
+        try:
+            sent_size = int(line)
+        except ValueError:
+            raise TransferError(
+                "no size received: {!r}".format(line)) from None
+        if size is not None and sent_size != size:
+            raise SizeMismatch("file has {} bytes, expected {}".format(
+                sent_size, size))
+        codec = _read_line(process.stdout, 'codec')
+        if codec != 'none':
+            if codec not in CODECS:
+                raise TransferError("unknown codec: {}".format(codec))
+            decompress = _start(
+                stack, CODECS[codec][1], stdin=process.stdout,
+                stdout=subprocess.PIPE, bufsize=0)
+            processes.append(decompress)
+            # the source gets EPIPE if the decompressing stops reading
+            process.stdout.close()
+            stream = decompress.stdout
+        with contextlib.suppress(OSError):
+            # a chunk per read, instead of the default 64 KiB
+            fcntl.fcntl(stream, F_SETPIPE_SZ, CHUNK_SIZE)
+        progress = Progress(sent_size)
+        hasher = hashlib.sha256()
+        buffer = bytearray(CHUNK_SIZE)
+        view = memoryview(buffer)
+        with open(tmp_path, 'wb') as file:
+            with contextlib.suppress(OSError):
+                os.posix_fallocate(file.fileno(), 0, sent_size)
+            while True:
+                count = stream.readinto(buffer)
+                if not count:
+                    break
+                if progress.done + count > sent_size:
+                    raise SizeMismatch(
+                        "file is longer than {} bytes".format(sent_size))
+                hasher.update(view[:count])
+                file.write(view[:count])
+                progress.done += count
+                if report is not None:
+                    report(progress)
+            # preallocated, but not all written if it is too short
+            file.truncate(progress.done)
+        for running in reversed(processes):
+            if running.wait() != 0:
+                raise TransferError("{} failed with exit code {}".format(
+                    running.args[0], running.returncode))
+        if progress.done != sent_size:
+            raise SizeMismatch("file has {} bytes, expected {}".format(
+                progress.done, sent_size))
+        digest = hasher.hexdigest()
+        if sha256 is not None and digest != sha256:
+            raise HashMismatch("file has sha256 {}, expected {}".format(
+                digest, sha256))
+        os.replace(tmp_path, target)
+        return digest
+
+
+def terminal_report(file=sys.stdout, interval=REPORT_INTERVAL,
+                    clock=time.monotonic):
+    """Returns report function writing the progress over the previous one
+    at most every interval seconds"""
+    last = [None]
+
+    def report(progress):
+        now = clock()
+        if last[0] is not None and now - last[0] < interval and \
+                progress.done < progress.total:
+            return
+        last[0] = now
+        file.write('\r' + progress.format())
+        file.flush()
+    return report
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Copy a file from a qube to dom0")
+    parser.add_argument('vm')
+    parser.add_argument('source')
+    parser.add_argument('target')
+    parser.add_argument('--sha256')
+    parser.add_argument('--size', type=int)
+    parser.add_argument('--compress', choices=COMPRESSION_CHOICES,
+                        default='none')
+    parser.add_argument('--level', type=int,
+                        help="compression level, default {}".format(
+                            ", ".join("{} for {}".format(level, codec)
+                                      for codec, level
+                                      in DEFAULT_LEVELS.items())))
+    args = parser.parse_args(args)
+
+    codec = choose_codec(args.compress, [
+        'qvm-run', '-p', args.vm, sample_script(args.source)])
+    if codec is not None:
+        print("compressed with {}".format(codec))
+    try:
+        transfer(vm_source(args.vm, args.source, codec, args.level),
+                 args.target, args.sha256, args.size, terminal_report())
+    except (OSError, ValueError) as ex:
+        print("\ntransfer: {}".format(ex), file=sys.stderr)
+        return 1
+    print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,329 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+#
+"""Updating many qubes at once, a few at a time."""
+
+import subprocess
+import time
+
+from PyQt5 import QtCore, QtWidgets  # pylint: disable=import-error
+
+from qubesadmin import exc
+
+from . import common_threads
+from . import utils
+
+# default number of qubes updated at the same time
+DEFAULT_MAX_PARALLEL = 2
+# memory (in MiB) left free for everything else when starting qubes
+MEMORY_RESERVE = 1024
+
+
+def get_free_memory(qubes_app):
+    """Estimates free memory in MiB: total memory of the host minus memory
+    of the running qubes (current memory of dom0, initial memory of the
+    others). Returns None if it cannot be determined."""
+    try:
+        free_memory = qubes_app.host.memory_total // 1024
+        for vm in qubes_app.domains:
+            if vm.klass == 'AdminVM':
+                free_memory -= vm.get_mem() // 1024
+            elif utils.is_running(vm, False):
+                free_memory -= vm.memory
+    except (AttributeError, NotImplementedError, TypeError,
+            exc.QubesException):
+        return None
+    return free_memory
+
+
+class UpdateQubeThread(common_threads.QubesThread):
+    """Updates a single qube and waits for the update to finish. If the
+    qube was not running, it is started for the update and shut down
+    again afterwards."""
+    status_changed = QtCore.pyqtSignal(str)
+
+    def __init__(self, vm):
+        super().__init__(vm)
+        self.started_vm = False
+        self.duration = None
+
+    def run(self):
+        start_time = time.monotonic()
+        try:
+            if not utils.is_running(self.vm, False):
+                self.status_changed.emit(self.tr("starting"))
+                self.vm.start()
+                self.started_vm = True
+            self.status_changed.emit(self.tr("updating"))
+            self.vm.run_service_for_stdio("qubes.InstallUpdatesGUI",
+                                          user="root")
+            self.msg_is_success = True
+        except (ChildProcessError, subprocess.CalledProcessError,
+                exc.QubesException) as ex:
+            self.msg = (self.tr("Error on qube update!"), str(ex))
+
+        if self.started_vm:
+            self.status_changed.emit(self.tr("shutting down"))
+            try:
+                self.vm.shutdown(wait=True)
+            except exc.QubesException as ex:
+                if self.msg is None:
+                    self.msg = (self.tr("Error shutting down qube!"),
+                                str(ex))
+                    self.msg_is_success = False
+
+        self.duration = time.monotonic() - start_time
+
+
+class UpdateOrchestrator(QtCore.QObject):
+    """Runs updates of the given qubes, at most max_parallel at a time and
+    only starting a halted qube when there seems to be enough free memory
+    for it (one qube is always allowed, so that the queue cannot stall).
+    Progress is reported with signals, all of them on the GUI thread."""
+    # qube name, status
+    status_changed = QtCore.pyqtSignal(str, str)
+    # qube name, success, duration in seconds, error message
+    vm_finished = QtCore.pyqtSignal(str, bool, float, str)
+    # total wall time in seconds
+    finished = QtCore.pyqtSignal(float)
+
+    def __init__(self, vms, max_parallel=DEFAULT_MAX_PARALLEL,
+                 free_memory=None, parent=None):
+        """
+        :param vms: qubes to update
+        :param max_parallel: maximum number of concurrent updates
+        :param free_memory: callable returning free memory in MiB or None
+            if unknown; default is get_free_memory
+        """
+        super().__init__(parent)
+        self.queue = list(vms)
+        self.max_parallel = max(1, max_parallel)
+        self.free_memory = free_memory
+        self.running = {}
+        # all the threads started, kept until they really end
+        self.threads = []
+        # memory (in MiB) of halted qubes started for the update, counted
+        # as used until they are running, see _reserved_memory
+        self.reserved_memory = {}
+        # qube name: (success, duration, error message)
+        self.results = {}
+        self.start_time = None
+        self.wall_time = None
+
+    def start(self):
+        self.start_time = time.monotonic()
+        for vm in self.queue:
+            self.status_changed.emit(vm.name, self.tr("queued"))
+        self._schedule()
+
+    def is_finished(self):
+        return not self.queue and not self.running
+
+    def _get_free_memory(self):
+        if self.free_memory is not None:
+            return self.free_memory()
+        if not self.queue:
+            return None
+        return get_free_memory(self.queue[0].app)
+
+    def _needed_memory(self, vm):
+        if utils.is_running(vm, False):
+            return 0
+        try:
+            return vm.memory
+        except exc.QubesException:
+            return 0
+
+    def _reserved_memory(self, started_since_fetch):
+        """Memory (in MiB) of the qubes started for the update which the
+        fetched free memory does not count as used yet: those started since
+        it was fetched and those still starting"""
+        return sum(needed for name, needed in self.reserved_memory.items()
+                   if name in started_since_fetch or
+                   not self.running[name].started_vm)
+
+    def _schedule(self):
+        # fetched at most once per pass, as it takes a qubesd call for
+        # every domain
+        free_memory = None
+        fetched = False
+        started_since_fetch = set()
+        while self.queue and len(self.running) < self.max_parallel:
+            vm = self.queue[0]
+            needed = self._needed_memory(vm)
+            if self.running and needed:
+                if not fetched:
+                    free_memory = self._get_free_memory()
+                    fetched = True
+                if free_memory is not None and \
+                        needed + MEMORY_RESERVE > free_memory - \
+                        self._reserved_memory(started_since_fetch):
+                    utils.debug("update of {} waits for free memory".format(
+                        vm.name))
+                    break
+            self.queue.pop(0)
+
+            thread = UpdateQubeThread(vm)
+            thread.status_changed.connect(
+                lambda status, name=vm.name:
+                self.status_changed.emit(name, status))
+            thread.finished.connect(
+                lambda thread=thread: self._thread_finished(thread))
+            self.running[vm.name] = thread
+            self.threads.append(thread)
+            self.reserved_memory[vm.name] = needed
+            if fetched:
+                started_since_fetch.add(vm.name)
+            thread.start()
+
+        if self.is_finished() and self.wall_time is None:
+            self.wall_time = time.monotonic() - self.start_time
+            utils.debug(self.report())
+            self.finished.emit(self.wall_time)
+
+    def _thread_finished(self, thread):
+        name = thread.vm.name
+        del self.running[name]
+        del self.reserved_memory[name]
+
+        success = thread.msg_is_success
+        message = thread.msg[1] if thread.msg else ""
+        self.results[name] = (success, thread.duration, message)
+        self.status_changed.emit(
+            name, self.tr("done") if success else self.tr("failed"))
+        self.vm_finished.emit(name, success, thread.duration, message)
+
+        self._schedule()
+
+    def report(self):
+        lines = []
+        for name, (success, duration, message) in sorted(
+                self.results.items()):
+            line = "{}: {:.1f} s, {}".format(
+                name, duration, "ok" if success else "failed")
+            if message:
+                line += " ({})".format(message)
+            lines.append(line)
+        if self.wall_time is not None:
+            lines.append("total: {} qubes in {:.1f} s".format(
+                len(self.results), self.wall_time))
+        return "\n".join(lines)
+
+
+class UpdateProgressDialog(QtWidgets.QDialog):
+    """Shows qubes being updated by an UpdateOrchestrator"""
+    columns = ['Qube', 'Status', 'Time']
+
+    def __init__(self, vms, parent=None, free_memory=None):
+        super().__init__(parent)
+        self.vms = list(vms)
+        self.free_memory = free_memory
+        self.orchestrator = None
+        self.rows = {}
+        # closed by the user while updating, see reject
+        self.hidden_while_running = False
+
+        self.setWindowTitle(self.tr("Update qubes"))
+        self.setMinimumWidth(500)
+
+        layout = QtWidgets.QVBoxLayout(self)
+
+        limit_layout = QtWidgets.QHBoxLayout()
+        limit_layout.addWidget(QtWidgets.QLabel(
+            self.tr("Qubes updated at the same time:")))
+        self.max_parallel = QtWidgets.QSpinBox()
+        self.max_parallel.setRange(1, 16)
+        self.max_parallel.setValue(int(QtCore.QSettings().value(
+            'updates/max_parallel', DEFAULT_MAX_PARALLEL)))
+        limit_layout.addWidget(self.max_parallel)
+        limit_layout.addStretch()
+        layout.addLayout(limit_layout)
+
+        self.table = QtWidgets.QTableWidget(len(self.vms), len(self.columns))
+        self.table.setHorizontalHeaderLabels(
+            [self.tr('Qube'), self.tr('Status'), self.tr('Time')])
+        self.table.verticalHeader().hide()
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        for row, vm in enumerate(self.vms):
+            self.table.setItem(row, 0, QtWidgets.QTableWidgetItem(vm.name))
+            self.table.setItem(row, 1, QtWidgets.QTableWidgetItem(""))
+            self.table.setItem(row, 2, QtWidgets.QTableWidgetItem(""))
+            self.rows[vm.name] = row
+        self.table.horizontalHeader().setStretchLastSection(True)
+        layout.addWidget(self.table)
+
+        self.summary = QtWidgets.QLabel()
+        layout.addWidget(self.summary)
+
+        self.button_box = QtWidgets.QDialogButtonBox(
+            QtWidgets.QDialogButtonBox.Close)
+        self.start_button = self.button_box.addButton(
+            self.tr("Start"), QtWidgets.QDialogButtonBox.AcceptRole)
+        self.start_button.clicked.connect(self.start)
+        self.button_box.rejected.connect(self.reject)
+        layout.addWidget(self.button_box)
+
+    def start(self):
+        QtCore.QSettings().setValue('updates/max_parallel',
+                                    self.max_parallel.value())
+        self.start_button.setEnabled(False)
+        self.max_parallel.setEnabled(False)
+
+        self.orchestrator = UpdateOrchestrator(
+            self.vms, self.max_parallel.value(), self.free_memory, self)
+        self.orchestrator.status_changed.connect(self.set_status)
+        self.orchestrator.vm_finished.connect(self.vm_finished)
+        self.orchestrator.finished.connect(self.all_finished)
+        self.orchestrator.start()
+
+    def set_status(self, name, status):
+        self.table.item(self.rows[name], 1).setText(status)
+
+    def vm_finished(self, name, success, duration, message):
+        row = self.rows[name]
+        self.table.item(row, 2).setText("{:.0f} s".format(duration))
+        if not success:
+            self.table.item(row, 1).setToolTip(message)
+
+    def all_finished(self, wall_time):
+        failed = [name for name, result in self.orchestrator.results.items()
+                  if not result[0]]
+        summary = self.tr("Updated {} qubes in {:.0f} s.").format(
+            len(self.orchestrator.results) - len(failed), wall_time)
+        if failed:
+            summary += " " + self.tr("Failed: {}").format(", ".join(failed))
+        self.summary.setText(summary)
+        if self.hidden_while_running:
+            # finished only now, so that the dialog is released
+            super().reject()
+
+    @property
+    def threads_list(self):
+        """Update threads, which utils.OpenWindows waits for"""
+        if self.orchestrator is None:
+            return []
+        return self.orchestrator.threads
+
+    def reject(self):
+        if self.orchestrator is not None and \
+                not self.orchestrator.is_finished():
+            # threads keep running in the background, only hide the window
+            self.hidden_while_running = True
+            self.hide()
+            return
+        super().reject()
@@ -21,9 +21,13 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
+import collections
+import concurrent.futures
+import importlib.util
 import itertools
 import os
 import re
+import types
 import qubesadmin
 import traceback
 import asyncio
@@ -34,6 +38,9 @@ from qubesadmin import events
 from qubesadmin import exc
 
 from PyQt5 import QtWidgets, QtCore, QtGui  # pylint: disable=import-error
+from PyQt5 import sip  # pylint: disable=import-error
+
+from . import stall_watchdog
 
 
 # important usage note: which initialize_widget should I use?
@@ -111,6 +118,26 @@ def get_feature(vm, feature_name, default_value):
         return default_value
 
 
+def get_feature_for_vms(vms, feature_name, default_value, max_workers=8):
+    """Fetch a single feature for many qubes at once. Queries are issued
+    concurrently, as each of them is a separate qubesd call.
+    :param vms: iterable of qubes
+    :param feature_name: name of the feature
+    :param default_value: value used if the feature is not set or cannot
+        be read
+    :param max_workers: maximum number of concurrent qubesd calls
+    :return: dict of qube name: feature value
+    """
+    vms = list(vms)
+    if not vms:
+        return {}
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(max_workers, len(vms))) as executor:
+        values = executor.map(
+            lambda vm: get_feature(vm, feature_name, default_value), vms)
+        return {vm.name: value for vm, value in zip(vms, values)}
+
+
 def get_boolean_feature(vm, feature_name):
     """heper function to get a feature converted to a Bool if it does exist.
     Necessary because of the true/false in features being coded as 1/empty
@@ -411,6 +438,220 @@ def debug(*args, **kwargs):
     print(*args, **kwargs)
 
 
+def lazy_import(name):
+    """
+    Returns the module with the given (absolute) name, postponing the actual
+    import until one of its attributes is accessed for the first time. Useful
+    for dialogs that are not needed until the user opens them.
+    :param name: full name of the module, e.g. 'qubesmanager.settings'
+    :return: module object
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    # like import does, so that 'package.module' works as well
+    parent, _, child = name.rpartition('.')
+    if parent:
+        setattr(importlib.import_module(parent), child, module)
+    return module
+
+
+def is_imported(name):
+    """
+    Checks if the module with the given name was already imported (and
+    executed; modules only registered by lazy_import do not count).
+    :param name: full name of the module, e.g. 'qubesmanager.settings'
+    :return: bool
+    """
+    module = sys.modules.get(name)
+    # a module loaded by LazyLoader stays of a subclass until first used
+    # pylint: disable=unidiomatic-typecheck
+    return module is not None and type(module) is types.ModuleType
+
+
+class WindowDispatcher:
+    """Wraps the events dispatcher for a single window, remembering the
+    handlers the window adds, so that they can be removed once the window
+    is closed."""
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+        self.handlers = []
+
+    def add_handler(self, event, handler):
+        self.handlers.append((event, handler))
+        self.dispatcher.add_handler(event, handler)
+
+    def remove_handler(self, event, handler):
+        self.handlers.remove((event, handler))
+        self.dispatcher.remove_handler(event, handler)
+
+    def remove_all_handlers(self):
+        for event, handler in self.handlers:
+            self.dispatcher.remove_handler(event, handler)
+        self.handlers.clear()
+
+    def __getattr__(self, name):
+        return getattr(self.dispatcher, name)
+
+
+class LruCache:
+    """Dict-like cache keeping at most max_size items, dropping the least
+    recently used ones first"""
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self._items = collections.OrderedDict()
+
+    def __getitem__(self, key):
+        value = self._items[key]
+        self._items.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        self._items.clear()
+
+
+class OpenWindows(QtCore.QObject):
+    """Keeps references to open dialogs by key, so that they are not
+    garbage collected; closed dialogs are dropped and deleted as soon as
+    the threads they started (in their threads_list) are finished. Dialogs
+    which only hide while they work must emit finished once done."""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.windows = {}
+        # closed dialogs waiting for their threads
+        self.closing = []
+
+    def add(self, key, window):
+        self.windows[key] = window
+        # no lambda holding the window, that would keep it alive
+        window.finished.connect(self._window_finished)
+        window.destroyed.connect(self._window_destroyed)
+
+    def _window_destroyed(self):
+        # deleted without being finished, e.g. together with its parent
+        for key, window in list(self.windows.items()):
+            if sip.isdeleted(window):
+                del self.windows[key]
+
+    def _window_finished(self):
+        window = self.sender()
+        for key, kept_window in list(self.windows.items()):
+            if kept_window is window:
+                del self.windows[key]
+        running = self._running_threads(window)
+        if not running:
+            window.deleteLater()
+            return
+        # deleting the dialog would destroy its threads as well
+        self.closing.append(window)
+        for thread in running:
+            thread.finished.connect(self._thread_finished)
+
+    @staticmethod
+    def _running_threads(window):
+        return [thread for thread in getattr(window, 'threads_list', [])
+                if thread.isRunning()]
+
+    def _thread_finished(self):
+        # finished is emitted just before the thread really ends
+        self.sender().wait()
+        for window in list(self.closing):
+            if not self._running_threads(window):
+                self.closing.remove(window)
+                window.deleteLater()
+
+    def __contains__(self, key):
+        return key in self.windows
+
+    def __getitem__(self, key):
+        return self.windows[key]
+
+    def __len__(self):
+        return len(self.windows)
+
+
+class BufferedSettings(QtCore.QObject):
+    """Wraps QSettings, keeping written values in memory and writing them
+    out together: shortly after the last change, at least every max_delay
+    while changes keep coming (so that little is lost if the program
+    crashes) and when the application quits. Values equal to those already
+    written are not written again."""
+    # pylint: disable=invalid-name
+    def __init__(self, settings, delay=1000, max_delay=10000, parent=None):
+        """
+        :param settings: QSettings to write to
+        :param delay: time (in ms) since the last change to wait for more
+        :param max_delay: maximum time (in ms) a change waits to be written
+        """
+        super().__init__(parent)
+        self.settings = settings
+        self.pending = {}
+        self.written = {}
+        # number of values written to settings, for debugging
+        self.write_count = 0
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay)
+        self.timer.timeout.connect(self.flush)
+        self.max_timer = QtCore.QTimer(self)
+        self.max_timer.setSingleShot(True)
+        self.max_timer.setInterval(max_delay)
+        self.max_timer.timeout.connect(self.flush)
+
+        app = QtCore.QCoreApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(self.flush)
+
+    def setValue(self, key, value):
+        if key not in self.pending and self.written.get(key) == value:
+            return
+        self.pending[key] = value
+        self.timer.start()
+        if not self.max_timer.isActive():
+            self.max_timer.start()
+
+    def value(self, key, defaultValue=None, **kwargs):
+        if key in self.pending:
+            # read back through QSettings, for the same types as usual
+            self.flush()
+        return self.settings.value(key, defaultValue, **kwargs)
+
+    def flush(self):
+        """Writes all pending values"""
+        self.timer.stop()
+        self.max_timer.stop()
+        if not self.pending:
+            return
+        for key, value in self.pending.items():
+            self.settings.setValue(key, value)
+        self.settings.sync()
+        self.write_count += len(self.pending)
+        self.written.update(self.pending)
+        self.pending.clear()
+
+    def __getattr__(self, name):
+        return getattr(self.settings, name)
+
+
 def get_path_from_vm(vm, service_name):
     """
     Displays a file/directory selection window for the given VM.
@@ -518,6 +759,7 @@ def run_asynchronous(window_class):
     asyncio.set_event_loop(loop)
     dispatcher = events.EventsDispatcher(qubes_app)
 
+    watchdog = stall_watchdog.start_from_env(qt_app)
     window = window_class(qt_app, qubes_app, dispatcher)
 
     if hasattr(window, "setup_application"):
@@ -534,6 +776,8 @@ def run_asynchronous(window_class):
         loop_shutdown()
         exc_type, exc_value, exc_traceback = sys.exc_info()[:3]
         handle_exception(exc_type, exc_value, exc_traceback)
+    finally:
+        stall_watchdog.stop_and_report(watchdog)
 
 
 def run_synchronous(window_class):
@@ -555,6 +799,7 @@ def run_synchronous(window_class):
 
     qubes_app = qubesadmin.Qubes()
 
+    watchdog = stall_watchdog.start_from_env(qt_app)
     window = window_class(qt_app, qubes_app)
 
     if hasattr(window, "setup_application"):
@@ -564,5 +809,6 @@ def run_synchronous(window_class):
 
     qt_app.exec_()
     qt_app.exit()
+    stall_watchdog.stop_and_report(watchdog)
 
     return window
@@ -0,0 +1,270 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# Copyright (C) 2012  Agnieszka Kostrzewa <agnieszka.kostrzewa@gmail.com>
+# Copyright (C) 2012  Marek Marczykowski-Górecki
+#                       <marmarek@invisiblethingslab.com>
+# Copyright (C) 2017  Wojtek Porczyk <woju@invisiblethingslab.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+#
+"""Data of a qube shown in a row of the Qube Manager table."""
+
+import sys
+from datetime import datetime
+
+from qubesadmin import exc
+
+from . import utils as manager_utils
+
+
+def _intern(value):
+    """Intern strings repeated across many rows (template and netvm names
+    and the like), so that all rows share a single copy."""
+    if value is None:
+        return None
+    return sys.intern(str(value))
+
+
+class VmState:
+    """Power and outdated state of a qube. Both are stored as small integer
+    codes; item access with 'power' and 'outdated' keys returns the
+    corresponding strings, as for the dict used previously."""
+    __slots__ = ('power_code', 'outdated_code')
+
+    power_states = ("", "Running", "Transient", "Halting", "Paused",
+                    "Suspended", "Dying", "Crashed", "Halted", "NA")
+    outdated_states = ("", "update", "outdated", "to-be-outdated")
+
+    _codes = {
+        'power': {state: code for code, state in enumerate(power_states)},
+        'outdated': {state: code
+                     for code, state in enumerate(outdated_states)},
+    }
+
+    def __init__(self):
+        self.power_code = 0
+        self.outdated_code = 0
+
+    def __getitem__(self, key):
+        if key == 'power':
+            return self.power_states[self.power_code]
+        if key == 'outdated':
+            return self.outdated_states[self.outdated_code]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        try:
+            code = self._codes[key].get(value or "")
+        except KeyError:
+            raise KeyError(key) from None
+        if code is None:
+            raise ValueError("Unknown {} state: {}".format(key, value))
+        if key == 'power':
+            self.power_code = code
+        else:
+            self.outdated_code = code
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __eq__(self, other):
+        if isinstance(other, VmState):
+            return (self.power_code, self.outdated_code) == \
+                (other.power_code, other.outdated_code)
+        if isinstance(other, dict):
+            return other == {'power': self['power'],
+                             'outdated': self['outdated']}
+        return NotImplemented
+
+    def __repr__(self):
+        return "VmState(power={!r}, outdated={!r})".format(
+            self['power'], self['outdated'])
+
+
+# pylint: disable=too-many-instance-attributes
+# pylint: disable=too-few-public-methods
+class VmInfo():
+    __slots__ = ('vm', 'qid', 'name', 'label', 'klass', 'icon', 'state',
+                 'updateable', 'updates_available', 'template', 'netvm',
+                 'internal', 'ip', 'inc_backup', 'last_backup', 'dvm',
+                 'dvm_template', 'disk_float', 'disk', 'virt_mode',
+                 'provides_network', 'loaded')
+
+    def __init__(self, vm, updates_available=None):
+        self.loaded = True
+        self.vm = vm
+        self.qid = vm.qid
+        self.name = self.vm.name
+
+        self.label = getattr(self.vm, 'label', None)
+        self.klass = _intern(getattr(self.vm, 'klass', None))
+        self.icon = _intern(getattr(vm, 'icon', 'appvm-black'))
+
+        self.state = VmState()
+        self.updateable = getattr(vm, 'updateable', False)
+        self.disk_float = None
+        self.disk = None
+
+        # updates-available is prefetched in bulk by the cache and then kept
+        # up to date by the domain-feature-*:updates-available events
+        if updates_available is None:
+            updates_available = self.klass in \
+                {'TemplateVM', 'StandaloneVM'} and \
+                manager_utils.get_feature(vm, 'updates-available', False)
+        self.updates_available = bool(updates_available)
+
+        self.update(True)
+
+    @classmethod
+    def placeholder(cls, vm):
+        """
+        Returns VmInfo of a domain that is still being loaded: only its name
+        and class, which come from the domain list without further qubesd
+        calls, are known.
+        """
+        vm_info = cls.__new__(cls)
+        vm_info.loaded = False
+        vm_info.vm = vm
+        vm_info.qid = None
+        vm_info.name = vm.name
+        vm_info.klass = _intern(getattr(vm, 'klass', None))
+        vm_info.label = None
+        vm_info.icon = None
+        vm_info.state = VmState()
+        vm_info.updateable = False
+        vm_info.updates_available = False
+        for attr in ('template', 'netvm', 'internal', 'ip', 'inc_backup',
+                     'last_backup', 'dvm', 'dvm_template', 'disk_float',
+                     'disk', 'virt_mode', 'provides_network'):
+            setattr(vm_info, attr, None)
+        return vm_info
+
+    def set_updates_available(self, updates_available):
+        self.updates_available = bool(updates_available)
+        self.update_power_state()
+
+    def update_power_state(self):
+        try:
+            power = self.vm.get_power_state()
+        except exc.QubesDaemonAccessError:
+            power = ""
+        try:
+            self.state['power'] = power
+        except ValueError:
+            self.state['power'] = "NA"
+
+        self.state['outdated'] = ""
+        try:
+            if manager_utils.is_running(self.vm, False):
+                if hasattr(self.vm, 'template') and \
+                        manager_utils.is_running(self.vm.template, False):
+                    self.state['outdated'] = "to-be-outdated"
+                else:
+                    try:
+                        if any(vol.is_outdated()
+                               for vol in self.vm.volumes.values()):
+                            self.state['outdated'] = "outdated"
+                    except exc.QubesDaemonAccessError:
+                        pass
+
+        except exc.QubesDaemonAccessError:
+            pass
+
+        if self.updates_available:
+            self.state['outdated'] = 'update'
+
+    def update(self, update_size_on_disk=False, event=None):
+        """
+        Update VmInfo
+        :param update_size_on_disk: should disk utilization be updated?
+        :param event: name of the event that caused the update, to avoid
+        updating unnecessary properties; if event is none, update everything
+        :return: None
+        """
+        self.update_power_state()
+
+        if not event or event.endswith(':label'):
+            self.label = getattr(self.vm, 'label', None)
+            self.icon = _intern(getattr(self.vm, 'icon', 'appvm-black'))
+
+        if not event or event.endswith(':template'):
+            try:
+                self.template = _intern(self.vm.template.name)
+            except AttributeError:
+                self.template = None
+
+        if not event or event.endswith(':netvm'):
+            netvm = getattr(self.vm, 'netvm', None)
+            if netvm:
+                netvm = str(netvm)
+            else:
+                netvm = "n/a"
+            try:
+                if hasattr(self.vm, 'netvm') \
+                        and self.vm.property_is_default("netvm"):
+                    netvm = "default (" + netvm + ")"
+            except exc.QubesDaemonAccessError:
+                pass
+            self.netvm = _intern(netvm)
+
+        if not event or event.endswith(':internal'):
+            self.internal = manager_utils.get_boolean_feature(
+                self.vm, 'internal')
+
+        if not event or event.endswith(':ip'):
+            self.ip = getattr(self.vm, 'ip', "n/a")
+
+        if not event or event.endswith(':include_in_backups'):
+            self.inc_backup = getattr(self.vm, 'include_in_backups', None)
+
+        if not event or event.endswith(':backup_timestamp'):
+            self.last_backup = getattr(self.vm, 'backup_timestamp', None)
+            if self.last_backup:
+                self.last_backup = str(datetime.fromtimestamp(self.last_backup))
+
+        if not event or event.endswith(':default_dispvm'):
+            dvm = getattr(self.vm, 'default_dispvm', None)
+            try:
+                if self.vm.property_is_default("default_dispvm"):
+                    dvm = "default (" + str(dvm) + ")"
+            except exc.QubesDaemonAccessError:
+                pass
+            self.dvm = _intern(dvm)
+
+        if not event or event.endswith(':template_for_dispvms'):
+            self.dvm_template = getattr(self.vm, 'template_for_dispvms', None)
+
+        if not event or event.endswith(':provides_network'):
+            self.provides_network = getattr(self.vm, 'provides_network',
+                                            False)
+
+        if self.vm.klass != 'AdminVM' and update_size_on_disk:
+            try:
+                self.disk_float = float(self.vm.get_disk_utilization())
+                self.disk = str(round(self.disk_float/(1024*1024), 2)) + " MiB"
+            except exc.QubesDaemonAccessError:
+                self.disk_float = None
+                self.disk = None
+
+        if self.vm.klass != 'AdminVM':
+            self.virt_mode = _intern(getattr(self.vm, 'virt_mode', None))
+        else:
+            self.virt_mode = None
+            self.disk = "n/a"
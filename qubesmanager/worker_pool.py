@@ -0,0 +1,202 @@
+#!/usr/bin/python3
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+#
+"""Disposables the fancy manager downloads in, kept between installations.
+
+The worker disposables are named disposables of one disposable template
+(a clone of the default disposable template with a bigger private volume),
+both created the first time they are needed. An installation leases an idle
+worker, preferring a running one, so that it only has to download; workers
+are checked before use and recreated or restarted when broken, and shut
+down (which also discards their state) after being idle for a while. When
+all workers are busy, a temporary one is created and removed afterwards.
+"""
+
+import shlex
+
+from PyQt5 import QtCore  # pylint: disable=import-error
+
+from qubesadmin import exc
+
+from .step_runner import FAILED_ENV
+
+WORKER_PREFIX = 'fancy-worker-'
+DISPOSABLE_TEMPLATE = 'fancy-worker-dvm'
+PRIVATE_SIZE = '10GiB'
+
+# settings keys and their defaults
+POOL_SIZE_KEY = 'fancy/pool_size'
+DEFAULT_POOL_SIZE = 2
+IDLE_TIMEOUT_KEY = 'fancy/pool_idle_timeout'
+DEFAULT_IDLE_TIMEOUT = 600  # seconds
+# a worker not answering within this time (in seconds) is restarted
+PROBE_TIMEOUT = 60
+
+
+class WorkerPool(QtCore.QObject):
+    """Leases worker disposables to installations, see the module
+    documentation"""
+    def __init__(self, qubes_app=None, settings=None, parent=None):
+        """
+        :param qubes_app: Qubes app; without it, workers are not shut down
+            when idle
+        :param settings: QSettings (or anything with its value method) to
+            read pool size and idle timeout from
+        """
+        super().__init__(parent)
+        self.qubes_app = qubes_app
+        self.settings = settings if settings is not None else \
+            QtCore.QSettings()
+        # run id: name of the worker leased to it
+        self.leases = {}
+        self.temporary = set()
+
+        self.idle_timer = QtCore.QTimer(self)
+        self.idle_timer.setSingleShot(True)
+        self.idle_timer.timeout.connect(self.shutdown_idle)
+
+    def _int_setting(self, key, default):
+        try:
+            return int(self.settings.value(key, default))
+        except (TypeError, ValueError):
+            return default
+
+    @property
+    def size(self):
+        return max(1, self._int_setting(POOL_SIZE_KEY, DEFAULT_POOL_SIZE))
+
+    @property
+    def idle_timeout(self):
+        return self._int_setting(IDLE_TIMEOUT_KEY, DEFAULT_IDLE_TIMEOUT)
+
+    def worker_names(self):
+        return [WORKER_PREFIX + str(number)
+                for number in range(1, self.size + 1)]
+
+    def _is_running(self, name):
+        if self.qubes_app is None:
+            return False
+        try:
+            return self.qubes_app.domains[name].is_running()
+        except (KeyError, exc.QubesException):
+            return False
+
+    def acquire(self, run_id, name=None):
+        """Leases a worker to the run, returns its name; when resuming a run,
+        the worker it used before is given (None if it is busy)"""
+        self.idle_timer.stop()
+        busy = set(self.leases.values())
+        if name is not None:
+            if name in busy:
+                return None
+            if name not in self.worker_names():
+                self.temporary.add(name)
+            self.leases[run_id] = name
+            return name
+        idle = [name for name in self.worker_names() if name not in busy]
+        if idle:
+            # a running worker has no start up to wait for
+            name = next((name for name in idle if self._is_running(name)),
+                        idle[0])
+        else:
+            # qube names are at most 31 characters long
+            name = WORKER_PREFIX + run_id[-10:]
+            self.temporary.add(name)
+        self.leases[run_id] = name
+        return name
+
+    def release(self, run_id):
+        """Ends the lease of the run (if any); the workers are shut down
+        when no run leases one for idle_timeout"""
+        name = self.leases.pop(run_id, None)
+        self.temporary.discard(name)
+        if not self.leases and self.idle_timeout > 0:
+            self.idle_timer.start(self.idle_timeout * 1000)
+
+    def shutdown_idle(self):
+        """Shuts down running workers not leased to any run"""
+        if self.qubes_app is None:
+            return
+        busy = set(self.leases.values())
+        for vm in list(self.qubes_app.domains):
+            if not vm.name.startswith(WORKER_PREFIX) or \
+                    vm.name == DISPOSABLE_TEMPLATE or vm.name in busy:
+                continue
+            try:
+                if vm.is_running():
+                    vm.shutdown()
+            except exc.QubesException:
+                # it is shut down the next time, or when it is used again
+                pass
+
+    @staticmethod
+    def setup_script(name, default_dispvm):
+        """Returns a shell script creating (if needed), checking and starting
+        the worker"""
+        dvm = DISPOSABLE_TEMPLATE
+        quoted_name = shlex.quote(name)
+        return f"""
+        # disposable template of the workers, created once
+        if ! qvm-check --quiet {dvm}; then
+            qvm-clone {shlex.quote(str(default_dispvm))} {dvm}
+            qvm-volume extend {dvm}:private {PRIVATE_SIZE} || true
+            qvm-prefs {dvm} template_for_dispvms True
+        fi
+
+        # a missing or broken worker is created again
+        if ! qvm-check --quiet {quoted_name} || \\
+                [ "$(qvm-prefs {quoted_name} template)" != {dvm} ]; then
+            qvm-remove -f {quoted_name} 2>/dev/null || true
+            qvm-create --disp --template {dvm} --label gray {quoted_name}
+        fi
+        qvm-start --skip-if-running {quoted_name}
+
+        # a worker which does not answer is restarted
+        if ! timeout {PROBE_TIMEOUT} qvm-run -p {quoted_name} true; then
+            echo "worker {name} does not answer, restarting it"
+            qvm-kill {quoted_name} || true
+            qvm-start {quoted_name}
+        fi
+        """
+
+    @staticmethod
+    def check_script(name):
+        """Returns a shell condition true if the worker is ready"""
+        return f"qvm-check --running --quiet {shlex.quote(name)}"
+
+    def cleanup_script(self, name, paths):
+        """Returns a shell script removing the files of the run from the
+        worker (or the whole worker, if it is a temporary one); after a
+        failure, the files are kept for resuming the run. A worker the run
+        did not use (e.g. the file was cached) is left alone."""
+        quoted_name = shlex.quote(name)
+        if name in self.temporary:
+            return f"""
+        if qvm-check --quiet {quoted_name}; then
+            qvm-shutdown --wait {quoted_name}
+            qvm-remove -f {quoted_name}
+        fi
+        """
+        # a disposable which is not running has no files left
+        return f"""
+        if [ "${FAILED_ENV}" != 1 ] && \\
+                qvm-check --running --quiet {quoted_name}; then
+            qvm-run -p {quoted_name} {shlex.quote(
+                'rm -rf ' + ' '.join(shlex.quote(path) for path in paths))} || true
+        fi
+        """
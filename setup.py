@@ -14,20 +14,21 @@ if __name__ == '__main__':
         url='https://www.qubes-os.org/',
         packages=setuptools.find_packages(),
         package_data={
-            'qubesmanager': ['i18n/*', '*.css']
+            'qubesmanager': ['i18n/*', '*.css', 'installation_icons/*.png']
         },
         entry_points={
             'console_scripts': [
-                'qubes-global-settings = qubesmanager.global_settings:main',
-                'qubes-vm-settings = qubesmanager.settings:main',
-                'qubes-vm-create = qubesmanager.create_new_vm:main',
-                'qubes-vm-clone = qubesmanager.clone_vm:main',
+                'qubes-global-settings = qubesmanager.app_client:global_settings',
+                'qubes-vm-settings = qubesmanager.app_client:vm_settings',
+                'qubes-vm-create = qubesmanager.app_client:vm_create',
+                'qubes-vm-clone = qubesmanager.app_client:vm_clone',
                 'qubes-vm-boot-from-device = qubesmanager.bootfromdevice:main',
-                'qubes-backup = qubesmanager.backup:main',
-                'qubes-backup-restore = qubesmanager.restore:main',
-                'qubes-qube-manager = qubesmanager.qube_manager:main',
+                'qubes-backup = qubesmanager.app_client:backup',
+                'qubes-backup-restore = qubesmanager.app_client:restore',
+                'qubes-qube-manager = qubesmanager.app_client:qube_manager',
                 'qubes-log-viewer = qubesmanager.log_dialog:main',
-                'qubes-template-manager = qubesmanager.template_manager:main',
-                'qvm-template-gui = qubesmanager.qvm_template_gui:main'
+                'qubes-template-manager = qubesmanager.app_client:template_manager',
+                'qvm-template-gui = qubesmanager.qvm_template_gui:main',
+                'qubes-manager-service = qubesmanager.app_server:main'
             ],
         })